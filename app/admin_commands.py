@@ -0,0 +1,78 @@
+import os
+from datetime import datetime
+
+from aiogram import F, Router, types
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Update
+from broadcast import BroadcastManager
+from jobs import JobRunner
+
+# Telegram ID администраторов бота через запятую
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '').split(',') if admin_id.strip()}
+# Команды роутера ниже
+ADMIN_COMMANDS = ('jobs', 'broadcast', 'broadcast_status')
+
+router = Router()
+router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+
+
+def is_admin_command(update: Update) -> bool:
+    """Команда администратора из ADMIN_COMMANDS.
+
+    При WORKERS > 1 такие команды выполняет фронт: фоновые задачи и рассылки
+    работают только в нём (см. main.py).
+    """
+    message = update.message
+    if message is None or message.from_user is None or message.from_user.id not in ADMIN_IDS:
+        return False
+    words = (message.text or '').split(maxsplit=1)
+    return bool(words) and words[0].startswith('/') and words[0][1:].split('@', 1)[0] in ADMIN_COMMANDS
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%d.%m %H:%M:%S') if timestamp else '—'
+
+
+# Состояние фоновых задач: число запусков, ошибки, пропуски и длительность последнего запуска
+@router.message(Command('jobs'))
+async def cmd_jobs(message: types.Message, job_runner: JobRunner):
+    lines = []
+    for name, stats in job_runner.stats().items():
+        duration = f"{stats['last_duration']:.2f} с" if stats['last_duration'] is not None else '—'
+        lines.append(f"{name}{' (выполняется)' if stats['running'] else ''}\n"
+                     f"  запусков: {stats['runs']}, ошибок: {stats['failures']}, пропусков: {stats['skipped']}\n"
+                     f"  последний: {_format_time(stats['last_started'])}, {duration}\n"
+                     f"  следующий: {stats['next_run_time'] or '—'}")
+        if stats['last_error']:
+            lines.append(f"  ошибка: {stats['last_error']}")
+    await message.answer("\n".join(lines) or "Фоновые задачи не запущены.")
+
+
+# Рассылка сообщения всем зарегистрированным пользователям: /broadcast <текст>
+@router.message(Command('broadcast'))
+async def cmd_broadcast(message: types.Message, command: CommandObject, broadcast_manager: BroadcastManager):
+    text = (command.args or '').strip()
+    if not text:
+        await message.answer("Использование: /broadcast <текст сообщения>")
+        return
+    broadcast_id = await broadcast_manager.create(text, message.from_user.id)
+    await message.answer(f"Рассылка #{broadcast_id} запущена, по окончании придёт отчёт. "
+                         f"Прогресс: /broadcast_status {broadcast_id}")
+
+
+# Прогресс рассылки: /broadcast_status <id>
+@router.message(Command('broadcast_status'))
+async def cmd_broadcast_status(message: types.Message, command: CommandObject, broadcast_manager: BroadcastManager):
+    try:
+        broadcast_id = int((command.args or '').strip())
+    except ValueError:
+        await message.answer("Использование: /broadcast_status <номер рассылки>")
+        return
+    progress = await broadcast_manager.progress(broadcast_id)
+    if progress is None:
+        await message.answer(f"Рассылка #{broadcast_id} не найдена.")
+        return
+    await message.answer(f"Рассылка #{broadcast_id}: {progress['status']}"
+                         f"{' (идёт отправка)' if progress['running'] else ''}\n"
+                         f"отправлено: {progress.get('sent', 0)}, ошибок: {progress.get('failed', 0)}, "
+                         f"заблокировали бота: {progress.get('blocked', 0)}")
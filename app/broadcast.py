@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import AsyncIterable, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from request_scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CHAT_RATE = float(os.getenv('BROADCAST_CHAT_RATE', '1'))
+# Число одновременных запросов к Telegram при рассылке
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+# Сколько раз переотправлять сообщение после RetryAfter
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+# Получателей в одной странице выборки
+BROADCAST_PAGE_SIZE = 500
+# Сколько корзин токенов отдельных чатов хранить в памяти
+CHAT_BUCKETS_LIMIT = 10000
+
+SENT, FAILED, BLOCKED = 'sent', 'failed', 'blocked'
+
+
+class Delivery(NamedTuple):
+    """Одно сообщение рассылки."""
+    clockify_userid: str
+    chat_id: int
+    text: str
+
+
+class FanOut:
+    """Отправка множества сообщений с учётом ограничений Telegram.
+
+    Сообщения проходят через общую корзину токенов бота и корзину своего чата,
+    одновременно выполняется не больше concurrency запросов. При RetryAfter
+    общая корзина блокируется на указанное время, а сообщение отправляется заново.
+    Один экземпляр на бота: напоминания и рассылки делят общий лимит.
+    """
+
+    def __init__(self, bot: Bot, rate: float = BROADCAST_RATE, chat_rate: float = BROADCAST_CHAT_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY, max_retries: int = BROADCAST_MAX_RETRIES):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate)
+        self._chat_buckets: 'OrderedDict[int, TokenBucket]' = OrderedDict()
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, capacity=1)
+            if len(self._chat_buckets) > CHAT_BUCKETS_LIMIT:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def send(self, delivery: Delivery) -> str:
+        """Отправка одного сообщения. Возвращает sent, failed или blocked."""
+        attempt = 0
+        while True:
+            await self._chat_bucket(delivery.chat_id).acquire()
+            await self._bucket.acquire()
+            try:
+                await self.bot.send_message(delivery.chat_id, delivery.text)
+                self.sent += 1
+                return SENT
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    return FAILED
+                attempt += 1
+                self.retries += 1
+                self._bucket.block_for(e.retry_after)
+            except TelegramForbiddenError:
+                self.blocked += 1
+                return BLOCKED
+            except TelegramBadRequest as e:
+                logger.warning("Failed to send message to %s: %s", delivery.chat_id, e)
+                self.failed += 1
+                return FAILED
+            except Exception as e:
+                logger.warning("Failed to send message to %s: %s", delivery.chat_id, e)
+                self.failed += 1
+                return FAILED
+
+    async def send_all(self, deliveries: AsyncIterable[Delivery],
+                       on_result: Optional[Callable[[Delivery, str], Awaitable[None]]] = None) -> Dict[str, float]:
+        """Отправка потока сообщений. Получатели читаются по мере отправки, а не заранее."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        result = {SENT: 0, FAILED: 0, BLOCKED: 0}
+        started = time.monotonic()
+
+        async def worker():
+            while True:
+                delivery = await queue.get()
+                if delivery is None:
+                    return
+                status = await self.send(delivery)
+                result[status] += 1
+                if on_result is not None:
+                    try:
+                        await on_result(delivery, status)
+                    except Exception as e:
+                        logger.warning("Failed to record delivery to %s: %s", delivery.chat_id, e)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            async for delivery in deliveries:
+                await queue.put(delivery)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        elapsed = time.monotonic() - started
+        total = sum(result.values())
+        return {**result, 'elapsed': elapsed, 'per_second': total / elapsed if elapsed else 0.0}
+
+    def stats(self) -> Dict[str, int]:
+        return {'sent': self.sent, 'failed': self.failed, 'blocked': self.blocked, 'retries': self.retries,
+                'chat_buckets': len(self._chat_buckets)}
+
+
+def format_result(broadcast_id: int, result: Dict[str, float]) -> str:
+    return (f"Рассылка #{broadcast_id} завершена: отправлено {result[SENT]}, "
+            f"ошибок {result[FAILED]}, заблокировали бота {result[BLOCKED]}.\n"
+            f"Время: {result['elapsed']:.1f} с, {result['per_second']:.1f} сообщений в секунду.")
+
+
+class BroadcastManager:
+    """Рассылки всем зарегистрированным пользователям.
+
+    Результат каждой доставки сохраняется в broadcast_deliveries сразу после
+    отправки, поэтому рассылка, прерванная перезапуском бота, продолжается
+    с того же места. Повторно после перезапуска могут прийти только сообщения,
+    которые отправлялись в момент остановки (не больше BROADCAST_CONCURRENCY).
+    По окончании автор получает отчёт с числом доставленных сообщений и скоростью отправки.
+    """
+
+    def __init__(self, fanout: FanOut, repository):
+        self.fanout = fanout
+        self.repo = repository
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def _recipients(self, broadcast_id: int, text: str):
+        after = ''
+        while True:
+            page = await self.repo.get_broadcast_recipients(broadcast_id, after, BROADCAST_PAGE_SIZE)
+            for clockify_userid, chat_id in page:
+                yield Delivery(clockify_userid, chat_id, text)
+            if len(page) < BROADCAST_PAGE_SIZE:
+                return
+            after = page[-1][0]
+
+    async def run(self, broadcast_id: int) -> Dict[str, float]:
+        broadcast = await self.repo.get_broadcast(broadcast_id)
+
+        async def on_result(delivery: Delivery, status: str):
+            await self.repo.add_broadcast_deliveries(broadcast_id, [(delivery.clockify_userid, status)])
+            if status == BLOCKED:
+                await self.repo.set_reminders_enabled(delivery.clockify_userid, False)
+
+        result = await self.fanout.send_all(self._recipients(broadcast_id, broadcast.text), on_result)
+        await self.repo.finish_broadcast(broadcast_id, 'done', time.time())
+        logger.info("Broadcast %s finished: %s", broadcast_id, result)
+        return result
+
+    async def _report(self, broadcast_id: int, result: Dict[str, float]) -> None:
+        """Отчёт о завершённой рассылке её автору."""
+        broadcast = await self.repo.get_broadcast(broadcast_id)
+        if broadcast is not None and broadcast.created_by:
+            # Итоги берутся из базы: после перезапуска рассылка могла пройти в несколько заходов
+            totals = {SENT: 0, FAILED: 0, BLOCKED: 0, **await self.repo.get_broadcast_counts(broadcast_id)}
+            await self.fanout.bot.send_message(broadcast.created_by, format_result(broadcast_id, {**result, **totals}))
+
+    def start(self, broadcast_id: int) -> None:
+        async def run():
+            try:
+                await self._report(broadcast_id, await self.run(broadcast_id))
+            except Exception as e:
+                logger.exception("Broadcast %s failed: %s", broadcast_id, e)
+            finally:
+                self._tasks.pop(broadcast_id, None)
+
+        self._tasks[broadcast_id] = asyncio.create_task(run())
+
+    async def create(self, text: str, created_by: Optional[int] = None) -> int:
+        broadcast_id = await self.repo.create_broadcast(text, created_by, time.time())
+        self.start(broadcast_id)
+        return broadcast_id
+
+    async def resume(self) -> int:
+        """Продолжение рассылок, прерванных остановкой бота."""
+        broadcast_ids = await self.repo.get_running_broadcast_ids()
+        for broadcast_id in broadcast_ids:
+            if broadcast_id not in self._tasks:
+                self.start(broadcast_id)
+        return len(broadcast_ids)
+
+    async def progress(self, broadcast_id: int) -> Optional[Dict]:
+        broadcast = await self.repo.get_broadcast(broadcast_id)
+        if broadcast is None:
+            return None
+        counts = await self.repo.get_broadcast_counts(broadcast_id)
+        return {'status': broadcast.status, 'running': broadcast_id in self._tasks, **counts}
+
+    async def close(self) -> None:
+        # Прогресс уже сохранён; незавершённые рассылки продолжатся при следующем запуске
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
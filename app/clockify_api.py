@@ -1,23 +1,40 @@
 import os
-import requests
-from dotenv import load_dotenv
-from utils import get_current_time_in_moscow
-from db.engine import create_connection
-from db.methods import get_user_by_tg_username, user_exists, add_user
-from typing import Optional, List, Dict, Any
+import asyncio
+import logging
+import time
+import aiohttp
+from time_conversion import aware_to_clockify, now_local, timezone_name, user_timezone
+from project_cache import ProjectCache
+from request_scheduler import RequestScheduler
+from request_coalescer import RequestCoalescer
+from outbox import CREATE, END, START, Outbox
+from entry_import import ImportFailure, ImportResult, ImportRow
+from db.engine import TG_USERNAME_PLACEHOLDER
+from metrics import CLOCKIFY_REQUEST_SECONDS, endpoint_label
+from typing import Optional, List, Dict, Any, Iterable, Iterator, AsyncIterator, Union
 
-# Загрузка API-ключа из файла .env
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Адрес Clockify API (для тестов и бенчмарков можно указать локальный сервер)
+CLOCKIFY_API_URL = os.getenv('CLOCKIFY_API_URL', 'https://api.clockify.me/api/v1').rstrip('/')
+# Размер страницы для постраничной выгрузки пользователей и проектов
+CLOCKIFY_PAGE_SIZE = int(os.getenv('CLOCKIFY_PAGE_SIZE', '200'))
+# Число одновременных запросов при массовом импорте записей времени
+IMPORT_CONCURRENCY = int(os.getenv('IMPORT_CONCURRENCY', '10'))
+# Наибольшая доля известных пользователей, которую синхронизация может удалить за раз
+USER_SYNC_MAX_REMOVE_SHARE = float(os.getenv('USER_SYNC_MAX_REMOVE_SHARE', '0.1'))
 
 class ClockifyAPI:
     def __init__(self):
         self.api_key: str = os.getenv('CLOCKIFY_API_KEY')
         self.workspace_id: str = os.getenv('WORKSPACE_ID')
-        self.base_url: str = f'https://api.clockify.me/api/v1/workspaces/{self.workspace_id}'
+        self.base_url: str = f'{CLOCKIFY_API_URL}/workspaces/{self.workspace_id}'
         self.headers: Dict[str, str] = {'X-Api-Key': self.api_key}
 
     def _make_request(self, method: str, endpoint: str, **kwargs: Any) -> Optional[Dict]:
         """Унифицированный метод для выполнения запросов к Clockify API с отладкой."""
+        # Синхронный клиент нужен только скриптам: бот не платит за импорт requests при старте
+        import requests
         url: str = f'{self.base_url}/{endpoint}'
         try:
             if 'headers' not in kwargs.keys():
@@ -29,16 +46,36 @@ class ClockifyAPI:
             else:
                 raise requests.exceptions.HTTPError(f"Error {response.status_code}: {response.text}", response=response)
         except requests.exceptions.RequestException as e:
-            print(f"Request failed: {str(e)}")
+            logger.warning("Request failed: %s", e)
             raise
 
+    def _iter_pages(self, endpoint: str, page_size: Optional[int] = None) -> Iterator[List[Dict]]:
+        """Постраничная выгрузка списка: страницы запрашиваются по мере чтения."""
+        page_size = page_size or CLOCKIFY_PAGE_SIZE
+        page = 1
+        while True:
+            items = self._make_request('GET', endpoint, params={'page': page, 'page-size': page_size}) or []
+            if items:
+                yield items
+            if len(items) < page_size:
+                return
+            page += 1
+
+    def iter_workspace_users(self, page_size: Optional[int] = None) -> Iterator[List[Dict]]:
+        """Постраничная выгрузка пользователей рабочего пространства."""
+        return self._iter_pages('users', page_size)
+
+    def iter_all_projects(self, page_size: Optional[int] = None) -> Iterator[List[Dict]]:
+        """Постраничная выгрузка проектов рабочего пространства."""
+        return self._iter_pages('projects', page_size)
+
     def get_workspace_users(self) -> Optional[List[Dict]]:
         """Получение списка пользователей рабочего пространства."""
-        return self._make_request('GET', 'users')
+        return [user for page in self.iter_workspace_users() for user in page]
 
     def get_all_projects(self) -> Optional[List[Dict]]:
         """Получение списка всех проектов рабочего пространства."""
-        return self._make_request('GET', 'projects')
+        return [project for page in self.iter_all_projects() for project in page]
 
     def get_project_id_by_name(self, project_name: str) -> Optional[str]:
         """Получение ID проекта по его имени."""
@@ -47,7 +84,7 @@ class ClockifyAPI:
             for project in projects:
                 if project['name'] == project_name:
                     return project['id']
-        print(f"Project {project_name} not found.")
+        logger.info("Project %s not found.", project_name)
         return None
 
     def create_time_entry(self, user_api_key: str, clockify_userid: str, start_time: str, 
@@ -84,93 +121,482 @@ class ClockifyAPI:
         return self._make_request('PATCH', url, json=body, headers=headers)
 
 
+class AsyncClockifyAPI:
+    """Асинхронный клиент Clockify API с общим пулом соединений (keep-alive).
+
+    Повторяет набор методов ClockifyAPI, но не блокирует цикл событий бота.
+    """
+
+    def __init__(self, pool_size: int = 100, timeout: float = 30.0, scheduler: Optional[RequestScheduler] = None,
+                 coalescer: Optional[RequestCoalescer] = None):
+        self.api_key: str = os.getenv('CLOCKIFY_API_KEY')
+        self.workspace_id: str = os.getenv('WORKSPACE_ID')
+        self.base_url: str = f'{CLOCKIFY_API_URL}/workspaces/{self.workspace_id}'
+        self.headers: Dict[str, str] = {'X-Api-Key': self.api_key}
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        self.project_cache = ProjectCache(self.get_all_projects)
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.coalescer = coalescer if coalescer is not None else RequestCoalescer()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Ленивое создание общей сессии: одна на всё приложение."""
+        if self._session is None or self._session.closed:
+            async with self._session_lock:
+                if self._session is None or self._session.closed:
+                    connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+                    self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self) -> None:
+        """Закрытие сессии и всех соединений пула."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _make_request(self, method: str, endpoint: str, **kwargs: Any) -> Optional[Dict]:
+        """Унифицированный асинхронный метод для выполнения запросов к Clockify API.
+
+        Запросы проходят через RequestScheduler: ограничение частоты по API-ключу
+        и повторы при 429/5xx. Одинаковые одновременные GET к эндпоинтам из
+        CLOCKIFY_COALESCE_ENDPOINTS выполняются одним запросом (RequestCoalescer).
+        """
+        url: str = f'{self.base_url}/{endpoint}'
+        if 'headers' not in kwargs.keys():
+            kwargs['headers'] = self.headers
+        api_key = kwargs['headers'].get('X-Api-Key', '')
+        label = endpoint_label(endpoint)
+
+        def send():
+            return self.scheduler.run(api_key, method, lambda: self._send(method, url, label, **kwargs))
+
+        try:
+            if method == 'GET' and self.coalescer.enabled(label):
+                return await self.coalescer.run(label, self.coalescer.key(url, kwargs.get('params'), api_key), send)
+            return await send()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Request failed: %s", e)
+            raise
+
+    async def _send(self, method: str, url: str, endpoint: str, **kwargs: Any) -> Optional[Dict]:
+        """Одна попытка HTTP-запроса. Время ответа попадает в гистограмму clockify_request_seconds."""
+        session = await self._get_session()
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                status = response.status
+                body = await response.read()
+                if response.status in [200, 201]:
+                    return await response.json(content_type=None) if body else {}
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status,
+                    message=body.decode(errors='replace'), headers=response.headers
+                )
+        finally:
+            CLOCKIFY_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                             method=method, endpoint=endpoint, status=status)
+
+    async def _iter_pages(self, endpoint: str, page_size: Optional[int] = None, prefetch: bool = False,
+                          params: Optional[Dict[str, str]] = None,
+                          headers: Optional[Dict[str, str]] = None) -> AsyncIterator[List[Dict]]:
+        """Постраничная выгрузка списка.
+
+        При prefetch=True следующая страница запрашивается, пока потребитель
+        обрабатывает текущую.
+        """
+        page_size = page_size or CLOCKIFY_PAGE_SIZE
+        page = 1
+
+        def fetch(number: int) -> asyncio.Future:
+            page_params = {**(params or {}), 'page': str(number), 'page-size': str(page_size)}
+            return asyncio.ensure_future(self._make_request('GET', endpoint, params=page_params,
+                                                            headers=headers or self.headers))
+
+        pending: Optional[asyncio.Future] = fetch(page)
+        try:
+            while pending is not None:
+                items = await pending or []
+                pending = None
+                has_more = len(items) >= page_size
+                if has_more and prefetch:
+                    page += 1
+                    pending = fetch(page)
+                if items:
+                    yield items
+                if has_more and not prefetch:
+                    page += 1
+                    pending = fetch(page)
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    def iter_workspace_users(self, page_size: Optional[int] = None,
+                             prefetch: bool = False) -> AsyncIterator[List[Dict]]:
+        """Постраничная выгрузка пользователей рабочего пространства."""
+        return self._iter_pages('users', page_size, prefetch)
+
+    def iter_all_projects(self, page_size: Optional[int] = None,
+                          prefetch: bool = False) -> AsyncIterator[List[Dict]]:
+        """Постраничная выгрузка проектов рабочего пространства."""
+        return self._iter_pages('projects', page_size, prefetch)
+
+    def iter_user_time_entries(self, user_api_key: str, clockify_userid: str, start: str,
+                               page_size: Optional[int] = None) -> AsyncIterator[List[Dict]]:
+        """Постраничная выгрузка записей времени пользователя, начатых не раньше start."""
+        return self._iter_pages(f'user/{clockify_userid}/time-entries', page_size, prefetch=True,
+                                params={'start': start}, headers={'X-Api-Key': user_api_key})
+
+    async def get_workspace_users(self) -> Optional[List[Dict]]:
+        """Получение списка пользователей рабочего пространства."""
+        return [user async for page in self.iter_workspace_users(prefetch=True) for user in page]
+
+    async def get_all_projects(self) -> Optional[List[Dict]]:
+        """Получение списка всех проектов рабочего пространства."""
+        return [project async for page in self.iter_all_projects(prefetch=True) for project in page]
+
+    async def get_cached_projects(self) -> List[Dict]:
+        """Получение проектов через кэш рабочего пространства (см. ProjectCache)."""
+        return await self.project_cache.get()
+
+    async def get_project_id_by_name(self, project_name: str) -> Optional[str]:
+        """Получение ID проекта по его имени."""
+        index = await self.project_cache.get_index()
+        project_id = index.project_id(project_name)
+        if project_id is None:
+            logger.info("Project %s not found.", project_name)
+        return project_id
+
+    async def create_time_entry(self, user_api_key: str, clockify_userid: str, start_time: str,
+                                end_time: str, project_id: str, description: str) -> Optional[Dict]:
+        """Создание записи времени."""
+        url = f'user/{clockify_userid}/time-entries'
+        headers = {'X-Api-Key': user_api_key}
+        body = {
+            "description": description,
+            "start": start_time,
+            "end": end_time,
+            "projectId": project_id
+        }
+        return await self._make_request('POST', url, json=body, headers=headers)
+
+    async def start_time_entry(self, user_api_key: str, clockify_userid: str, start_time: str,
+                               project_id: str, description: str) -> Optional[Dict]:
+        """Начало новой записи времени."""
+        url = f'user/{clockify_userid}/time-entries'
+        headers = {'X-Api-Key': user_api_key}
+        body = {
+            "description": description,
+            "start": start_time,
+            "projectId": project_id,
+            "billable": True
+        }
+        return await self._make_request('POST', url, json=body, headers=headers)
+
+    async def end_time_entry(self, user_api_key: str, clockify_userid: str, end_time: str) -> Optional[Dict]:
+        """Завершение текущей записи времени."""
+        url = f'user/{clockify_userid}/time-entries'
+        headers = {'X-Api-Key': user_api_key}
+        body = {"end": end_time}
+        return await self._make_request('PATCH', url, json=body, headers=headers)
+
+    async def get_in_progress_time_entry(self, user_api_key: str, clockify_userid: str) -> Optional[Dict]:
+        """Получение запущенной записи времени пользователя, если она есть."""
+        url = f'user/{clockify_userid}/time-entries'
+        headers = {'X-Api-Key': user_api_key}
+        entries = await self._make_request('GET', url, params={'in-progress': 'true'}, headers=headers)
+        return entries[0] if entries else None
+
+    async def get_last_time_entry(self, user_api_key: str, clockify_userid: str) -> Optional[Dict]:
+        """Последняя завершённая запись времени пользователя (Clockify отдаёт записи от новых к старым)."""
+        url = f'user/{clockify_userid}/time-entries'
+        headers = {'X-Api-Key': user_api_key}
+        entries = await self._make_request('GET', url, params={'page-size': '5'}, headers=headers) or []
+        return next((entry for entry in entries if (entry.get('timeInterval') or {}).get('end')), None)
+
+    async def find_time_entries(self, user_api_key: str, clockify_userid: str, start: str, end: str) -> List[Dict]:
+        """Записи времени пользователя в интервале от start до end."""
+        url = f'user/{clockify_userid}/time-entries'
+        headers = {'X-Api-Key': user_api_key}
+        params = {'start': start, 'end': end, 'page-size': '50'}
+        return await self._make_request('GET', url, params=params, headers=headers) or []
+
+
+class TimerAlreadyRunningError(Exception):
+    """Попытка запустить таймер, когда у пользователя уже есть запущенный."""
+
+    def __init__(self, timer):
+        super().__init__(f"Timer for project {timer.project_name} is already running.")
+        self.timer = timer
+
+
 class UserManager:
-    def __init__(self, db_connection):
-        self.conn = db_connection
+    def __init__(self, repository):
+        self.repo = repository
 
-    def add_new_users_to_db(self, api: ClockifyAPI) -> None:
-        """Добавление новых пользователей в базу данных."""
-        users = api.get_workspace_users()
-        if users:
+    async def sync_users(self, api: AsyncClockifyAPI, remove_missing: bool = False) -> Dict[str, int]:
+        """Синхронизация пользователей рабочего пространства с базой данных.
+
+        Известные ID читаются одним запросом, новые пользователи вставляются
+        одним executemany в одной транзакции. Пользователи, которых Clockify не
+        вернул, только считаются (missing); удаляются они лишь при remove_missing
+        и только если выгрузка не пустая и не потеряла больше
+        USER_SYNC_MAX_REMOVE_SHARE известных пользователей: неполная выгрузка
+        (права, не то рабочее пространство, ошибка постраничной загрузки) не должна
+        стирать ключи API и привязки Telegram.
+        """
+        known_ids = await self.repo.get_all_clockify_userids()
+        seen_ids = set()
+        new_rows = []
+        async for users in api.iter_workspace_users(prefetch=True):
             for user in users:
                 clockify_userid = user['id']
-                email = user['email']
-                if not user_exists(self.conn, clockify_userid):
-                    add_user(self.conn, clockify_userid, 'clockify_apikey_placeholder', 'tg_username_placeholder', email)
-                    print(f"Added new user: {email}")
-                else:
-                    print(f"User {email} already exists in the database.")
-
-    def get_user_projects(self, api: ClockifyAPI, tg_username: str) -> List[str]:
+                if clockify_userid in seen_ids:
+                    continue
+                seen_ids.add(clockify_userid)
+                if clockify_userid not in known_ids:
+                    new_rows.append((clockify_userid, 'clockify_apikey_placeholder', TG_USERNAME_PLACEHOLDER, user['email']))
+        missing_ids = known_ids - seen_ids
+        if new_rows:
+            await self.repo.add_users_bulk(new_rows)
+        removed = 0
+        if remove_missing and missing_ids:
+            if not seen_ids or len(missing_ids) > len(known_ids) * USER_SYNC_MAX_REMOVE_SHARE:
+                logger.warning("User sync: %d of %d known users are missing from Clockify, not removing them",
+                               len(missing_ids), len(known_ids))
+            else:
+                await self.repo.delete_users_bulk(missing_ids)
+                removed = len(missing_ids)
+        result = {
+            'inserted': len(new_rows),
+            'unchanged': len(seen_ids) - len(new_rows),
+            'missing': len(missing_ids),
+            'removed': removed,
+        }
+        logger.info("User sync finished: %s", result)
+        return result
+
+    async def add_new_users_to_db(self, api: AsyncClockifyAPI) -> None:
+        """Добавление новых пользователей в базу данных."""
+        await self.sync_users(api, remove_missing=False)
+
+    async def get_user_projects(self, api: AsyncClockifyAPI, tg_username: str) -> List[str]:
         """Получение списка проектов, в которых участвует пользователь."""
-        user = get_user_by_tg_username(self.conn, tg_username)
+        user = await self.repo.get_user_by_tg_username(tg_username)
         if not user:
-            print(f"User with tg_username {tg_username} not found.")
+            logger.info("User with tg_username %s not found.", tg_username)
             return []
 
-        clockify_userid = user[0]
-        projects = api.get_all_projects()
-        if projects:
-            user_projects = [
-                project['name'] for project in projects 
-                for membership in project['memberships'] if membership['userId'] == clockify_userid
-            ]
-            return user_projects
-        return []
+        clockify_userid = user.clockify_userid
+        index = await api.project_cache.get_index()
+        return [name for name, _ in index.projects_for_user(clockify_userid)]
+
+    async def get_user_timezone(self, tg_username: str):
+        """Часовой пояс пользователя; для незарегистрированного — пояс по умолчанию."""
+        return user_timezone(await self.repo.get_user_by_tg_username(tg_username))
+
+    async def set_user_timezone(self, tg_username: str, timezone: Optional[str]):
+        """Смена часового пояса (None — пояс по умолчанию). Возвращает строку пользователя."""
+        if timezone is not None:
+            name = timezone_name(timezone)
+            if name is None:
+                raise ValueError(f"Unknown timezone: {timezone}")
+            timezone = name
+        user = await self.repo.get_user_by_tg_username(tg_username)
+        if not user:
+            raise ValueError(f"User with tg_username {tg_username} not found.")
+        await self.repo.set_user_timezone(user.clockify_userid, timezone)
+        return user
 
 
 class TimeEntryManager:
-    def __init__(self, db_connection):
-        self.conn = db_connection
+    """Записи времени пользователей.
+
+    С outbox создание, запуск и остановка записи ставятся в очередь (см. outbox.py)
+    и отправляются в Clockify в фоне; методы возвращают id изменения в очереди
+    (None, если изменение с тем же ключом идемпотентности уже поставлено).
+    Без outbox запрос к Clockify выполняется сразу.
+    """
+
+    def __init__(self, repository, outbox: Optional[Outbox] = None):
+        self.repo = repository
+        self.outbox = outbox
+
+    async def create_time_entry(self, api: AsyncClockifyAPI, tg_username: str, start_time: str,
+                                end_time: str, project_name: str, description: str,
+                                chat_id: Optional[int] = None, idempotency_key: Optional[str] = None,
+                                project_id: Optional[str] = None) -> Optional[int]:
+        """Создание новой записи времени с обработкой ошибок.
 
-    def create_time_entry(self, api: ClockifyAPI, tg_username: str, start_time: str, 
-                          end_time: str, project_name: str, description: str) -> None:
-        """Создание новой записи времени с обработкой ошибок."""
+        project_id, если известен (выбран кнопкой), используется как есть; иначе проект ищется по имени.
+        """
         try:
-            user = get_user_by_tg_username(self.conn, tg_username)
+            user = await self.repo.get_user_by_tg_username(tg_username)
             if not user:
                 raise ValueError(f"User with tg_username {tg_username} not found.")
 
-            clockify_userid, user_api_key = user[0], user[1]
-            project_id = api.get_project_id_by_name(project_name)
-            if project_id:
-                result = api.create_time_entry(user_api_key, clockify_userid, start_time, end_time, project_id, description)
-                if result is None:
-                    raise Exception("Ошибка при создании записи времени на Clockify.")
+            clockify_userid, user_api_key = user.clockify_userid, user.clockify_apikey
+            if project_id is None:
+                project_id = await api.get_project_id_by_name(project_name)
+            if not project_id:
+                raise ValueError(f"Проект {project_name} не найден.")
+            if self.outbox is not None:
+                return await self.outbox.enqueue(clockify_userid, CREATE, {
+                    'start': start_time, 'end': end_time, 'project_id': project_id, 'description': description,
+                    'summary': f"запись по проекту {project_name}",
+                }, chat_id, idempotency_key)
+            result = await api.create_time_entry(user_api_key, clockify_userid, start_time, end_time, project_id, description)
+            if result is None:
+                raise Exception("Ошибка при создании записи времени на Clockify.")
         except Exception as e:
-            print(f"Ошибка при создании записи времени: {str(e)}")
+            logger.error("Ошибка при создании записи времени: %s", e)
             raise
 
-    def start_time_entry(self, api: ClockifyAPI, tg_username: str, project_name: str, description: str) -> None:
+    async def import_time_entries(self, api: AsyncClockifyAPI, tg_username: str,
+                                  entries: Iterable[Union[ImportRow, ImportFailure]],
+                                  concurrency: int = IMPORT_CONCURRENCY) -> List[ImportResult]:
+        """Массовое создание записей времени.
+
+        Строки отправляются в Clockify по мере разбора, не более concurrency одновременно.
+        Возвращает результат для каждой строки в порядке файла.
+        """
+        user = await self.repo.get_user_by_tg_username(tg_username)
+        if not user:
+            raise ValueError(f"User with tg_username {tg_username} not found.")
+        index = await api.project_cache.get_index()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def post(entry: ImportRow, project_id: str) -> ImportResult:
+            async with semaphore:
+                try:
+                    await api.create_time_entry(user.clockify_apikey, user.clockify_userid, entry.start,
+                                                entry.end, project_id, entry.description)
+                    return ImportResult(entry.line, True, "создано")
+                except Exception as e:
+                    return ImportResult(entry.line, False, f"ошибка Clockify: {str(e)}")
+
+        results: List[Optional[ImportResult]] = []
+        pending = []
+        for entry in entries:
+            if isinstance(entry, ImportFailure):
+                results.append(ImportResult(entry.line, False, entry.error))
+                continue
+            project_id = index.project_id(entry.project)
+            if project_id is None:
+                results.append(ImportResult(entry.line, False, f"проект {entry.project} не найден"))
+                continue
+            results.append(None)
+            pending.append((len(results) - 1, asyncio.ensure_future(post(entry, project_id))))
+        for position, task in pending:
+            results[position] = await task
+        logger.info("Imported %d/%d time entries for %s", sum(r.ok for r in results), len(results), tg_username)
+        return results
+
+    async def start_time_entry(self, api: AsyncClockifyAPI, tg_username: str, project_name: str, description: str,
+                               chat_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> Optional[int]:
         """Начало новой записи времени с обработкой ошибок."""
         try:
-            user = get_user_by_tg_username(self.conn, tg_username)
+            user = await self.repo.get_user_by_tg_username(tg_username)
             if not user:
                 raise ValueError(f"User with tg_username {tg_username} not found.")
 
-            clockify_userid, user_api_key = user[0], user[1]
-            project_id = api.get_project_id_by_name(project_name)
-            if project_id:
-                start_time = get_current_time_in_moscow()
-                result = api.start_time_entry(user_api_key, clockify_userid, start_time, project_id, description)
-                if result is None:
-                    raise Exception("Ошибка при запуске записи времени на Clockify.")
+            clockify_userid, user_api_key = user.clockify_userid, user.clockify_apikey
+            running = await self.repo.get_running_timer(clockify_userid)
+            if running:
+                raise TimerAlreadyRunningError(running)
+            project_id = await api.get_project_id_by_name(project_name)
+            if not project_id:
+                raise ValueError(f"Проект {project_name} не найден.")
+            # Момент запуска по часам пользователя, в Clockify уходит в UTC
+            start_time = aware_to_clockify(now_local(user_timezone(user)))
+            if self.outbox is not None:
+                entry_id = await self.outbox.enqueue(clockify_userid, START, {
+                    'start': start_time, 'project_id': project_id, 'description': description,
+                    'summary': f"запуск таймера по проекту {project_name}",
+                }, chat_id, idempotency_key)
+                if entry_id is not None:
+                    # Таймер считается запущенным сразу; id записи в Clockify появится после отправки
+                    await self.repo.set_running_timer(clockify_userid, '', project_id, project_name,
+                                                      description, start_time)
+                return entry_id
+            result = await api.start_time_entry(user_api_key, clockify_userid, start_time, project_id, description)
+            if result is None:
+                raise Exception("Ошибка при запуске записи времени на Clockify.")
+            await self.repo.set_running_timer(clockify_userid, result.get('id', ''), project_id,
+                                              project_name, description, start_time)
         except Exception as e:
-            print(f"Ошибка при начале записи времени: {str(e)}")
+            logger.error("Ошибка при начале записи времени: %s", e)
             raise
 
-    def end_time_entry(self, api: ClockifyAPI, tg_username: str) -> None:
+    async def end_time_entry(self, api: AsyncClockifyAPI, tg_username: str,
+                             chat_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> Optional[int]:
         """Завершение записи времени с отладкой ошибок."""
         try:
-            user = get_user_by_tg_username(self.conn, tg_username)
+            user = await self.repo.get_user_by_tg_username(tg_username)
             if not user:
                 raise ValueError(f"User with tg_username {tg_username} not found.")
 
-            clockify_userid, user_api_key = user[0], user[1]
-            end_time = get_current_time_in_moscow()
-            result = api.end_time_entry(user_api_key, clockify_userid, end_time)
+            clockify_userid, user_api_key = user.clockify_userid, user.clockify_apikey
+            end_time = aware_to_clockify(now_local(user_timezone(user)))
+            if self.outbox is not None:
+                # Время окончания — момент команды, а не момент отправки в Clockify
+                entry_id = await self.outbox.enqueue(clockify_userid, END, {
+                    'end': end_time, 'summary': "остановка таймера",
+                }, chat_id, idempotency_key)
+                if entry_id is not None:
+                    await self.repo.delete_running_timer(clockify_userid)
+                return entry_id
+            try:
+                result = await api.end_time_entry(user_api_key, clockify_userid, end_time)
+            except aiohttp.ClientResponseError as e:
+                # 404 — в Clockify нет запущенной записи, локальная запись устарела
+                if e.status == 404:
+                    await self.repo.delete_running_timer(clockify_userid)
+                raise
             if result is None:
                 raise Exception("Ошибка при завершении записи времени на Clockify.")
+            await self.repo.delete_running_timer(clockify_userid)
         except Exception as e:
-            print(f"Ошибка при завершении записи времени: {str(e)}")
-            raise
\ No newline at end of file
+            logger.error("Ошибка при завершении записи времени: %s", e)
+            raise
+
+    async def get_running_timer(self, tg_username: str):
+        """Запущенный таймер пользователя по локальным данным, без запроса к Clockify."""
+        user = await self.repo.get_user_by_tg_username(tg_username)
+        if not user:
+            raise ValueError(f"User with tg_username {tg_username} not found.")
+        return await self.repo.get_running_timer(user.clockify_userid)
+
+    async def reconcile_running_timers(self, api: AsyncClockifyAPI) -> Dict[str, int]:
+        """Сверка локальных таймеров с Clockify: таймеры, остановленные вне бота, удаляются."""
+        result = {'checked': 0, 'stopped': 0, 'updated': 0, 'errors': 0}
+        # Пока изменения пользователя не отправлены, Clockify отстаёт от локального таймера
+        pending = await self.repo.get_outbox_pending_userids() if self.outbox is not None else set()
+        for timer in await self.repo.get_all_running_timers():
+            if timer.clockify_userid in pending:
+                continue
+            result['checked'] += 1
+            user = await self.repo.get_user_by_clockify_userid(timer.clockify_userid)
+            if not user:
+                await self.repo.delete_running_timer(timer.clockify_userid)
+                result['stopped'] += 1
+                continue
+            try:
+                entry = await api.get_in_progress_time_entry(user.clockify_apikey, user.clockify_userid)
+            except Exception as e:
+                logger.warning("Failed to reconcile timer for %s: %s", user.email, e)
+                result['errors'] += 1
+                continue
+            if entry is None:
+                await self.repo.delete_running_timer(timer.clockify_userid)
+                result['stopped'] += 1
+            elif entry.get('id') != timer.entry_id:
+                project_id = entry.get('projectId')
+                await self.repo.set_running_timer(timer.clockify_userid, entry.get('id', ''), project_id,
+                                                  api.project_cache.index.project_name(project_id),
+                                                  entry.get('description'), entry['timeInterval']['start'])
+                result['updated'] += 1
+        logger.info("Running timers reconciled: %s", result)
+        return result
\ No newline at end of file
@@ -0,0 +1,133 @@
+import os
+from functools import cached_property
+from typing import Any, Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.fsm.storage.base import BaseStorage
+
+from broadcast import BroadcastManager, FanOut
+from clockify_api import AsyncClockifyAPI, TimeEntryManager, UserManager
+from db.repository import UserRepository, create_repository
+from fsm_storage import PersistentStorage, create_storage
+from jobs import JobRunner
+from keyboards import cache_stats as keyboard_cache_stats
+from metrics import Registry
+from middlewares import TelegramRequestMiddleware
+from outbox import OUTBOX_ENABLED, Outbox
+from reminders import ReminderService
+from reports import ReportManager
+
+
+class Container:
+    """Общие объекты приложения: клиенты, репозиторий, менеджеры и фоновые службы.
+
+    Создаётся один раз в main(); каждый объект строится при первом обращении,
+    поэтому импорт модулей бота ничего не создаёт, а обработчик получает только
+    то, что ему нужно. В обработчики объекты попадают по имени параметра
+    через ServicesMiddleware (см. SERVICES).
+    """
+
+    # Объекты, которые обработчики могут получить параметром с тем же именем
+    SERVICES = ('clockify_api', 'repository', 'user_manager', 'time_entry_manager', 'report_manager',
+                'job_runner', 'broadcast_manager')
+
+    def __init__(self, token: Optional[str] = None, bot: Optional[Bot] = None):
+        self.token = token or os.getenv('TELEGRAM_TOKEN')
+        if bot is not None:
+            self.__dict__['bot'] = bot
+
+    def built(self, name: str) -> bool:
+        return name in self.__dict__
+
+    @cached_property
+    def bot(self) -> Bot:
+        bot = Bot(token=self.token)
+        # Время запросов к Bot API
+        bot.session.middleware(TelegramRequestMiddleware())
+        return bot
+
+    @cached_property
+    def storage(self) -> BaseStorage:
+        return create_storage()
+
+    @cached_property
+    def clockify_api(self) -> AsyncClockifyAPI:
+        return AsyncClockifyAPI()
+
+    @cached_property
+    def repository(self) -> UserRepository:
+        return create_repository()
+
+    @cached_property
+    def user_manager(self) -> UserManager:
+        return UserManager(self.repository)
+
+    @cached_property
+    def time_entry_manager(self) -> TimeEntryManager:
+        return TimeEntryManager(self.repository, self.outbox if OUTBOX_ENABLED else None)
+
+    @cached_property
+    def report_manager(self) -> ReportManager:
+        return ReportManager(self.repository)
+
+    @cached_property
+    def job_runner(self) -> JobRunner:
+        return JobRunner()
+
+    @cached_property
+    def fanout(self) -> FanOut:
+        # Все массовые отправки сообщений идут через один FanOut с общим лимитом Telegram
+        return FanOut(self.bot)
+
+    @cached_property
+    def broadcast_manager(self) -> BroadcastManager:
+        return BroadcastManager(self.fanout, self.repository)
+
+    @cached_property
+    def outbox(self) -> Outbox:
+        return Outbox(self.repository, self.clockify_api, self.fanout)
+
+    @cached_property
+    def reminders(self) -> ReminderService:
+        return ReminderService(self.fanout, self.repository, self.clockify_api)
+
+    async def startup(self) -> None:
+        """Схема базы и хранилище состояний: то, без чего нельзя обработать первое обновление."""
+        await self.repository.init_schema()
+        if isinstance(self.storage, PersistentStorage):
+            await self.storage.init()
+
+    def _stats(self, name: str, read: Callable[[Any], Dict[str, Any]]) -> Callable[[], Dict[str, Any]]:
+        # Запрос метрик не должен создавать объекты, которые ещё никому не понадобились
+        return lambda: read(getattr(self, name)) if self.built(name) else {}
+
+    def register_stats(self, registry: Registry) -> None:
+        """Статистика компонентов в /metrics."""
+        registry.register_stats('project_cache', self._stats('clockify_api', lambda api: api.project_cache.stats()))
+        registry.register_stats('clockify_scheduler', self._stats('clockify_api', lambda api: api.scheduler.stats()))
+        registry.register_stats('clockify_coalescer', self._stats('clockify_api', lambda api: api.coalescer.stats()))
+        registry.register_stats('user_cache', self._stats('repository', lambda repo: repo.cache.stats()))
+        registry.register_stats('fanout', self._stats('fanout', lambda fanout: fanout.stats()))
+        registry.register_stats('outbox', self._stats('outbox', lambda outbox: outbox.stats()))
+        registry.register_stats('keyboard_cache', keyboard_cache_stats)
+        registry.register_stats('job', self._stats('job_runner', lambda runner: {
+            f'{name}_{key}': value for name, stats in runner.stats().items() for key, value in stats.items()}))
+        registry.register_stats('fsm_storage', self._stats('storage', lambda storage: {
+            'writes': storage.writes, 'flushes': storage.flushes} if isinstance(storage, PersistentStorage) else {}))
+
+    async def close(self) -> None:
+        """Остановка и закрытие только тех объектов, которые были созданы."""
+        if self.built('job_runner'):
+            self.job_runner.shutdown()
+        if self.built('broadcast_manager'):
+            await self.broadcast_manager.close()
+        if self.built('outbox'):
+            await self.outbox.close()
+        if self.built('storage'):
+            await self.storage.close()
+        if self.built('clockify_api'):
+            await self.clockify_api.close()
+        if self.built('repository'):
+            self.repository.close()
+        if self.built('bot'):
+            await self.bot.session.close()
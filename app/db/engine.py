@@ -1,22 +1,301 @@
 import sqlite3
 import os
+import queue
+import threading
+from contextlib import contextmanager
 
 # Получаем путь к базе данных из переменной окружения, если она установлена
 DATABASE_PATH = os.getenv('DATABASE', 'users.db')
+# Размер пула соединений
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+
+# Значение tg_username у пользователей, которые ещё не привязали Telegram
+TG_USERNAME_PLACEHOLDER = 'tg_username_placeholder'
+# Значения clockify_apikey у пользователей, которые ещё не прислали свой ключ
+API_KEY_PLACEHOLDERS = ('clockify_apikey_placeholder', 'placeholder_api_key')
+# Таблицы со строками пользователя, которые удаляются вместе с ним
+USER_TABLES = ('running_timers', 'user_chats', 'outbox', 'time_entries', 'time_rollups', 'time_entries_sync')
+
+# Настройки SQLite: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в режиме WAL не теряет целостность, но сокращает число fsync
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 134217728',
+)
+
 
 # Создание или подключение к базе данных
-def create_connection():
-    conn = sqlite3.connect(DATABASE_PATH)
+def create_connection(database_path=None):
+    conn = sqlite3.connect(database_path or DATABASE_PATH, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+
+# Миграции схемы: номер применённой миграции хранится в PRAGMA user_version
+def _migration_create_users(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            clockify_userid TEXT PRIMARY KEY,
+            clockify_apikey TEXT NOT NULL,
+            tg_username TEXT NOT NULL,
+            email TEXT NOT NULL
+        );
+    ''')
+
+
+def _merge_duplicate_users(conn):
+    """Слияние пользователей с одинаковым email перед созданием уникального индекса.
+
+    Остаётся последняя запись; ключ API и Telegram, которых у неё нет, берутся из
+    удаляемых дубликатов. Если у дубликатов разные настоящие ключи или Telegram,
+    миграция прерывается: выбрать правильное значение может только администратор.
+    """
+    groups = {}
+    for row in conn.execute('''
+        SELECT rowid, clockify_userid, clockify_apikey, tg_username, email FROM users
+        WHERE email IN (SELECT email FROM users GROUP BY email HAVING COUNT(*) > 1)
+        ORDER BY email, rowid DESC
+    '''):
+        groups.setdefault(row[4], []).append(row)
+    for email, rows in groups.items():
+        apikeys = {row[2] for row in rows if row[2] not in API_KEY_PLACEHOLDERS}
+        tg_usernames = {row[3] for row in rows if row[3] != TG_USERNAME_PLACEHOLDER}
+        if len(apikeys) > 1 or len(tg_usernames) > 1:
+            raise RuntimeError(
+                f"Users {', '.join(row[1] for row in rows)} share email {email} but have different API keys "
+                f"or Telegram usernames; remove the stale rows from the users table and restart."
+            )
+        survivor = rows[0]
+        conn.execute('UPDATE users SET clockify_apikey = ?, tg_username = ? WHERE rowid = ?',
+                     (apikeys.pop() if apikeys else survivor[2],
+                      tg_usernames.pop() if tg_usernames else survivor[3], survivor[0]))
+        conn.executemany('DELETE FROM users WHERE rowid = ?', [(row[0],) for row in rows[1:]])
+
+
+def _migration_users_indexes(conn):
+    _merge_duplicate_users(conn)
+    # Один Telegram у разных пользователей Clockify: привязка остаётся у последнего
+    # пользователя с ключом API, остальным нужно привязаться заново
+    conn.execute('''
+        UPDATE users SET tg_username = ?
+        WHERE tg_username != ? AND rowid NOT IN (
+            SELECT rowid FROM (
+                SELECT rowid, ROW_NUMBER() OVER (
+                    PARTITION BY tg_username ORDER BY clockify_apikey NOT IN (?, ?) DESC, rowid DESC
+                ) AS position FROM users
+            ) WHERE position = 1
+        )
+    ''', (TG_USERNAME_PLACEHOLDER, TG_USERNAME_PLACEHOLDER) + API_KEY_PLACEHOLDERS)
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)')
+    # Плейсхолдер встречается у многих пользователей, поэтому уникальность
+    # проверяется частичным индексом, а поиск идёт по обычному
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_tg_username ON users (tg_username)')
+    conn.execute(f'''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_tg_username_unique ON users (tg_username)
+        WHERE tg_username != '{TG_USERNAME_PLACEHOLDER}'
+    ''')
+
+
+def _migration_fsm_states(conn):
+    # Состояния диалогов aiogram (см. fsm_storage.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)')
+
+
+def _migration_running_timers(conn):
+    # Запущенные через бота таймеры Clockify, по одному на пользователя
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS running_timers (
+            clockify_userid TEXT PRIMARY KEY,
+            entry_id TEXT NOT NULL,
+            project_id TEXT,
+            project_name TEXT,
+            description TEXT,
+            started_at TEXT NOT NULL
+        );
+    ''')
+
+
+def _migration_time_entries(conn):
+    # Локальная копия записей времени для отчётов (см. reports.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS time_entries (
+            id TEXT PRIMARY KEY,
+            clockify_userid TEXT NOT NULL,
+            project_id TEXT NOT NULL,
+            description TEXT,
+            start TEXT NOT NULL,
+            day TEXT NOT NULL,
+            seconds INTEGER NOT NULL
+        );
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_time_entries_user_start ON time_entries (clockify_userid, start)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_time_entries_user_day ON time_entries (clockify_userid, day)')
+    # Готовые суммы по пользователю, дню и проекту
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS time_rollups (
+            clockify_userid TEXT NOT NULL,
+            day TEXT NOT NULL,
+            project_id TEXT NOT NULL,
+            seconds INTEGER NOT NULL,
+            entries INTEGER NOT NULL,
+            PRIMARY KEY (clockify_userid, day, project_id)
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS time_entries_sync (
+            clockify_userid TEXT PRIMARY KEY,
+            synced_from TEXT NOT NULL,
+            synced_at REAL NOT NULL
+        );
+    ''')
+
+
+def _migration_user_chats(conn):
+    # Чаты Telegram для напоминаний; reminders = 0, если пользователь их отключил
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_chats (
+            clockify_userid TEXT PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            reminders INTEGER NOT NULL DEFAULT 1
+        );
+    ''')
+
+
+def _migration_broadcasts(conn):
+    # Рассылки и доставленные сообщения: прерванная рассылка продолжается с того же места
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_by INTEGER,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            clockify_userid TEXT NOT NULL,
+            status TEXT NOT NULL,
+            PRIMARY KEY (broadcast_id, clockify_userid)
+        );
+    ''')
+
+
+def _migration_users_timezone(conn):
+    # Часовой пояс пользователя (имя из базы tz); NULL — пояс по умолчанию
+    conn.execute('ALTER TABLE users ADD COLUMN timezone TEXT')
+
+
+def _migration_outbox(conn):
+    # Изменения записей времени, ожидающие отправки в Clockify (см. outbox.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clockify_userid TEXT NOT NULL,
+            chat_id INTEGER,
+            action TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL
+        );
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status_user ON outbox (status, clockify_userid, id)')
+
+
+MIGRATIONS = [
+    _migration_create_users,
+    _migration_users_indexes,
+    _migration_fsm_states,
+    _migration_running_timers,
+    _migration_time_entries,
+    _migration_user_chats,
+    _migration_broadcasts,
+    _migration_users_timezone,
+    _migration_outbox,
+]
+
+
+def migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+
+
 # Создание таблицы, если она не существует
 def create_table(conn):
-    with conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                clockify_userid TEXT PRIMARY KEY,
-                clockify_apikey TEXT NOT NULL,
-                tg_username TEXT NOT NULL,
-                email TEXT NOT NULL
-            );
-        ''')
\ No newline at end of file
+    migrate(conn)
+
+
+class ConnectionPool:
+    """Пул соединений SQLite, общий для всех модулей бота."""
+
+    def __init__(self, database_path=None, size=DB_POOL_SIZE):
+        self.database_path = database_path or DATABASE_PATH
+        self.size = size
+        self._pool = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return create_connection(self.database_path)
+        return self._pool.get()
+
+    @contextmanager
+    def connection(self):
+        """Выдача соединения из пула на время блока with."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Единый пул соединений приложения."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
@@ -1,3 +1,9 @@
+import logging
+
+from db.engine import API_KEY_PLACEHOLDERS, TG_USERNAME_PLACEHOLDER, USER_TABLES
+
+logger = logging.getLogger(__name__)
+
 # Добавление новой записи
 def add_user(conn, clockify_userid, clockify_apikey, tg_username, email):
     with conn:
@@ -6,6 +12,29 @@ def add_user(conn, clockify_userid, clockify_apikey, tg_username, email):
             VALUES (?, ?, ?, ?)
         ''', (clockify_userid, clockify_apikey, tg_username, email))
 
+# Массовое добавление пользователей одной транзакцией
+def add_users_bulk(conn, rows):
+    with conn:
+        conn.executemany('''
+            INSERT INTO users (clockify_userid, clockify_apikey, tg_username, email)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+
+# Получение множества всех clockify_userid одним запросом
+def get_all_clockify_userids(conn):
+    with conn:
+        cursor = conn.execute('SELECT clockify_userid FROM users')
+        return {row[0] for row in cursor}
+
+# Массовое удаление пользователей по clockify_userid
+def delete_users_bulk(conn, clockify_userids):
+    params = [(uid,) for uid in clockify_userids]
+    with conn:
+        # Вместе с пользователем удаляются его таймер, чат, очередь изменений и локальная копия записей
+        for table in USER_TABLES:
+            conn.executemany(f'DELETE FROM {table} WHERE clockify_userid = ?', params)
+        conn.executemany('DELETE FROM users WHERE clockify_userid = ?', params)
+
 # Получение данных по clockify_userid
 def get_user_by_clockify_userid(conn, clockify_userid):
     with conn:
@@ -33,42 +62,285 @@ def get_user_by_email(conn, email):
 # Проверка, существует ли пользователь по clockify_userid
 def user_exists(conn, clockify_userid):
     with conn:
-        cursor = conn.execute('SELECT * FROM users WHERE clockify_userid = ?', (clockify_userid,))
+        cursor = conn.execute('SELECT 1 FROM users WHERE clockify_userid = ?', (clockify_userid,))
         return cursor.fetchone() is not None
     
  
 # Проверка, существует ли пользователь по email
 def user_exists_by_email(conn, email):
     with conn:
-        cursor = conn.execute('SELECT * FROM users WHERE email = ?', (email,))
+        cursor = conn.execute('SELECT 1 FROM users WHERE email = ?', (email,))
         return cursor.fetchone() is not None   
     
 # Обновление API-ключа и Telegram-юзернейма по email
 def update_user_by_email(conn, email, clockify_apikey, tg_username):
     with conn:
         if user_exists_by_email(conn, email):
+            # Telegram-аккаунт может быть привязан только к одному пользователю
+            conn.execute('''
+                UPDATE users SET tg_username = ?
+                WHERE tg_username = ? AND email != ?
+            ''', (TG_USERNAME_PLACEHOLDER, tg_username, email))
             conn.execute('''
                 UPDATE users
                 SET clockify_apikey = ?, tg_username = ?
                 WHERE email = ?
             ''', (clockify_apikey, tg_username, email))
-            print(f"Updated user with email: {email}")
+            logger.info("Updated user with email: %s", email)
         else:
-            print(f"User with email {email} does not exist in the database.")
+            logger.info("User with email %s does not exist in the database.", email)
             
 
 # Обновление API-ключа по Telegram-юзернейму
 def update_api_key_by_tg_username(conn, tg_username, clockify_apikey):
     with conn:
-        cursor = conn.execute('SELECT * FROM users WHERE tg_username = ?', (tg_username,))
+        cursor = conn.execute('SELECT 1 FROM users WHERE tg_username = ?', (tg_username,))
         if cursor.fetchone():
             conn.execute('''
                 UPDATE users
                 SET clockify_apikey = ?
                 WHERE tg_username = ?
             ''', (clockify_apikey, tg_username))
-            print(f"Updated API key for user with tg_username: {tg_username}")
+            logger.info("Updated API key for user with tg_username: %s", tg_username)
         else:
-            print(f"User with tg_username {tg_username} does not exist in the database.")
+            logger.info("User with tg_username %s does not exist in the database.", tg_username)
 
-            
+# Часовой пояс пользователя; None — пояс по умолчанию
+def set_user_timezone(conn, clockify_userid, timezone):
+    with conn:
+        conn.execute('UPDATE users SET timezone = ? WHERE clockify_userid = ?', (timezone, clockify_userid))
+
+
+# Сохранение запущенного таймера пользователя (заменяет предыдущий)
+def set_running_timer(conn, clockify_userid, entry_id, project_id, project_name, description, started_at):
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO running_timers
+                (clockify_userid, entry_id, project_id, project_name, description, started_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (clockify_userid, entry_id, project_id, project_name, description, started_at))
+
+# Получение запущенного таймера по clockify_userid
+def get_running_timer(conn, clockify_userid):
+    with conn:
+        cursor = conn.execute('''
+            SELECT clockify_userid, entry_id, project_id, project_name, description, started_at
+            FROM running_timers WHERE clockify_userid = ?
+        ''', (clockify_userid,))
+        return cursor.fetchone()
+
+# Получение всех запущенных таймеров
+def get_all_running_timers(conn):
+    with conn:
+        cursor = conn.execute('''
+            SELECT clockify_userid, entry_id, project_id, project_name, description, started_at
+            FROM running_timers
+        ''')
+        return cursor.fetchall()
+
+# Удаление запущенного таймера
+def delete_running_timer(conn, clockify_userid):
+    with conn:
+        conn.execute('DELETE FROM running_timers WHERE clockify_userid = ?', (clockify_userid,))
+
+
+# Сохранение записей времени пользователя, загруженных начиная с window_start.
+# Записи из этого окна, которых больше нет в Clockify, удаляются,
+# суммы в time_rollups пересчитываются для затронутых дней.
+def replace_time_entries(conn, clockify_userid, window_start, rows):
+    with conn:
+        days = {row[0] for row in conn.execute(
+            'SELECT DISTINCT day FROM time_entries WHERE clockify_userid = ? AND start >= ?',
+            (clockify_userid, window_start))}
+        days.update(row[5] for row in rows)
+        # Запись могла переехать в окно из более раннего дня — этот день тоже пересчитываем
+        ids = [row[0] for row in rows]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            days.update(row[0] for row in conn.execute(
+                f'SELECT DISTINCT day FROM time_entries WHERE id IN ({",".join("?" * len(chunk))})', chunk))
+        conn.execute('DELETE FROM time_entries WHERE clockify_userid = ? AND start >= ?',
+                     (clockify_userid, window_start))
+        conn.executemany('''
+            INSERT OR REPLACE INTO time_entries (id, clockify_userid, project_id, description, start, day, seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        day_params = [(clockify_userid, day) for day in days]
+        conn.executemany('DELETE FROM time_rollups WHERE clockify_userid = ? AND day = ?', day_params)
+        conn.executemany('''
+            INSERT INTO time_rollups (clockify_userid, day, project_id, seconds, entries)
+            SELECT clockify_userid, day, project_id, SUM(seconds), COUNT(*)
+            FROM time_entries WHERE clockify_userid = ? AND day = ?
+            GROUP BY project_id
+        ''', day_params)
+
+# Получение сумм по дням и проектам за период (включительно)
+def get_time_rollups(conn, clockify_userid, day_from, day_to):
+    with conn:
+        cursor = conn.execute('''
+            SELECT day, project_id, seconds, entries FROM time_rollups
+            WHERE clockify_userid = ? AND day BETWEEN ? AND ?
+            ORDER BY day, project_id
+        ''', (clockify_userid, day_from, day_to))
+        return cursor.fetchall()
+
+# Получение точки синхронизации записей времени пользователя
+def get_time_entries_sync(conn, clockify_userid):
+    with conn:
+        cursor = conn.execute('SELECT synced_from, synced_at FROM time_entries_sync WHERE clockify_userid = ?',
+                              (clockify_userid,))
+        return cursor.fetchone()
+
+# Сохранение точки синхронизации записей времени пользователя
+def set_time_entries_sync(conn, clockify_userid, synced_from, synced_at):
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO time_entries_sync (clockify_userid, synced_from, synced_at)
+            VALUES (?, ?, ?)
+        ''', (clockify_userid, synced_from, synced_at))
+
+
+# Сохранение чата Telegram пользователя (настройка напоминаний не меняется)
+def set_user_chat(conn, clockify_userid, chat_id):
+    with conn:
+        conn.execute('''
+            INSERT INTO user_chats (clockify_userid, chat_id) VALUES (?, ?)
+            ON CONFLICT (clockify_userid) DO UPDATE SET chat_id = excluded.chat_id
+        ''', (clockify_userid, chat_id))
+
+# Включение и отключение напоминаний
+def set_reminders_enabled(conn, clockify_userid, enabled):
+    with conn:
+        conn.execute('UPDATE user_chats SET reminders = ? WHERE clockify_userid = ?',
+                     (1 if enabled else 0, clockify_userid))
+
+# Получение зарегистрированных пользователей с включёнными напоминаниями
+# вместе с их запущенными таймерами — одним запросом
+def get_reminder_targets(conn):
+    with conn:
+        cursor = conn.execute(f'''
+            SELECT u.clockify_userid, u.clockify_apikey, c.chat_id, t.project_name, t.started_at, u.timezone
+            FROM users u
+            JOIN user_chats c ON c.clockify_userid = u.clockify_userid
+            LEFT JOIN running_timers t ON t.clockify_userid = u.clockify_userid
+            WHERE c.reminders = 1 AND u.clockify_apikey NOT IN ({",".join("?" * len(API_KEY_PLACEHOLDERS))})
+        ''', API_KEY_PLACEHOLDERS)
+        return cursor.fetchall()
+
+
+# Создание рассылки, возвращает её id
+def create_broadcast(conn, text, created_by, created_at):
+    with conn:
+        cursor = conn.execute('''
+            INSERT INTO broadcasts (text, status, created_by, created_at) VALUES (?, 'running', ?, ?)
+        ''', (text, created_by, created_at))
+        return cursor.lastrowid
+
+# Получение рассылки по id
+def get_broadcast(conn, broadcast_id):
+    with conn:
+        cursor = conn.execute('''
+            SELECT id, text, status, created_by, created_at, finished_at FROM broadcasts WHERE id = ?
+        ''', (broadcast_id,))
+        return cursor.fetchone()
+
+# Получение id незавершённых рассылок
+def get_running_broadcast_ids(conn):
+    with conn:
+        cursor = conn.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [row[0] for row in cursor]
+
+# Завершение рассылки
+def finish_broadcast(conn, broadcast_id, status, finished_at):
+    with conn:
+        conn.execute('UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?',
+                     (status, finished_at, broadcast_id))
+
+# Следующая страница получателей рассылки, которым сообщение ещё не отправлялось.
+# Постраничный обход по clockify_userid не держит всех получателей в памяти.
+def get_broadcast_recipients(conn, broadcast_id, after, limit):
+    with conn:
+        cursor = conn.execute(f'''
+            SELECT c.clockify_userid, c.chat_id
+            FROM user_chats c
+            JOIN users u ON u.clockify_userid = c.clockify_userid
+            WHERE c.clockify_userid > ?
+              AND u.clockify_apikey NOT IN ({",".join("?" * len(API_KEY_PLACEHOLDERS))})
+              AND NOT EXISTS (
+                  SELECT 1 FROM broadcast_deliveries d
+                  WHERE d.broadcast_id = ? AND d.clockify_userid = c.clockify_userid
+              )
+            ORDER BY c.clockify_userid
+            LIMIT ?
+        ''', (after, *API_KEY_PLACEHOLDERS, broadcast_id, limit))
+        return cursor.fetchall()
+
+# Сохранение результатов доставки пачкой: rows — (clockify_userid, status)
+def add_broadcast_deliveries(conn, broadcast_id, rows):
+    with conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, clockify_userid, status) VALUES (?, ?, ?)
+        ''', [(broadcast_id, clockify_userid, status) for clockify_userid, status in rows])
+
+# Число доставок рассылки по статусам
+def get_broadcast_counts(conn, broadcast_id):
+    with conn:
+        cursor = conn.execute('''
+            SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status
+        ''', (broadcast_id,))
+        return dict(cursor.fetchall())
+
+
+# Очередь изменений для Clockify (см. outbox.py).
+# Добавление записи; None, если запись с таким ключом идемпотентности уже есть
+def add_outbox_entry(conn, clockify_userid, chat_id, action, payload, idempotency_key, created_at):
+    with conn:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO outbox
+                (clockify_userid, chat_id, action, payload, idempotency_key, status, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
+        ''', (clockify_userid, chat_id, action, payload, idempotency_key, created_at, created_at))
+        return cursor.lastrowid if cursor.rowcount else None
+
+# Первые по порядку ожидающие записи каждого пользователя, время отправки которых наступило
+def get_outbox_heads(conn, now, limit):
+    with conn:
+        cursor = conn.execute('''
+            SELECT id, clockify_userid, chat_id, action, payload, idempotency_key, attempts, last_error
+            FROM outbox
+            WHERE id IN (SELECT MIN(id) FROM outbox WHERE status = 'pending' GROUP BY clockify_userid)
+              AND next_attempt_at <= ?
+            ORDER BY id LIMIT ?
+        ''', (now, limit))
+        return cursor.fetchall()
+
+# Захват записи перед отправкой: False, если её уже взял другой экземпляр бота
+def claim_outbox_entry(conn, entry_id, attempts, next_attempt_at):
+    with conn:
+        cursor = conn.execute('''
+            UPDATE outbox SET attempts = ?, next_attempt_at = ?
+            WHERE id = ? AND attempts = ? AND status = 'pending'
+        ''', (attempts + 1, next_attempt_at, entry_id, attempts))
+        return cursor.rowcount == 1
+
+# Итог попытки: status = pending (повтор в next_attempt_at), done или dead
+def finish_outbox_entry(conn, entry_id, status, error, next_attempt_at, updated_at):
+    with conn:
+        conn.execute('UPDATE outbox SET status = ?, last_error = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?',
+                     (status, error, next_attempt_at, updated_at, entry_id))
+
+# Пользователи, у которых есть неотправленные изменения
+def get_outbox_pending_userids(conn):
+    with conn:
+        cursor = conn.execute("SELECT DISTINCT clockify_userid FROM outbox WHERE status = 'pending'")
+        return {row[0] for row in cursor}
+
+# Число записей очереди по статусам
+def get_outbox_counts(conn):
+    with conn:
+        return dict(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+# Удаление отправленных записей, завершённых раньше before
+def delete_outbox_done(conn, before):
+    with conn:
+        return conn.execute("DELETE FROM outbox WHERE status = 'done' AND updated_at < ?", (before,)).rowcount
@@ -0,0 +1,397 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import NamedTuple, Optional
+
+from db import methods
+from db.engine import ConnectionPool, get_pool, migrate
+from db.user_cache import UserCache, UserRecord
+from metrics import DB_QUERY_SECONDS
+
+# Строка подключения SQLAlchemy (например, postgresql+psycopg://...);
+# если не задана, используется локальная SQLite из DATABASE
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+
+class RunningTimer(NamedTuple):
+    """Таймер Clockify, запущенный через бота."""
+    clockify_userid: str
+    entry_id: str
+    project_id: Optional[str]
+    project_name: Optional[str]
+    description: Optional[str]
+    started_at: str
+
+
+class ReminderTarget(NamedTuple):
+    """Пользователь, которому можно отправить напоминание, и его запущенный таймер (если есть)."""
+    clockify_userid: str
+    clockify_apikey: str
+    chat_id: int
+    project_name: Optional[str]
+    started_at: Optional[str]
+    timezone: Optional[str] = None
+
+
+class OutboxEntry(NamedTuple):
+    """Изменение записи времени, ожидающее отправки в Clockify."""
+    id: int
+    clockify_userid: str
+    chat_id: Optional[int]
+    action: str
+    payload: str
+    idempotency_key: str
+    attempts: int
+    last_error: Optional[str]
+
+
+class Broadcast(NamedTuple):
+    """Рассылка сообщения всем зарегистрированным пользователям."""
+    id: int
+    text: str
+    status: str
+    created_by: Optional[int]
+    created_at: float
+    finished_at: Optional[float]
+
+
+class _SavepointConnection:
+    """Соединение пачки записей: `with conn` в методах открывает точку сохранения
+    внутри общей транзакции, а не отдельную транзакцию с фиксацией."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._depth = 0
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._depth += 1
+        self._conn.execute(f'SAVEPOINT write_{self._depth}')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        name = f'write_{self._depth}'
+        self._depth -= 1
+        if exc_type is not None:
+            self._conn.execute(f'ROLLBACK TO {name}')
+        self._conn.execute(f'RELEASE {name}')
+        return False
+
+
+class SQLiteBackend:
+    """Хранилище на SQLite через общий пул соединений."""
+
+    methods = methods
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self.size = pool.size
+
+    def connection(self):
+        return self.pool.connection()
+
+    @contextmanager
+    def transaction(self):
+        """Одна транзакция на пачку записей."""
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield _SavepointConnection(conn)
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    @staticmethod
+    def savepoint(conn):
+        return conn
+
+    def init_schema(self):
+        with self.connection() as conn:
+            migrate(conn)
+
+    def close(self):
+        self.pool.close()
+
+
+class SQLAlchemyBackend:
+    """Хранилище на SQLAlchemy (PostgreSQL и другие СУБД)."""
+
+    def __init__(self, url: str, pool_size: int = 5):
+        from sqlalchemy import create_engine
+        from db import sqlalchemy_methods
+
+        self.methods = sqlalchemy_methods
+        self.engine = create_engine(url, pool_size=pool_size, pool_pre_ping=True)
+        self.size = pool_size
+
+    def connection(self):
+        return self.engine.begin()
+
+    def transaction(self):
+        """Одна транзакция на пачку записей."""
+        return self.engine.begin()
+
+    @staticmethod
+    def savepoint(conn):
+        return conn.begin_nested()
+
+    def init_schema(self):
+        self.methods.create_schema(self.engine)
+
+    def close(self):
+        self.engine.dispose()
+
+
+class UserRepository:
+    """Асинхронный доступ к таблице users.
+
+    Синхронные вызовы БД выполняются в отдельных потоках и не блокируют цикл
+    событий. Чтение идёт параллельно, запись — в одном потоке: запросы на запись,
+    пришедшие за одну итерацию цикла, выполняются там одной транзакцией. Каждая
+    запись — в своей точке сохранения: ошибка одной не отменяет остальные.
+    Пользователи, найденные по tg_username и clockify_userid, кэшируются в UserCache.
+    """
+
+    def __init__(self, backend, cache: UserCache = None):
+        self.backend = backend
+        self.cache = cache if cache is not None else UserCache()
+        self._reader = ThreadPoolExecutor(max_workers=backend.size, thread_name_prefix='db-read')
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        self._write_queue = []
+        self._flush_scheduled = False
+
+    def _call(self, func, *args):
+        with self.backend.connection() as conn:
+            # Время ожидания соединения из пула не учитывается
+            with DB_QUERY_SECONDS.time(function=func.__name__):
+                return func(conn, *args)
+
+    async def _read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, partial(self._call, func, *args))
+
+    async def _write(self, func, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._write_queue.append((func, args, future))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush, loop)
+        return await future
+
+    def _flush(self, loop):
+        batch, self._write_queue = self._write_queue, []
+        self._flush_scheduled = False
+        job = loop.run_in_executor(self._writer, self._run_batch, [(func, args) for func, args, _ in batch])
+        job.add_done_callback(partial(self._resolve_batch, [future for _, _, future in batch]))
+
+    def _run_batch(self, batch):
+        results = []
+        with self.backend.transaction() as conn:
+            for func, args in batch:
+                try:
+                    with self.backend.savepoint(conn), DB_QUERY_SECONDS.time(function=func.__name__):
+                        value = func(conn, *args)
+                    results.append((True, value))
+                except Exception as e:
+                    results.append((False, e))
+        return results
+
+    @staticmethod
+    def _resolve_batch(futures, job):
+        if job.exception() is not None:
+            results = [(False, job.exception())] * len(futures)
+        else:
+            results = job.result()
+        for future, (ok, value) in zip(futures, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def init_schema(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self.backend.init_schema)
+
+    def close(self):
+        self._reader.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        self.backend.close()
+
+    # Чтение
+    @staticmethod
+    def _record(row):
+        return UserRecord._make(row) if row is not None else None
+
+    async def get_user_by_clockify_userid(self, clockify_userid):
+        record = self.cache.get(clockify_userid)
+        if record is not None:
+            return record
+        generation = self.cache.generation
+        record = self._record(await self._read(self.backend.methods.get_user_by_clockify_userid, clockify_userid))
+        if record is not None:
+            self.cache.put(record, generation)
+        return record
+
+    async def get_user_by_clockify_apikey(self, clockify_apikey):
+        return self._record(await self._read(self.backend.methods.get_user_by_clockify_apikey, clockify_apikey))
+
+    async def get_user_by_tg_username(self, tg_username):
+        record = self.cache.get_by_tg_username(tg_username)
+        if record is not None:
+            return record
+        generation = self.cache.generation
+        record = self._record(await self._read(self.backend.methods.get_user_by_tg_username, tg_username))
+        if record is not None:
+            self.cache.put(record, generation)
+        return record
+
+    async def get_user_by_email(self, email):
+        return self._record(await self._read(self.backend.methods.get_user_by_email, email))
+
+    async def user_exists(self, clockify_userid):
+        return await self._read(self.backend.methods.user_exists, clockify_userid)
+
+    async def user_exists_by_email(self, email):
+        return await self._read(self.backend.methods.user_exists_by_email, email)
+
+    async def get_all_clockify_userids(self):
+        return await self._read(self.backend.methods.get_all_clockify_userids)
+
+    # Запись
+    async def add_user(self, clockify_userid, clockify_apikey, tg_username, email):
+        return await self._write(self.backend.methods.add_user, clockify_userid, clockify_apikey, tg_username, email)
+
+    async def add_users_bulk(self, rows):
+        return await self._write(self.backend.methods.add_users_bulk, rows)
+
+    async def delete_users_bulk(self, clockify_userids):
+        try:
+            return await self._write(self.backend.methods.delete_users_bulk, clockify_userids)
+        finally:
+            for clockify_userid in clockify_userids:
+                self.cache.invalidate(clockify_userid=clockify_userid)
+
+    async def update_user_by_email(self, email, clockify_apikey, tg_username):
+        # Запись затрагивает и строку с email, и строку, у которой отвязывается tg_username
+        self.cache.invalidate(email=email, tg_username=tg_username)
+        try:
+            return await self._write(self.backend.methods.update_user_by_email, email, clockify_apikey, tg_username)
+        finally:
+            self.cache.invalidate(email=email, tg_username=tg_username)
+
+    async def update_api_key_by_tg_username(self, tg_username, clockify_apikey):
+        self.cache.invalidate(tg_username=tg_username)
+        try:
+            return await self._write(self.backend.methods.update_api_key_by_tg_username, tg_username, clockify_apikey)
+        finally:
+            self.cache.invalidate(tg_username=tg_username)
+
+    async def set_user_timezone(self, clockify_userid, timezone):
+        self.cache.invalidate(clockify_userid=clockify_userid)
+        try:
+            return await self._write(self.backend.methods.set_user_timezone, clockify_userid, timezone)
+        finally:
+            self.cache.invalidate(clockify_userid=clockify_userid)
+
+    # Запущенные таймеры
+    async def get_running_timer(self, clockify_userid):
+        row = await self._read(self.backend.methods.get_running_timer, clockify_userid)
+        return RunningTimer._make(row) if row is not None else None
+
+    async def get_all_running_timers(self):
+        return [RunningTimer._make(row) for row in await self._read(self.backend.methods.get_all_running_timers)]
+
+    async def set_running_timer(self, clockify_userid, entry_id, project_id, project_name, description, started_at):
+        return await self._write(self.backend.methods.set_running_timer, clockify_userid, entry_id,
+                                 project_id, project_name, description, started_at)
+
+    async def delete_running_timer(self, clockify_userid):
+        return await self._write(self.backend.methods.delete_running_timer, clockify_userid)
+
+    # Записи времени для отчётов
+    async def replace_time_entries(self, clockify_userid, window_start, rows):
+        return await self._write(self.backend.methods.replace_time_entries, clockify_userid, window_start, rows)
+
+    async def get_time_rollups(self, clockify_userid, day_from, day_to):
+        return await self._read(self.backend.methods.get_time_rollups, clockify_userid, day_from, day_to)
+
+    async def get_time_entries_sync(self, clockify_userid):
+        return await self._read(self.backend.methods.get_time_entries_sync, clockify_userid)
+
+    async def set_time_entries_sync(self, clockify_userid, synced_from, synced_at):
+        return await self._write(self.backend.methods.set_time_entries_sync, clockify_userid, synced_from, synced_at)
+
+
+    # Чаты и напоминания
+    async def set_user_chat(self, clockify_userid, chat_id):
+        return await self._write(self.backend.methods.set_user_chat, clockify_userid, chat_id)
+
+    async def set_reminders_enabled(self, clockify_userid, enabled):
+        return await self._write(self.backend.methods.set_reminders_enabled, clockify_userid, enabled)
+
+    async def get_reminder_targets(self):
+        return [ReminderTarget._make(row) for row in await self._read(self.backend.methods.get_reminder_targets)]
+
+
+    # Рассылки
+    async def create_broadcast(self, text, created_by, created_at):
+        return await self._write(self.backend.methods.create_broadcast, text, created_by, created_at)
+
+    async def get_broadcast(self, broadcast_id):
+        row = await self._read(self.backend.methods.get_broadcast, broadcast_id)
+        return Broadcast._make(row) if row is not None else None
+
+    async def get_running_broadcast_ids(self):
+        return await self._read(self.backend.methods.get_running_broadcast_ids)
+
+    async def finish_broadcast(self, broadcast_id, status, finished_at):
+        return await self._write(self.backend.methods.finish_broadcast, broadcast_id, status, finished_at)
+
+    async def get_broadcast_recipients(self, broadcast_id, after, limit):
+        return await self._read(self.backend.methods.get_broadcast_recipients, broadcast_id, after, limit)
+
+    async def add_broadcast_deliveries(self, broadcast_id, rows):
+        return await self._write(self.backend.methods.add_broadcast_deliveries, broadcast_id, rows)
+
+    async def get_broadcast_counts(self, broadcast_id):
+        return await self._read(self.backend.methods.get_broadcast_counts, broadcast_id)
+
+
+    # Очередь изменений для Clockify
+    async def add_outbox_entry(self, clockify_userid, chat_id, action, payload, idempotency_key, created_at):
+        return await self._write(self.backend.methods.add_outbox_entry, clockify_userid, chat_id, action, payload,
+                                 idempotency_key, created_at)
+
+    async def get_outbox_heads(self, now, limit):
+        return [OutboxEntry._make(row) for row in await self._read(self.backend.methods.get_outbox_heads, now, limit)]
+
+    async def claim_outbox_entry(self, entry_id, attempts, next_attempt_at):
+        return await self._write(self.backend.methods.claim_outbox_entry, entry_id, attempts, next_attempt_at)
+
+    async def finish_outbox_entry(self, entry_id, status, error, next_attempt_at, updated_at):
+        return await self._write(self.backend.methods.finish_outbox_entry, entry_id, status, error, next_attempt_at,
+                                 updated_at)
+
+    async def get_outbox_pending_userids(self):
+        return await self._read(self.backend.methods.get_outbox_pending_userids)
+
+    async def get_outbox_counts(self):
+        return await self._read(self.backend.methods.get_outbox_counts)
+
+    async def delete_outbox_done(self, before):
+        return await self._write(self.backend.methods.delete_outbox_done, before)
+
+
+def create_repository(database_url=DATABASE_URL):
+    """Создание репозитория с бэкендом, выбранным по DATABASE_URL."""
+    if database_url and not database_url.startswith('sqlite'):
+        return UserRepository(SQLAlchemyBackend(database_url))
+    return UserRepository(SQLiteBackend(get_pool()))
@@ -0,0 +1,393 @@
+import logging
+
+from sqlalchemy import (BigInteger, Column, Float, Index, Integer, MetaData, String, Table, delete, func, insert, inspect,
+                        select, text, update)
+
+from db.engine import API_KEY_PLACEHOLDERS, TG_USERNAME_PLACEHOLDER, USER_TABLES
+
+logger = logging.getLogger(__name__)
+
+# Те же операции, что и в db/methods.py, но через SQLAlchemy Core —
+# для работы с PostgreSQL при нескольких репликах бота.
+# Транзакцией управляет вызывающий код (engine.begin()).
+
+metadata = MetaData()
+
+users = Table(
+    'users', metadata,
+    Column('clockify_userid', String, primary_key=True),
+    Column('clockify_apikey', String, nullable=False),
+    Column('tg_username', String, nullable=False),
+    Column('email', String, nullable=False),
+    Column('timezone', String),
+    Index('idx_users_email', 'email', unique=True),
+    Index('idx_users_tg_username', 'tg_username'),
+    Index('idx_users_tg_username_unique', 'tg_username', unique=True,
+          postgresql_where=text(f"tg_username != '{TG_USERNAME_PLACEHOLDER}'"),
+          sqlite_where=text(f"tg_username != '{TG_USERNAME_PLACEHOLDER}'")),
+)
+
+running_timers = Table(
+    'running_timers', metadata,
+    Column('clockify_userid', String, primary_key=True),
+    Column('entry_id', String, nullable=False),
+    Column('project_id', String),
+    Column('project_name', String),
+    Column('description', String),
+    Column('started_at', String, nullable=False),
+)
+
+time_entries = Table(
+    'time_entries', metadata,
+    Column('id', String, primary_key=True),
+    Column('clockify_userid', String, nullable=False),
+    Column('project_id', String, nullable=False),
+    Column('description', String),
+    Column('start', String, nullable=False),
+    Column('day', String, nullable=False),
+    Column('seconds', Integer, nullable=False),
+    Index('idx_time_entries_user_start', 'clockify_userid', 'start'),
+    Index('idx_time_entries_user_day', 'clockify_userid', 'day'),
+)
+
+time_rollups = Table(
+    'time_rollups', metadata,
+    Column('clockify_userid', String, primary_key=True),
+    Column('day', String, primary_key=True),
+    Column('project_id', String, primary_key=True),
+    Column('seconds', Integer, nullable=False),
+    Column('entries', Integer, nullable=False),
+)
+
+time_entries_sync = Table(
+    'time_entries_sync', metadata,
+    Column('clockify_userid', String, primary_key=True),
+    Column('synced_from', String, nullable=False),
+    Column('synced_at', Float, nullable=False),
+)
+
+user_chats = Table(
+    'user_chats', metadata,
+    Column('clockify_userid', String, primary_key=True),
+    Column('chat_id', BigInteger, nullable=False),
+    Column('reminders', Integer, nullable=False, server_default=text('1')),
+)
+
+broadcasts = Table(
+    'broadcasts', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('text', String, nullable=False),
+    Column('status', String, nullable=False),
+    Column('created_by', BigInteger),
+    Column('created_at', Float, nullable=False),
+    Column('finished_at', Float),
+)
+
+broadcast_deliveries = Table(
+    'broadcast_deliveries', metadata,
+    Column('broadcast_id', Integer, primary_key=True),
+    Column('clockify_userid', String, primary_key=True),
+    Column('status', String, nullable=False),
+)
+
+_columns = (users.c.clockify_userid, users.c.clockify_apikey, users.c.tg_username, users.c.email, users.c.timezone)
+
+
+outbox = Table(
+    'outbox', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('clockify_userid', String, nullable=False),
+    Column('chat_id', BigInteger),
+    Column('action', String, nullable=False),
+    Column('payload', String, nullable=False),
+    Column('idempotency_key', String, nullable=False, unique=True),
+    Column('status', String, nullable=False),
+    Column('attempts', Integer, nullable=False, server_default=text('0')),
+    Column('next_attempt_at', Float, nullable=False),
+    Column('last_error', String),
+    Column('created_at', Float, nullable=False),
+    Column('updated_at', Float),
+    Index('idx_outbox_status_user', 'status', 'clockify_userid', 'id'),
+)
+
+# Колонки, добавленные в уже существующие таблицы: create_all их не создаёт
+ADDED_COLUMNS = ((users, users.c.timezone),)
+
+
+def create_schema(engine):
+    metadata.create_all(engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column in ADDED_COLUMNS:
+            if column.name not in {c['name'] for c in inspector.get_columns(table.name)}:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                                  f'{column.type.compile(engine.dialect)}'))
+
+
+def _row(result):
+    row = result.first()
+    return tuple(row) if row is not None else None
+
+
+# Добавление новой записи
+def add_user(conn, clockify_userid, clockify_apikey, tg_username, email):
+    conn.execute(insert(users).values(clockify_userid=clockify_userid, clockify_apikey=clockify_apikey,
+                                      tg_username=tg_username, email=email))
+
+# Массовое добавление пользователей одной транзакцией
+def add_users_bulk(conn, rows):
+    if rows:
+        conn.execute(insert(users), [
+            {'clockify_userid': r[0], 'clockify_apikey': r[1], 'tg_username': r[2], 'email': r[3]} for r in rows
+        ])
+
+# Получение множества всех clockify_userid одним запросом
+def get_all_clockify_userids(conn):
+    return {row[0] for row in conn.execute(select(users.c.clockify_userid))}
+
+# Массовое удаление пользователей по clockify_userid
+def delete_users_bulk(conn, clockify_userids):
+    clockify_userids = list(clockify_userids)
+    # Вместе с пользователем удаляются его таймер, чат, очередь изменений и локальная копия записей
+    for table in USER_TABLES:
+        table = metadata.tables[table]
+        conn.execute(delete(table).where(table.c.clockify_userid.in_(clockify_userids)))
+    conn.execute(delete(users).where(users.c.clockify_userid.in_(clockify_userids)))
+
+# Получение данных по clockify_userid
+def get_user_by_clockify_userid(conn, clockify_userid):
+    return _row(conn.execute(select(*_columns).where(users.c.clockify_userid == clockify_userid)))
+
+# Получение данных по clockify_apikey
+def get_user_by_clockify_apikey(conn, clockify_apikey):
+    return _row(conn.execute(select(*_columns).where(users.c.clockify_apikey == clockify_apikey)))
+
+# Получение данных по tg_username
+def get_user_by_tg_username(conn, tg_username):
+    return _row(conn.execute(select(*_columns).where(users.c.tg_username == tg_username)))
+
+# Получение данных по email
+def get_user_by_email(conn, email):
+    return _row(conn.execute(select(*_columns).where(users.c.email == email)))
+
+# Проверка, существует ли пользователь по clockify_userid
+def user_exists(conn, clockify_userid):
+    return get_user_by_clockify_userid(conn, clockify_userid) is not None
+
+# Проверка, существует ли пользователь по email
+def user_exists_by_email(conn, email):
+    return get_user_by_email(conn, email) is not None
+
+# Обновление API-ключа и Telegram-юзернейма по email
+def update_user_by_email(conn, email, clockify_apikey, tg_username):
+    if user_exists_by_email(conn, email):
+        # Telegram-аккаунт может быть привязан только к одному пользователю
+        conn.execute(update(users)
+                     .where(users.c.tg_username == tg_username, users.c.email != email)
+                     .values(tg_username=TG_USERNAME_PLACEHOLDER))
+        conn.execute(update(users).where(users.c.email == email)
+                     .values(clockify_apikey=clockify_apikey, tg_username=tg_username))
+        logger.info("Updated user with email: %s", email)
+    else:
+        logger.info("User with email %s does not exist in the database.", email)
+
+# Обновление API-ключа по Telegram-юзернейму
+def update_api_key_by_tg_username(conn, tg_username, clockify_apikey):
+    result = conn.execute(update(users).where(users.c.tg_username == tg_username)
+                          .values(clockify_apikey=clockify_apikey))
+    if result.rowcount:
+        logger.info("Updated API key for user with tg_username: %s", tg_username)
+    else:
+        logger.info("User with tg_username %s does not exist in the database.", tg_username)
+
+# Часовой пояс пользователя; None — пояс по умолчанию
+def set_user_timezone(conn, clockify_userid, timezone):
+    conn.execute(update(users).where(users.c.clockify_userid == clockify_userid).values(timezone=timezone))
+
+
+# Сохранение запущенного таймера пользователя (заменяет предыдущий)
+def set_running_timer(conn, clockify_userid, entry_id, project_id, project_name, description, started_at):
+    conn.execute(delete(running_timers).where(running_timers.c.clockify_userid == clockify_userid))
+    conn.execute(insert(running_timers).values(clockify_userid=clockify_userid, entry_id=entry_id,
+                                               project_id=project_id, project_name=project_name,
+                                               description=description, started_at=started_at))
+
+# Получение запущенного таймера по clockify_userid
+def get_running_timer(conn, clockify_userid):
+    return _row(conn.execute(select(running_timers).where(running_timers.c.clockify_userid == clockify_userid)))
+
+# Получение всех запущенных таймеров
+def get_all_running_timers(conn):
+    return [tuple(row) for row in conn.execute(select(running_timers))]
+
+# Удаление запущенного таймера
+def delete_running_timer(conn, clockify_userid):
+    conn.execute(delete(running_timers).where(running_timers.c.clockify_userid == clockify_userid))
+
+
+# Сохранение записей времени пользователя, загруженных начиная с window_start
+def replace_time_entries(conn, clockify_userid, window_start, rows):
+    window = (time_entries.c.clockify_userid == clockify_userid) & (time_entries.c.start >= window_start)
+    days = {row[0] for row in conn.execute(select(time_entries.c.day).where(window).distinct())}
+    days.update(row[5] for row in rows)
+    conn.execute(delete(time_entries).where(window))
+    ids = [row[0] for row in rows]
+    if ids:
+        # Запись могла переехать в окно из более раннего дня — удаляем её старую версию
+        # и пересчитываем тот день
+        days.update(row[0] for row in conn.execute(select(time_entries.c.day).where(time_entries.c.id.in_(ids))))
+        conn.execute(delete(time_entries).where(time_entries.c.id.in_(ids)))
+        conn.execute(insert(time_entries), [
+            {'id': r[0], 'clockify_userid': r[1], 'project_id': r[2], 'description': r[3],
+             'start': r[4], 'day': r[5], 'seconds': r[6]} for r in rows
+        ])
+    if days:
+        conn.execute(delete(time_rollups).where(time_rollups.c.clockify_userid == clockify_userid,
+                                                time_rollups.c.day.in_(days)))
+        conn.execute(insert(time_rollups).from_select(
+            ['clockify_userid', 'day', 'project_id', 'seconds', 'entries'],
+            select(time_entries.c.clockify_userid, time_entries.c.day, time_entries.c.project_id,
+                   func.sum(time_entries.c.seconds), func.count())
+            .where(time_entries.c.clockify_userid == clockify_userid, time_entries.c.day.in_(days))
+            .group_by(time_entries.c.clockify_userid, time_entries.c.day, time_entries.c.project_id)
+        ))
+
+# Получение сумм по дням и проектам за период (включительно)
+def get_time_rollups(conn, clockify_userid, day_from, day_to):
+    query = (select(time_rollups.c.day, time_rollups.c.project_id, time_rollups.c.seconds, time_rollups.c.entries)
+             .where(time_rollups.c.clockify_userid == clockify_userid, time_rollups.c.day.between(day_from, day_to))
+             .order_by(time_rollups.c.day, time_rollups.c.project_id))
+    return [tuple(row) for row in conn.execute(query)]
+
+# Получение точки синхронизации записей времени пользователя
+def get_time_entries_sync(conn, clockify_userid):
+    return _row(conn.execute(select(time_entries_sync.c.synced_from, time_entries_sync.c.synced_at)
+                             .where(time_entries_sync.c.clockify_userid == clockify_userid)))
+
+# Сохранение точки синхронизации записей времени пользователя
+def set_time_entries_sync(conn, clockify_userid, synced_from, synced_at):
+    conn.execute(delete(time_entries_sync).where(time_entries_sync.c.clockify_userid == clockify_userid))
+    conn.execute(insert(time_entries_sync).values(clockify_userid=clockify_userid, synced_from=synced_from,
+                                                  synced_at=synced_at))
+
+
+# Сохранение чата Telegram пользователя (настройка напоминаний не меняется)
+def set_user_chat(conn, clockify_userid, chat_id):
+    result = conn.execute(update(user_chats).where(user_chats.c.clockify_userid == clockify_userid)
+                          .values(chat_id=chat_id))
+    if not result.rowcount:
+        conn.execute(insert(user_chats).values(clockify_userid=clockify_userid, chat_id=chat_id))
+
+# Включение и отключение напоминаний
+def set_reminders_enabled(conn, clockify_userid, enabled):
+    conn.execute(update(user_chats).where(user_chats.c.clockify_userid == clockify_userid)
+                 .values(reminders=1 if enabled else 0))
+
+# Получение зарегистрированных пользователей с включёнными напоминаниями
+# вместе с их запущенными таймерами — одним запросом
+def get_reminder_targets(conn):
+    query = (select(users.c.clockify_userid, users.c.clockify_apikey, user_chats.c.chat_id,
+                    running_timers.c.project_name, running_timers.c.started_at, users.c.timezone)
+             .join(user_chats, user_chats.c.clockify_userid == users.c.clockify_userid)
+             .outerjoin(running_timers, running_timers.c.clockify_userid == users.c.clockify_userid)
+             .where(user_chats.c.reminders == 1, users.c.clockify_apikey.not_in(API_KEY_PLACEHOLDERS)))
+    return [tuple(row) for row in conn.execute(query)]
+
+
+# Создание рассылки, возвращает её id
+def create_broadcast(conn, text, created_by, created_at):
+    result = conn.execute(insert(broadcasts).values(text=text, status='running', created_by=created_by,
+                                                    created_at=created_at))
+    return result.inserted_primary_key[0]
+
+# Получение рассылки по id
+def get_broadcast(conn, broadcast_id):
+    return _row(conn.execute(select(broadcasts).where(broadcasts.c.id == broadcast_id)))
+
+# Получение id незавершённых рассылок
+def get_running_broadcast_ids(conn):
+    return [row[0] for row in conn.execute(select(broadcasts.c.id).where(broadcasts.c.status == 'running')
+                                           .order_by(broadcasts.c.id))]
+
+# Завершение рассылки
+def finish_broadcast(conn, broadcast_id, status, finished_at):
+    conn.execute(update(broadcasts).where(broadcasts.c.id == broadcast_id)
+                 .values(status=status, finished_at=finished_at))
+
+# Следующая страница получателей рассылки, которым сообщение ещё не отправлялось
+def get_broadcast_recipients(conn, broadcast_id, after, limit):
+    delivered = (select(broadcast_deliveries.c.clockify_userid)
+                 .where(broadcast_deliveries.c.broadcast_id == broadcast_id,
+                        broadcast_deliveries.c.clockify_userid == user_chats.c.clockify_userid))
+    query = (select(user_chats.c.clockify_userid, user_chats.c.chat_id)
+             .join(users, users.c.clockify_userid == user_chats.c.clockify_userid)
+             .where(user_chats.c.clockify_userid > after, users.c.clockify_apikey.not_in(API_KEY_PLACEHOLDERS),
+                    ~delivered.exists())
+             .order_by(user_chats.c.clockify_userid)
+             .limit(limit))
+    return [tuple(row) for row in conn.execute(query)]
+
+# Сохранение результатов доставки пачкой: rows — (clockify_userid, status)
+def add_broadcast_deliveries(conn, broadcast_id, rows):
+    if not rows:
+        return
+    conn.execute(delete(broadcast_deliveries).where(
+        broadcast_deliveries.c.broadcast_id == broadcast_id,
+        broadcast_deliveries.c.clockify_userid.in_([clockify_userid for clockify_userid, _ in rows])))
+    conn.execute(insert(broadcast_deliveries), [
+        {'broadcast_id': broadcast_id, 'clockify_userid': clockify_userid, 'status': status}
+        for clockify_userid, status in rows
+    ])
+
+# Число доставок рассылки по статусам
+def get_broadcast_counts(conn, broadcast_id):
+    query = (select(broadcast_deliveries.c.status, func.count())
+             .where(broadcast_deliveries.c.broadcast_id == broadcast_id)
+             .group_by(broadcast_deliveries.c.status))
+    return {status: count for status, count in conn.execute(query)}
+
+
+# Очередь изменений для Clockify (см. outbox.py).
+# Добавление записи; None, если запись с таким ключом идемпотентности уже есть
+def add_outbox_entry(conn, clockify_userid, chat_id, action, payload, idempotency_key, created_at):
+    if conn.execute(select(outbox.c.id).where(outbox.c.idempotency_key == idempotency_key)).first():
+        return None
+    result = conn.execute(insert(outbox).values(clockify_userid=clockify_userid, chat_id=chat_id, action=action,
+                                                payload=payload, idempotency_key=idempotency_key, status='pending',
+                                                next_attempt_at=created_at, created_at=created_at))
+    return result.inserted_primary_key[0]
+
+# Первые по порядку ожидающие записи каждого пользователя, время отправки которых наступило
+def get_outbox_heads(conn, now, limit):
+    heads = select(func.min(outbox.c.id)).where(outbox.c.status == 'pending').group_by(outbox.c.clockify_userid)
+    query = (select(outbox.c.id, outbox.c.clockify_userid, outbox.c.chat_id, outbox.c.action, outbox.c.payload,
+                    outbox.c.idempotency_key, outbox.c.attempts, outbox.c.last_error)
+             .where(outbox.c.id.in_(heads), outbox.c.next_attempt_at <= now)
+             .order_by(outbox.c.id).limit(limit))
+    return [tuple(row) for row in conn.execute(query)]
+
+# Захват записи перед отправкой: False, если её уже взял другой экземпляр бота
+def claim_outbox_entry(conn, entry_id, attempts, next_attempt_at):
+    result = conn.execute(update(outbox)
+                          .where(outbox.c.id == entry_id, outbox.c.attempts == attempts, outbox.c.status == 'pending')
+                          .values(attempts=attempts + 1, next_attempt_at=next_attempt_at))
+    return result.rowcount == 1
+
+# Итог попытки: status = pending (повтор в next_attempt_at), done или dead
+def finish_outbox_entry(conn, entry_id, status, error, next_attempt_at, updated_at):
+    conn.execute(update(outbox).where(outbox.c.id == entry_id)
+                 .values(status=status, last_error=error, next_attempt_at=next_attempt_at, updated_at=updated_at))
+
+# Пользователи, у которых есть неотправленные изменения
+def get_outbox_pending_userids(conn):
+    return {row[0] for row in conn.execute(select(outbox.c.clockify_userid)
+                                           .where(outbox.c.status == 'pending').distinct())}
+
+# Число записей очереди по статусам
+def get_outbox_counts(conn):
+    return {status: count for status, count in
+            conn.execute(select(outbox.c.status, func.count()).group_by(outbox.c.status))}
+
+# Удаление отправленных записей, завершённых раньше before
+def delete_outbox_done(conn, before):
+    return conn.execute(delete(outbox).where(outbox.c.status == 'done', outbox.c.updated_at < before)).rowcount
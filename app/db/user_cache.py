@@ -0,0 +1,97 @@
+import os
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from db.engine import TG_USERNAME_PLACEHOLDER
+
+# Максимальное число пользователей в кэше
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+
+
+class UserRecord(NamedTuple):
+    """Строка таблицы users. Поддерживает и доступ по индексу, как кортеж из sqlite3."""
+    clockify_userid: str
+    clockify_apikey: str
+    tg_username: str
+    email: str
+    timezone: Optional[str] = None
+
+
+class UserCache:
+    """LRU-кэш пользователей с поиском по clockify_userid и tg_username."""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._records: 'OrderedDict[str, UserRecord]' = OrderedDict()
+        self._by_tg_username: Dict[str, str] = {}
+        self._by_email: Dict[str, str] = {}
+        # Номер поколения растёт при каждой инвалидации: чтение, начатое до записи,
+        # не должно положить в кэш устаревшую строку
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, clockify_userid: str) -> Optional[UserRecord]:
+        record = self._records.get(clockify_userid)
+        if record is None:
+            self.misses += 1
+            return None
+        self._records.move_to_end(clockify_userid)
+        self.hits += 1
+        return record
+
+    def get_by_tg_username(self, tg_username: str) -> Optional[UserRecord]:
+        clockify_userid = self._by_tg_username.get(tg_username)
+        if clockify_userid is None:
+            self.misses += 1
+            return None
+        return self.get(clockify_userid)
+
+    def put(self, record: UserRecord, generation: int) -> None:
+        if generation != self.generation:
+            return
+        self._discard(record.clockify_userid)
+        self._records[record.clockify_userid] = record
+        if record.tg_username != TG_USERNAME_PLACEHOLDER:
+            self._by_tg_username[record.tg_username] = record.clockify_userid
+        self._by_email[record.email] = record.clockify_userid
+        while len(self._records) > self.max_size:
+            self._discard(next(iter(self._records)))
+
+    def _discard(self, clockify_userid: str) -> None:
+        record = self._records.pop(clockify_userid, None)
+        if record is None:
+            return
+        if self._by_tg_username.get(record.tg_username) == clockify_userid:
+            del self._by_tg_username[record.tg_username]
+        if self._by_email.get(record.email) == clockify_userid:
+            del self._by_email[record.email]
+
+    def invalidate(self, clockify_userid: Optional[str] = None, tg_username: Optional[str] = None,
+                   email: Optional[str] = None) -> None:
+        """Удаление записей, совпадающих с любым из переданных ключей."""
+        self.generation += 1
+        for key, index in ((tg_username, self._by_tg_username), (email, self._by_email)):
+            if key is not None and key in index:
+                self._discard(index[key])
+        if clockify_userid is not None:
+            self._discard(clockify_userid)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._records.clear()
+        self._by_tg_username.clear()
+        self._by_email.clear()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._records),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,92 @@
+import csv
+import io
+from datetime import datetime, tzinfo
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
+
+from time_conversion import local_to_clockify, parse_local
+
+HEADER = ('project', 'description', 'start', 'end')
+
+
+class ImportRow(NamedTuple):
+    """Строка файла импорта после проверки."""
+    line: int
+    project: str
+    description: str
+    start: str
+    end: str
+
+
+class ImportFailure(NamedTuple):
+    """Строка файла импорта, не прошедшая проверку."""
+    line: int
+    error: str
+
+
+class ImportResult(NamedTuple):
+    """Итог обработки одной строки файла импорта."""
+    line: int
+    ok: bool
+    message: str
+
+
+def iter_text_lines(data: Union[bytes, io.BufferedIOBase]) -> Iterator[str]:
+    """Построчное чтение загруженного файла в UTF-8 (с BOM или без)."""
+    stream = io.BytesIO(data) if isinstance(data, bytes) else data
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def _detect_delimiter(first_line: str) -> str:
+    counts = {d: first_line.count(d) for d in (';', '\t', ',')}
+    return max(counts, key=counts.get) if any(counts.values()) else ';'
+
+
+def _parse_datetime(value: str) -> Optional[datetime]:
+    try:
+        return parse_local(value)
+    except ValueError:
+        return None
+
+
+def parse_entries(lines: Iterable[str], max_rows: int,
+                  tz: Optional[tzinfo] = None) -> Iterator[Union[ImportRow, ImportFailure]]:
+    """Разбор и проверка записей за один проход.
+
+    Ожидаемые колонки: проект, описание, начало, конец (YYYY-MM-DD HH:MM)
+    по времени пользователя tz. Разделитель (;, табуляция или запятая)
+    определяется по первой строке, строка заголовка пропускается.
+    """
+    lines = iter(lines)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+    delimiter = _detect_delimiter(first_line)
+
+    def chained():
+        yield first_line
+        yield from lines
+
+    rows = 0
+    for line_number, cells in enumerate(csv.reader(chained(), delimiter=delimiter), start=1):
+        if not cells or not any(cell.strip() for cell in cells):
+            continue
+        if line_number == 1 and tuple(cell.strip().lower() for cell in cells[:4]) == HEADER:
+            continue
+        rows += 1
+        if rows > max_rows:
+            yield ImportFailure(line_number, f"превышен лимит в {max_rows} записей, остаток файла пропущен")
+            return
+        if len(cells) != 4:
+            yield ImportFailure(line_number, f"ожидалось 4 колонки, получено {len(cells)}")
+            continue
+        project, description, start_str, end_str = (cell.strip() for cell in cells)
+        start, end = _parse_datetime(start_str), _parse_datetime(end_str)
+        if not project:
+            yield ImportFailure(line_number, "не указан проект")
+        elif start is None or end is None:
+            yield ImportFailure(line_number, "дата и время должны быть в формате YYYY-MM-DD HH:MM")
+        elif end <= start:
+            yield ImportFailure(line_number, "время окончания должно быть позже начала")
+        else:
+            yield ImportRow(line_number, project, description,
+                            local_to_clockify(start, tz), local_to_clockify(end, tz))
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from db.engine import get_pool, migrate
+
+logger = logging.getLogger(__name__)
+
+# Хранилище состояний диалогов: memory, sqlite или redis
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Через сколько секунд бездействия незавершённый диалог удаляется
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', str(24 * 60 * 60)))
+# Задержка отложенной записи: изменения за это время сохраняются одной пачкой
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '0.2'))
+
+# Короткие имена для полей, которые хранят формы бота
+_SHORT_KEYS = {
+    'project': 'p',
+    'description': 'd',
+    'start_date': 'sd',
+    'start_time': 'st',
+    'end_date': 'ed',
+    'end_time': 'et',
+    'email': 'm',
+    'tg_username': 'u',
+}
+_LONG_KEYS = {short: long for long, short in _SHORT_KEYS.items()}
+
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+def encode_data(data: Mapping[str, Any]) -> str:
+    """Компактная сериализация данных формы в JSON."""
+    return json.dumps({_SHORT_KEYS.get(k, k): v for k, v in data.items()},
+                      separators=(',', ':'), ensure_ascii=False)
+
+
+def decode_data(raw: Optional[str]) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    return {_LONG_KEYS.get(k, k): v for k, v in json.loads(raw).items()}
+
+
+def build_key(key: StorageKey) -> str:
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id:
+        parts.append(f't{key.thread_id}')
+    business_connection_id = getattr(key, 'business_connection_id', None)
+    if business_connection_id:
+        parts.append(f'b{business_connection_id}')
+    parts.append(key.destiny)
+    return ':'.join(parts)
+
+
+class SQLiteFSMBackend:
+    """Состояния диалогов в таблице fsm_states базы бота."""
+
+    def __init__(self, pool=None):
+        self.pool = pool or get_pool()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm')
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get(self, key: str, newer_than: float) -> Optional[Tuple[Optional[str], str]]:
+        # Просроченный диалог, который очистка ещё не удалила, считается отсутствующим
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT state, data FROM fsm_states WHERE key = ? AND updated_at >= ?',
+                                (key, newer_than)).fetchone()
+
+    def _write(self, upserts: Dict[str, Tuple[Optional[str], str]], deletes: Iterable[str]) -> None:
+        now = time.time()
+        with self.pool.connection() as conn:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                                    updated_at = excluded.updated_at
+                ''', [(key, state, data, now) for key, (state, data) in upserts.items()])
+                conn.executemany('DELETE FROM fsm_states WHERE key = ?', [(key,) for key in deletes])
+
+    def _purge(self, older_than: float) -> int:
+        with self.pool.connection() as conn:
+            with conn:
+                return conn.execute('DELETE FROM fsm_states WHERE updated_at < ?', (older_than,)).rowcount
+
+    async def init(self) -> None:
+        def init_schema():
+            with self.pool.connection() as conn:
+                migrate(conn)
+        await self._run(init_schema)
+
+    async def get(self, key: str, ttl: int) -> Optional[Tuple[Optional[str], str]]:
+        return await self._run(self._get, key, time.time() - ttl)
+
+    async def write(self, upserts: Dict[str, Tuple[Optional[str], str]], deletes: Iterable[str], ttl: int) -> None:
+        await self._run(self._write, upserts, list(deletes))
+
+    async def purge(self, ttl: int) -> int:
+        return await self._run(self._purge, time.time() - ttl)
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class RedisFSMBackend:
+    """Состояния диалогов в Redis (или в любом клиенте с API redis.asyncio).
+
+    Срок жизни задаётся через EX, поэтому отдельная очистка не нужна.
+    """
+
+    def __init__(self, client, prefix: str = 'fsm'):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f'{self.prefix}:{key}'
+
+    async def init(self) -> None:
+        pass
+
+    async def get(self, key: str, ttl: int) -> Optional[Tuple[Optional[str], str]]:
+        raw = await self.client.get(self._key(key))
+        if raw is None:
+            return None
+        state, data = json.loads(raw)
+        return state, data
+
+    async def write(self, upserts: Dict[str, Tuple[Optional[str], str]], deletes: Iterable[str], ttl: int) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for key, (state, data) in upserts.items():
+            pipe.set(self._key(key), json.dumps([state, data], separators=(',', ':'), ensure_ascii=False), ex=ttl)
+        for key in deletes:
+            pipe.delete(self._key(key))
+        await pipe.execute()
+
+    async def purge(self, ttl: int) -> int:
+        return 0
+
+    async def close(self) -> None:
+        close = getattr(self.client, 'aclose', None) or self.client.close
+        await close()
+
+
+class PersistentStorage(BaseStorage):
+    """Хранилище FSM aiogram с отложенной пакетной записью.
+
+    Изменения копятся в памяти и сохраняются одной пачкой раз в flush_interval,
+    поэтому set_state и update_data в одном обработчике дают одну запись.
+    Диалоги без активности дольше ttl удаляются.
+    """
+
+    def __init__(self, backend, ttl: int = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.backend = backend
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Record] = {}
+        # Пачка, которая сейчас записывается: чтение должно видеть её, а не старые данные
+        self._flushing: Dict[str, Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.flushes = 0
+
+    async def init(self) -> None:
+        await self.backend.init()
+
+    async def _load(self, key: str) -> Record:
+        if key in self._pending:
+            return self._pending[key]
+        if key in self._flushing:
+            return self._flushing[key]
+        row = await self.backend.get(key, self.ttl)
+        if row is None:
+            return None, {}
+        return row[0], decode_data(row[1])
+
+    def _stage(self, key: str, record: Record) -> None:
+        self._pending[key] = record
+        self.writes += 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Сохранение всех отложенных изменений."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        self._flushing.update(batch)
+        upserts = {key: (state, encode_data(data)) for key, (state, data) in batch.items() if state or data}
+        deletes = [key for key, (state, data) in batch.items() if not state and not data]
+        try:
+            await self.backend.write(upserts, deletes, self.ttl)
+            self.flushes += 1
+        except Exception as e:
+            logger.warning("FSM storage flush failed: %s", e)
+            # Возвращаем несохранённое, не затирая более свежие изменения
+            for key, record in batch.items():
+                self._pending.setdefault(key, record)
+            if self._flush_task is None or self._flush_task.done() or self._flush_task is asyncio.current_task():
+                self._flush_task = asyncio.create_task(self._flush_later())
+        finally:
+            for key, record in batch.items():
+                if self._flushing.get(key) is record:
+                    del self._flushing[key]
+
+    async def cleanup(self) -> int:
+        """Удаление просроченных диалогов."""
+        removed = await self.backend.purge(self.ttl)
+        if removed:
+            logger.info("Removed %d expired FSM states", removed)
+        return removed
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = build_key(key)
+        _, data = await self._load(storage_key)
+        self._stage(storage_key, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(build_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = build_key(key)
+        state, _ = await self._load(storage_key)
+        self._stage(storage_key, (state, dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(build_key(key))
+        return dict(data)
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await self.backend.close()
+
+
+def create_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    """Создание хранилища FSM по настройке FSM_STORAGE."""
+    if kind == 'memory':
+        return MemoryStorage()
+    if kind == 'redis':
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis требует пакета redis: poetry install --extras redis") from e
+        return PersistentStorage(RedisFSMBackend(Redis.from_url(REDIS_URL)))
+    if kind == 'sqlite':
+        return PersistentStorage(SQLiteFSMBackend())
+    raise ValueError(f"Unknown FSM_STORAGE: {kind}")
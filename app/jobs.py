@@ -0,0 +1,165 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from project_cache import PROJECT_CACHE_TTL
+from time_conversion import get_timezone
+
+logger = logging.getLogger(__name__)
+
+# Интервал фоновой синхронизации пользователей рабочего пространства (в минутах)
+USER_SYNC_INTERVAL = int(os.getenv('USER_SYNC_INTERVAL', '15'))
+# Удалять пользователей, пропавших из Clockify (не больше USER_SYNC_MAX_REMOVE_SHARE за раз)
+USER_SYNC_REMOVE_MISSING = os.getenv('USER_SYNC_REMOVE_MISSING', '0') == '1'
+# Интервал сверки запущенных таймеров с Clockify (в минутах)
+TIMER_RECONCILE_INTERVAL = int(os.getenv('TIMER_RECONCILE_INTERVAL', '10'))
+# Рабочие часы по часовому поясу по умолчанию, DEFAULT_TIMEZONE (пн–пт)
+WORKDAY_START = os.getenv('WORKDAY_START', '09:00')
+WORKDAY_END = os.getenv('WORKDAY_END', '19:00')
+# За сколько минут до начала рабочего дня прогревать кэши
+WARMUP_LEAD_MINUTES = int(os.getenv('WARMUP_LEAD_MINUTES', '15'))
+# Время напоминаний: «таймер не запущен» и «таймер не остановлен»
+REMINDERS_ENABLED = os.getenv('REMINDERS_ENABLED', '1') == '1'
+REMINDER_START_TIME = os.getenv('REMINDER_START_TIME', '10:30')
+REMINDER_STOP_TIME = os.getenv('REMINDER_STOP_TIME', '19:30')
+
+WORKDAYS = 'mon-fri'
+
+default_tz = get_timezone()
+
+
+def _parse_hhmm(value: str):
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def is_working_time(now: Optional[datetime] = None) -> bool:
+    now = now or datetime.now(default_tz)
+    return now.weekday() < 5 and _parse_hhmm(WORKDAY_START) <= now.time() < _parse_hhmm(WORKDAY_END)
+
+
+class JobStats:
+    """Счётчики и время выполнения одной фоновой задачи."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.running = False
+        self.last_started: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_result: Any = None
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class JobRunner:
+    """Фоновые задачи бота на APScheduler (время — по часовому поясу DEFAULT_TIMEZONE).
+
+    Задача не запускается, пока не завершился её предыдущий запуск; такие
+    пропуски, число запусков, ошибки и длительность последнего запуска
+    доступны через stats().
+    """
+
+    def __init__(self, scheduler: Optional[AsyncIOScheduler] = None):
+        self.scheduler = scheduler or AsyncIOScheduler(timezone=default_tz)
+        self.jobs: Dict[str, JobStats] = {}
+        self.scheduler.add_listener(self._on_skipped, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+
+    def _on_skipped(self, event) -> None:
+        stats = self.jobs.get(event.job_id)
+        if stats is not None:
+            stats.skipped += 1
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], trigger: str, *args, **trigger_args) -> None:
+        stats = self.jobs[name] = JobStats(name)
+
+        async def run():
+            stats.running = True
+            stats.last_started = time.time()
+            started = time.monotonic()
+            try:
+                stats.last_result = await func(*args)
+                stats.last_error = None
+                stats.runs += 1
+            except Exception as e:
+                stats.failures += 1
+                stats.last_error = str(e)
+                logger.exception("Job %s failed: %s", name, e)
+            finally:
+                stats.running = False
+                stats.last_duration = time.monotonic() - started
+                logger.info("Job %s finished in %.2fs", name, stats.last_duration)
+
+        # max_instances=1: запуск, пока идёт предыдущий, пропускается (и учитывается в skipped);
+        # coalesce: пропущенные запуски не копятся, а сливаются в один
+        self.scheduler.add_job(run, trigger, id=name, name=name, max_instances=1, coalesce=True,
+                               misfire_grace_time=60, **trigger_args)
+
+    def start(self) -> None:
+        self.scheduler.start()
+
+    def shutdown(self) -> None:
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for name, stats in self.jobs.items():
+            job = self.scheduler.get_job(name)
+            result[name] = stats.as_dict()
+            result[name]['next_run_time'] = job.next_run_time.isoformat() if job and job.next_run_time else None
+        return result
+
+
+def register_jobs(runner: JobRunner, api, user_manager, time_entry_manager, reminders=None, storage=None,
+                  on_user_sync=None) -> None:
+    """Регистрация всех фоновых задач бота.
+
+    on_user_sync вызывается после синхронизации, изменившей таблицу users
+    (в многопроцессном режиме — сброс кэшей пользователей в обработчиках).
+    """
+    start = _parse_hhmm(WORKDAY_START)
+    warmup = (datetime.combine(datetime.today(), start) - timedelta(minutes=WARMUP_LEAD_MINUTES)).time()
+
+    async def sync_users():
+        result = await user_manager.sync_users(api, remove_missing=USER_SYNC_REMOVE_MISSING)
+        if on_user_sync is not None and (result['inserted'] or result['removed']):
+            on_user_sync()
+        return result
+
+    async def warmup_caches():
+        await api.project_cache.refresh()
+        return await sync_users()
+
+    async def refresh_projects():
+        # Вне рабочего времени кэш обновится по TTL при первом обращении
+        if not is_working_time():
+            return None
+        await api.project_cache.refresh()
+        return len(api.project_cache.index)
+
+    # Синхронизация пользователей выполняется в фоне, а не на каждый /start
+    runner.add('user_sync', sync_users, 'interval',
+               minutes=USER_SYNC_INTERVAL, next_run_time=datetime.now(default_tz))
+    runner.add('cache_warmup', warmup_caches, 'cron', day_of_week=WORKDAYS, hour=warmup.hour, minute=warmup.minute)
+    # Проекты обновляются раньше, чем истечёт TTL, чтобы запросы в рабочее время не ждали Clockify
+    runner.add('project_refresh', refresh_projects, 'interval', seconds=max(60, int(PROJECT_CACHE_TTL * 0.8)))
+    runner.add('timer_reconcile', time_entry_manager.reconcile_running_timers, 'interval', api,
+               minutes=TIMER_RECONCILE_INTERVAL)
+    if storage is not None:
+        # Очистка незавершённых диалогов, которые старше FSM_STATE_TTL
+        runner.add('fsm_cleanup', storage.cleanup, 'interval', hours=1)
+    if reminders is not None and REMINDERS_ENABLED:
+        remind_start, remind_stop = _parse_hhmm(REMINDER_START_TIME), _parse_hhmm(REMINDER_STOP_TIME)
+        runner.add('remind_not_started', reminders.remind_not_started, 'cron',
+                   day_of_week=WORKDAYS, hour=remind_start.hour, minute=remind_start.minute)
+        runner.add('remind_not_stopped', reminders.remind_not_stopped, 'cron',
+                   day_of_week=WORKDAYS, hour=remind_stop.hour, minute=remind_stop.minute)
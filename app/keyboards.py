@@ -0,0 +1,224 @@
+import bisect
+import os
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+# Шаг слотов времени в клавиатурах, минут (15, 30 или 60)
+TIME_SLOT_STEP = int(os.getenv('TIME_SLOT_STEP', '30'))
+# Проектов на одной странице клавиатуры выбора проекта
+PROJECTS_PER_PAGE = int(os.getenv('PROJECTS_PER_PAGE', '10'))
+# Сколько дней назад можно выбрать дату начала
+DATE_KEYBOARD_DAYS = 6
+
+ALLOWED_STEPS = (15, 30, 60)
+MINUTES_IN_DAY = 24 * 60
+
+PREV_PAGE = '« Назад'
+NEXT_PAGE = 'Далее »'
+WEEKDAYS = ('пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс')
+
+# Готовые клавиатуры из кэшей ниже — общие объекты для всех пользователей.
+# Разметка aiogram изменяема (MutableTelegramObject), поэтому вызывающий код
+# не должен менять полученную клавиатуру: изменение увидят все, кому она достанется.
+
+
+def _check_step(step: int) -> int:
+    if step not in ALLOWED_STEPS:
+        raise ValueError(f"Unsupported time slot step: {step}")
+    return step
+
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02}:{minutes % 60:02}"
+
+
+def parse_time(text: str) -> Optional[int]:
+    """Время ЧЧ:ММ в минутах от начала суток; None, если строка не похожа на время."""
+    hours, sep, minutes = text.strip().partition(':')
+    if not sep or not hours.isdecimal() or not minutes.isdecimal() or len(minutes) != 2:
+        return None
+    value = int(hours) * 60 + int(minutes)
+    return value if int(hours) < 24 and int(minutes) < 60 else None
+
+
+def parse_date(text: str) -> Optional[date]:
+    """Дата ГГГГ-ММ-ДД; None, если строка не похожа на дату."""
+    try:
+        return date.fromisoformat(text.strip())
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=None)
+def time_slots(step: int = TIME_SLOT_STEP) -> Tuple[int, ...]:
+    """Слоты суток в минутах с шагом step."""
+    return tuple(range(0, MINUTES_IN_DAY, _check_step(step)))
+
+
+def _rows(buttons: Sequence[KeyboardButton], columns: int) -> List[List[KeyboardButton]]:
+    return [list(buttons[i:i + columns]) for i in range(0, len(buttons), columns)]
+
+
+def _markup(rows: List[List[KeyboardButton]]) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(keyboard=rows, resize_keyboard=True, one_time_keyboard=True)
+
+
+@lru_cache(maxsize=None)
+def _time_buttons(step: int) -> Tuple[KeyboardButton, ...]:
+    return tuple(KeyboardButton(text=format_minutes(minutes)) for minutes in time_slots(step))
+
+
+@lru_cache(maxsize=512)
+def time_keyboard(limit: Optional[int] = None, step: int = TIME_SLOT_STEP) -> Optional[ReplyKeyboardMarkup]:
+    """Клавиатура времени: слоты строго позже limit (в минутах).
+
+    Граница ищется бинарным поиском по таблице слотов, кнопки берутся готовые; при мелком шаге
+    в строке больше кнопок, чтобы клавиатура не растягивалась. None, если позже limit
+    слотов нет: пустую клавиатуру Telegram не примет, время вводится вручную.
+    """
+    slots = time_slots(step)
+    first = 0 if limit is None else bisect.bisect_right(slots, limit)
+    buttons = _time_buttons(step)[first:]
+    if not buttons:
+        return None
+    return _markup(_rows(buttons, max(2, 60 // step)))
+
+
+@lru_cache(maxsize=32)
+def date_keyboard(today: date) -> ReplyKeyboardMarkup:
+    """Даты от сегодня до DATE_KEYBOARD_DAYS - 1 дней назад."""
+    return _markup([[KeyboardButton(text=(today - timedelta(days=i)).isoformat())]
+                    for i in range(DATE_KEYBOARD_DAYS)])
+
+
+@lru_cache(maxsize=256)
+def end_date_keyboard(start_date: str, today: date) -> ReplyKeyboardMarkup:
+    """Даты окончания: сегодня и завтра для записи, начатой сегодня, иначе от даты начала до сегодня."""
+    if start_date == today.isoformat():
+        dates = [today, today + timedelta(days=1)]
+    else:
+        start = date.fromisoformat(start_date)
+        dates = [start + timedelta(days=i) for i in range((today - start).days + 1)]
+    return _markup([[KeyboardButton(text=day.isoformat())] for day in dates])
+
+
+def page_count(total: int, per_page: int = PROJECTS_PER_PAGE) -> int:
+    return max(1, -(-total // per_page))
+
+
+@lru_cache(maxsize=1024)
+def project_keyboard(projects: Tuple[str, ...], page: int = 0,
+                     per_page: int = PROJECTS_PER_PAGE) -> ReplyKeyboardMarkup:
+    """Страница клавиатуры проектов с кнопками листания.
+
+    Ключ кэша — кортеж имён проектов пользователя: у участников одних
+    и тех же проектов клавиатура общая.
+    """
+    pages = page_count(len(projects), per_page)
+    page = min(max(page, 0), pages - 1)
+    rows = [[KeyboardButton(text=name)] for name in projects[page * per_page:(page + 1) * per_page]]
+    navigation = []
+    if page > 0:
+        navigation.append(KeyboardButton(text=PREV_PAGE))
+    if page < pages - 1:
+        navigation.append(KeyboardButton(text=NEXT_PAGE))
+    if navigation:
+        rows.append(navigation)
+    return _markup(rows)
+
+
+def turn_page(text: str, page: int) -> Optional[int]:
+    """Номер новой страницы, если нажата кнопка листания, иначе None."""
+    if text == PREV_PAGE:
+        return page - 1
+    if text == NEXT_PAGE:
+        return page + 1
+    return None
+
+
+@lru_cache(maxsize=None)
+def choice_keyboard(*options: str) -> ReplyKeyboardMarkup:
+    return _markup([[KeyboardButton(text=option)] for option in options])
+
+
+class EntryCallback(CallbackData, prefix='te'):
+    """Данные кнопок быстрой записи времени: te:<действие>:<значение>.
+
+    Действия: p — проект (ID), pg — страница проектов, d — день (сколько дней назад),
+    t — время (минуты от начала суток), n — без описания, r — повтор последней записи,
+    e — изменить время, s — сохранить, x — отмена, _ — кнопка-подпись.
+    """
+    action: str
+    value: str = ''
+
+
+def _inline(text: str, action: str, value='') -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=EntryCallback(action=action, value=str(value)).pack())
+
+
+CANCEL_ROW = (_inline('Отмена', 'x'),)
+
+
+def day_label(day: date) -> str:
+    return f"{WEEKDAYS[day.weekday()]} {day.strftime('%d.%m')}"
+
+
+@lru_cache(maxsize=None)
+def _inline_time_buttons(step: int) -> Tuple[InlineKeyboardButton, ...]:
+    return tuple(_inline(format_minutes(minutes), 't', minutes) for minutes in time_slots(step))
+
+
+@lru_cache(maxsize=1024)
+def datetime_picker(today: date, offset: int, min_offset: int, max_offset: int,
+                    limit: Optional[int] = None, step: int = TIME_SLOT_STEP) -> InlineKeyboardMarkup:
+    """Выбор даты и времени в одной клавиатуре.
+
+    День задаётся смещением offset от today в прошлое (отрицательное — будущее),
+    листается стрелками в пределах [min_offset, max_offset]. Слоты времени —
+    не раньше limit минут.
+    """
+    slots = time_slots(step)
+    first = 0 if limit is None else bisect.bisect_left(slots, limit)
+    navigation = [
+        _inline('‹', 'd', offset + 1) if offset < max_offset else _inline(' ', '_'),
+        _inline(day_label(today - timedelta(days=offset)), '_'),
+        _inline('›', 'd', offset - 1) if offset > min_offset else _inline(' ', '_'),
+    ]
+    rows = [navigation] + _rows(_inline_time_buttons(step)[first:], 6 if step >= 30 else 8)
+    return InlineKeyboardMarkup(inline_keyboard=rows + [list(CANCEL_ROW)])
+
+
+@lru_cache(maxsize=1024)
+def inline_project_keyboard(projects: Tuple[Tuple[str, str], ...], page: int = 0,
+                            per_page: int = PROJECTS_PER_PAGE, repeat: bool = True) -> InlineKeyboardMarkup:
+    """Страница проектов (пары имя, ID) для быстрой записи с кнопкой повтора последней записи."""
+    pages = page_count(len(projects), per_page)
+    page = min(max(page, 0), pages - 1)
+    rows = [[_inline(name, 'p', project_id)]
+            for name, project_id in projects[page * per_page:(page + 1) * per_page]]
+    navigation = []
+    if page > 0:
+        navigation.append(_inline(PREV_PAGE, 'pg', page - 1))
+    if page < pages - 1:
+        navigation.append(_inline(NEXT_PAGE, 'pg', page + 1))
+    if navigation:
+        rows.append(navigation)
+    if repeat:
+        rows.append([_inline('Повторить последнюю запись', 'r')])
+    return InlineKeyboardMarkup(inline_keyboard=rows + [list(CANCEL_ROW)])
+
+
+DESCRIPTION_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[[_inline('Без описания', 'n')], list(CANCEL_ROW)])
+CONFIRM_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [_inline('Сохранить', 's')], [_inline('Изменить время', 'e')], list(CANCEL_ROW)])
+
+
+def cache_stats() -> dict:
+    return {name: func.cache_info().currsize
+            for name, func in (('time', time_keyboard), ('date', date_keyboard),
+                               ('end_date', end_date_keyboard), ('project', project_keyboard),
+                               ('datetime_picker', datetime_picker), ('inline_project', inline_project_keyboard))}
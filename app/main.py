@@ -1,39 +1,100 @@
 import asyncio
-import os
-import logging
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram import Router
+from typing import Optional
 from dotenv import load_dotenv
-from db.engine import create_connection, create_table
-from db.methods import get_user_by_tg_username
-from clockify_api import ClockifyAPI
-import start_commands
-import time_entry_commands
 
-# Загрузка токена Telegram из .env
+# Переменные из .env загружаются до импорта модулей бота: их настройки читаются при импорте
 load_dotenv()
-API_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
-# Настройки логирования
-logging.basicConfig(level=logging.INFO)
+from aiogram import Dispatcher  # noqa: E402
+from aiogram.fsm.storage.memory import SimpleEventIsolation  # noqa: E402
+from container import Container  # noqa: E402
+from jobs import register_jobs  # noqa: E402
+from fsm_storage import PersistentStorage  # noqa: E402
+from outbox import OUTBOX_ENABLED  # noqa: E402
+from workers import WORKERS, ShardingMiddleware, WorkerPool  # noqa: E402
+import start_commands  # noqa: E402
+import time_entry_commands  # noqa: E402
+import quick_entry_commands  # noqa: E402
+import report_commands  # noqa: E402
+import admin_commands  # noqa: E402
+from webhook import BOT_MODE, WEBAPP_HOST, WEBAPP_PORT, run_webhook  # noqa: E402
+from metrics import REGISTRY, setup_logging, start_metrics_server  # noqa: E402
+from middlewares import HandlerMetricsMiddleware, ServicesMiddleware, UpdateContextMiddleware  # noqa: E402
 
-# Инициализация бота и диспетчера
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-router = Router()
+# Настройки логирования: JSON с correlation ID обновления (LOG_FORMAT=text — обычный текст)
+setup_logging()
 
-# Инициализация Clockify API и базы данных
-clockify_api = ClockifyAPI()
-db_conn = create_connection()
 
-# Регистрация роутеров и запуск
-async def main():
-    create_table(db_conn)
+def create_dispatcher(container: Container, pool: Optional[WorkerPool] = None) -> Dispatcher:
+    """Диспетчер с middleware и роутерами; объекты приложения берутся из контейнера.
+
+    С pool это диспетчер фронта: обновления передаются процессам-обработчикам, кроме команд
+    администратора. Их фронт выполняет сам: фоновые задачи и рассылки работают только в нём,
+    а остальные роутеры подключаются ради списка типов обновлений для Telegram.
+    """
+    if pool is not None:
+        dp = Dispatcher()
+        dp.update.outer_middleware(ShardingMiddleware(pool, local=admin_commands.is_admin_command))
+    else:
+        # Обновления одного пользователя обрабатываются по очереди, разных — параллельно
+        dp = Dispatcher(storage=container.storage, events_isolation=SimpleEventIsolation())
+
+    # Метрики: время обработки обновлений, обработчиков и диалогов FSM
+    dp.update.outer_middleware(UpdateContextMiddleware())
+    handler_metrics = HandlerMetricsMiddleware()
+    services = ServicesMiddleware(container)
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(handler_metrics)
+        observer.middleware(services)
+    dp['container'] = container
+
     dp.include_router(start_commands.router)
     dp.include_router(time_entry_commands.router)
-    await dp.start_polling(bot)
+    dp.include_router(quick_entry_commands.router)
+    dp.include_router(report_commands.router)
+    dp.include_router(admin_commands.router)
+    return dp
+
+
+# Запуск
+async def main():
+    container = Container()
+    # При WORKERS > 1 этот процесс — фронт: принимает обновления и выполняет фоновые задачи,
+    # а обновления обрабатывают процессы-обработчики (workers.py)
+    pool = WorkerPool(WORKERS, create_dispatcher) if WORKERS > 1 else None
+    dp = create_dispatcher(container, pool)
+    bot = container.bot
+    container.register_stats(REGISTRY)
+    try:
+        await container.startup()
+        if pool is not None:
+            pool.start()
+            REGISTRY.register_stats('worker', pool.stats)
+        # Синхронизация пользователей, прогрев кэшей и напоминания выполняются в фоне
+        register_jobs(container.job_runner, container.clockify_api, container.user_manager,
+                      container.time_entry_manager, reminders=container.reminders,
+                      storage=container.storage if isinstance(container.storage, PersistentStorage) else None,
+                      on_user_sync=pool.clear_user_caches if pool is not None else None)
+        container.job_runner.start()
+        # Рассылки, прерванные прошлой остановкой бота, продолжаются с места остановки
+        await container.broadcast_manager.resume()
+        # Изменения записей времени, не отправленные в Clockify до остановки, отправляются снова
+        # (в многопроцессном режиме очередь разбирают обработчики)
+        if OUTBOX_ENABLED and pool is None:
+            container.outbox.start()
+        if BOT_MODE == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            # В режиме polling /metrics отдаёт отдельный сервер на том же порту
+            metrics_runner = await start_metrics_server(WEBAPP_HOST, WEBAPP_PORT)
+            try:
+                await dp.start_polling(bot)
+            finally:
+                await metrics_runner.cleanup()
+    finally:
+        if pool is not None:
+            await pool.close()
+        await container.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
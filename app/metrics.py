@@ -0,0 +1,226 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+# Формат логов: json (по строке JSON на запись) или text
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Идентификатор обрабатываемого обновления Telegram: попадает во все записи лога
+correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar('correlation_id', default='-')
+
+_OBJECT_ID = re.compile(r'[0-9a-f]{24}')
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    """Гистограмма Prometheus. observe() можно вызывать из любого потока."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счётчики по корзинам, сумма и число наблюдений
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}')
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    """Набор метрик и источников статистики для экспорта в формате Prometheus."""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._stats: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, source: Callable[[], Dict[str, Any]]) -> None:
+        """Числовые значения из stats() компонента экспортируются как gauge с именем prefix_key."""
+        self._stats[prefix] = source
+
+    def collect_stats(self) -> Dict[str, float]:
+        """Числовые значения всех источников статистики по именам prefix_key."""
+        result: Dict[str, float] = {}
+        for prefix, source in self._stats.items():
+            try:
+                stats = source()
+            except Exception as e:
+                logging.getLogger(__name__).warning("stats source %s failed: %s", prefix, e)
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                result[f'{prefix}_{key}'] = value
+        return result
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for name, value in self.collect_stats().items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CLOCKIFY_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'clockify_request_seconds', 'Clockify API request latency (one HTTP attempt)', ('method', 'endpoint', 'status')))
+TELEGRAM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'telegram_request_seconds', 'Telegram Bot API request latency', ('method', 'status')))
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    'bot_handler_seconds', 'Handler execution time', ('handler', 'status')))
+UPDATE_SECONDS = REGISTRY.register(Histogram(
+    'bot_update_seconds', 'Total update processing time', ('type',)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'db_query_seconds', 'Database function execution time', ('function',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+FSM_DIALOG_SECONDS = REGISTRY.register(Histogram(
+    'fsm_dialog_seconds', 'Time from the first to the last step of a dialogue', ('form',),
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)))
+FSM_DIALOGS_TOTAL = REGISTRY.register(Counter(
+    'fsm_dialogs_total', 'Dialogues by outcome (started, completed, abandoned)', ('form', 'outcome')))
+
+
+def endpoint_label(endpoint: str) -> str:
+    """Эндпоинт без идентификаторов, чтобы число временных рядов не росло с числом пользователей."""
+    return _OBJECT_ID.sub('{id}', endpoint.split('?', 1)[0])
+
+
+def new_correlation_id(prefix: Optional[Any] = None) -> str:
+    suffix = uuid.uuid4().hex[:8]
+    return f'{prefix}-{suffix}' if prefix is not None else suffix
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'correlation_id': correlation_id.get(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(fmt: str = LOG_FORMAT, level: str = LOG_LEVEL) -> None:
+    handler = logging.StreamHandler()
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s'))
+        handler.addFilter(_CorrelationFilter())
+    logging.basicConfig(level=level, handlers=[handler], force=True)
+
+
+class _CorrelationFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+def add_metrics_route(app: web.Application, path: str = METRICS_PATH) -> None:
+    app.router.add_get(path, metrics_handler)
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Отдельный HTTP-сервер с /metrics (в режиме polling, где нет сервера webhook)."""
+    app = web.Application()
+    add_metrics_route(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.getLogger(__name__).info("Metrics available on %s:%s%s", host, port, METRICS_PATH)
+    return runner
@@ -0,0 +1,116 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject, Update
+
+from metrics import (FSM_DIALOG_SECONDS, FSM_DIALOGS_TOTAL, HANDLER_SECONDS, TELEGRAM_REQUEST_SECONDS,
+                     UPDATE_SECONDS, correlation_id, new_correlation_id)
+
+# Сколько незавершённых диалогов помнить для замера их длительности
+FSM_TRACKED_DIALOGS_LIMIT = 10000
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    """Внешний middleware обновлений: correlation ID для логов и общее время обработки."""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        # Значение не сбрасывается после обработки, чтобы итоговая запись aiogram
+        # об обновлении тоже получила его ID; следующее обновление задаёт свой
+        correlation_id.set(new_correlation_id(getattr(event, 'update_id', None)))
+        update_type = event.event_type if isinstance(event, Update) else type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, type=update_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время каждого обработчика и длительность диалогов FSM.
+
+    Диалог начинается, когда у пользователя появляется состояние, и завершается,
+    когда оно сбрасывается; группа состояний (форма) определяет метку form.
+    """
+
+    def __init__(self):
+        self._dialogs: Dict[Tuple[int, int], Tuple[str, float]] = {}
+
+    @staticmethod
+    def _form(state: Optional[str]) -> str:
+        return state.split(':', 1)[0] if state else ''
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        state_before = data.get('raw_state')
+        status = 'error'
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+            status = 'ok'
+            return result
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name, status=status)
+            fsm_context = data.get('state')
+            if fsm_context is not None:
+                await self._track_dialog(fsm_context, state_before)
+
+    async def _track_dialog(self, fsm_context, state_before: Optional[str]) -> None:
+        state_after = await fsm_context.get_state()
+        if state_after == state_before:
+            return
+        key = (fsm_context.key.chat_id, fsm_context.key.user_id)
+        now = time.monotonic()
+        if state_after is None:
+            started = self._dialogs.pop(key, None)
+            if started is not None:
+                FSM_DIALOG_SECONDS.observe(now - started[1], form=started[0])
+                FSM_DIALOGS_TOTAL.inc(form=started[0], outcome='completed')
+        elif self._form(state_before) != self._form(state_after):
+            if key in self._dialogs:
+                FSM_DIALOGS_TOTAL.inc(form=self._dialogs[key][0], outcome='abandoned')
+            elif len(self._dialogs) >= FSM_TRACKED_DIALOGS_LIMIT:
+                self._dialogs.pop(next(iter(self._dialogs)))
+            self._dialogs[key] = (self._form(state_after), now)
+            FSM_DIALOGS_TOTAL.inc(form=self._form(state_after), outcome='started')
+
+
+class TelegramRequestMiddleware(BaseRequestMiddleware):
+    """Время запросов к Bot API по методам."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = await make_request(bot, method)
+            status = 'ok'
+            return response
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                             method=type(method).__name__, status=status)
+
+
+class ServicesMiddleware(BaseMiddleware):
+    """Внутренний middleware: объекты контейнера приложения в параметры обработчика.
+
+    Передаются только объекты, чьи имена есть среди параметров обработчика,
+    поэтому каждый из них создаётся при первом обновлении, которому он нужен.
+    """
+
+    def __init__(self, container):
+        self.container = container
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        params = getattr(data.get('handler'), 'params', ())
+        for name in self.container.SERVICES:
+            if name in params and name not in data:
+                data[name] = getattr(self.container, name)
+        return await handler(event, data)
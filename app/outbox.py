@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from broadcast import Delivery, FanOut
+from time_conversion import parse_clockify
+
+logger = logging.getLogger(__name__)
+
+# Изменения записей времени отправляются в Clockify в фоне; 0 — сразу, в обработчике
+OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', '1') == '1'
+# Число пользователей, изменения которых отправляются одновременно
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '10'))
+# Попыток отправки, после которых изменение переводится в dead
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+# Задержка перед первым повтором и предельная задержка (в секундах), между ними — экспонента
+OUTBOX_RETRY_DELAY = float(os.getenv('OUTBOX_RETRY_DELAY', '5'))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv('OUTBOX_RETRY_MAX_DELAY', '600'))
+# Как часто проверять очередь, если новых изменений нет (в секундах)
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1'))
+# На сколько секунд запись захватывается на время отправки; если процесс остановится,
+# не дождавшись ответа, по истечении этого времени запись будет отправлена снова
+OUTBOX_LEASE = float(os.getenv('OUTBOX_LEASE', '120'))
+# Сообщать пользователю об успешной отправке (об ошибке сообщается всегда)
+OUTBOX_NOTIFY_SUCCESS = os.getenv('OUTBOX_NOTIFY_SUCCESS', '1') == '1'
+# Сколько дней хранить отправленные записи
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', '7'))
+OUTBOX_BATCH = 100
+
+CREATE, START, END = 'create', 'start', 'end'
+PENDING, DONE, DEAD = 'pending', 'done', 'dead'
+
+
+# Дописывается к ответу обработчика, когда изменение поставлено в очередь
+QUEUED_NOTE = "Clockify обновится в фоне, о результате придёт сообщение."
+
+
+def with_queued_note(text: str, queued: bool) -> str:
+    return f"{text}\n{QUEUED_NOTE}" if queued else text
+
+
+class PermanentError(Exception):
+    """Изменение, которое Clockify не примет и при повторе."""
+
+
+def _is_permanent(error: BaseException) -> bool:
+    if isinstance(error, PermanentError):
+        return True
+    # 4xx, кроме 408 и 429: запрос неверен (например, ключ API отозван), повтор не поможет
+    return isinstance(error, aiohttp.ClientResponseError) and 400 <= error.status < 500 and error.status not in (408, 429)
+
+
+def _describe(error: BaseException) -> str:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f"{error.status} {error.message}"[:500]
+    return (str(error) or type(error).__name__)[:500]
+
+
+def _same_time(a: Optional[str], b: Optional[str]) -> bool:
+    return (a is not None and b is not None
+            and parse_clockify(a).replace(microsecond=0) == parse_clockify(b).replace(microsecond=0))
+
+
+class Outbox:
+    """Очередь изменений записей времени для Clockify в таблице outbox.
+
+    Обработчик сохраняет изменение и сразу отвечает пользователю, не дожидаясь
+    Clockify. Фоновая задача отправляет изменения по порядку для каждого
+    пользователя (разных пользователей — параллельно), при сбоях Clockify
+    повторяет с экспоненциальной задержкой и после OUTBOX_MAX_ATTEMPTS попыток
+    или ошибки, которую повтор не исправит, переводит изменение в dead.
+    О результате пользователь получает сообщение.
+
+    Ключ идемпотентности не даёт поставить одно изменение дважды (например,
+    при повторной доставке обновления Telegram). Сам Clockify таких ключей не
+    поддерживает, поэтому перед повтором, когда прошлая попытка могла дойти
+    до Clockify, бот проверяет, нет ли там уже этой записи.
+    """
+
+    def __init__(self, repository, api, fanout: FanOut, concurrency: int = OUTBOX_CONCURRENCY,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, retry_delay: float = OUTBOX_RETRY_DELAY,
+                 max_delay: float = OUTBOX_RETRY_MAX_DELAY, poll_interval: float = OUTBOX_POLL_INTERVAL,
+                 notify_success: bool = OUTBOX_NOTIFY_SUCCESS):
+        self.repo = repository
+        self.api = api
+        self.fanout = fanout
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.notify_success = notify_success
+        self._wake = asyncio.Event()
+        self._active: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._cleaned_at = 0.0
+        # Метрики
+        self.enqueued = 0
+        self.duplicates = 0
+        self.sent = 0
+        self.retries = 0
+        self.dead = 0
+        self.recovered = 0
+
+    async def enqueue(self, clockify_userid: str, action: str, payload: Dict[str, Any], chat_id: Optional[int] = None,
+                      idempotency_key: Optional[str] = None) -> Optional[int]:
+        """Постановка изменения в очередь. None, если изменение с таким ключом уже есть."""
+        entry_id = await self.repo.add_outbox_entry(clockify_userid, chat_id, action,
+                                                    json.dumps(payload, ensure_ascii=False),
+                                                    idempotency_key or uuid.uuid4().hex, time.time())
+        if entry_id is None:
+            self.duplicates += 1
+        else:
+            self.enqueued += 1
+            self._wake.set()
+        return entry_id
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                await self._dispatch()
+                await self._cleanup()
+            except Exception as e:
+                logger.exception("Outbox dispatch failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self) -> None:
+        """Отправка первого изменения каждого пользователя, у которого сейчас ничего не отправляется."""
+        free = self.concurrency - len(self._active)
+        if free <= 0:
+            return
+        for entry in await self.repo.get_outbox_heads(time.time(), OUTBOX_BATCH + len(self._active)):
+            if entry.clockify_userid in self._active:
+                continue
+            self._active[entry.clockify_userid] = asyncio.create_task(self._process(entry))
+            free -= 1
+            if not free:
+                return
+
+    async def _process(self, entry) -> None:
+        try:
+            await self._attempt(entry)
+        except Exception as e:
+            logger.exception("Outbox entry %s failed: %s", entry.id, e)
+        finally:
+            self._active.pop(entry.clockify_userid, None)
+            self._wake.set()
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.max_delay, self.retry_delay * 2 ** attempts) * random.uniform(0.5, 1.0)
+
+    async def _attempt(self, entry) -> None:
+        if not await self.repo.claim_outbox_entry(entry.id, entry.attempts, time.time() + OUTBOX_LEASE):
+            return
+        payload = json.loads(entry.payload)
+        try:
+            await self._send(entry, payload)
+        except Exception as e:
+            error = _describe(e)
+            now = time.time()
+            if _is_permanent(e) or entry.attempts + 1 >= self.max_attempts:
+                await self.repo.finish_outbox_entry(entry.id, DEAD, error, now, now)
+                self.dead += 1
+                logger.warning("Outbox entry %s (%s) is dead after %d attempts: %s",
+                               entry.id, entry.action, entry.attempts + 1, error)
+                await self._on_dead(entry, payload)
+                await self._notify(entry, f"Не удалось отправить в Clockify: {payload['summary']}.\n"
+                                          f"Ошибка: {error}\nПовторите команду.")
+            else:
+                await self.repo.finish_outbox_entry(entry.id, PENDING, error, now + self._backoff(entry.attempts), now)
+                self.retries += 1
+            return
+        now = time.time()
+        await self.repo.finish_outbox_entry(entry.id, DONE, None, now, now)
+        self.sent += 1
+        if self.notify_success:
+            await self._notify(entry, f"Clockify: {payload['summary']} — готово.")
+
+    async def _send(self, entry, payload: Dict[str, Any]) -> None:
+        user = await self.repo.get_user_by_clockify_userid(entry.clockify_userid)
+        if user is None:
+            raise PermanentError("пользователь не найден")
+        # Прошлая попытка могла дойти до Clockify: ответ потерян или бот остановился, не дождавшись его
+        retried = entry.attempts > 0
+        if entry.action == CREATE:
+            if retried and await self._entry_exists(user, payload):
+                self.recovered += 1
+                return
+            result = await self.api.create_time_entry(user.clockify_apikey, user.clockify_userid, payload['start'],
+                                                      payload['end'], payload['project_id'], payload['description'])
+            if result is None:
+                raise Exception("Ошибка при создании записи времени на Clockify.")
+        elif entry.action == START:
+            running = (await self.api.get_in_progress_time_entry(user.clockify_apikey, user.clockify_userid)
+                       if retried else None)
+            if running is not None and _same_time(running['timeInterval']['start'], payload['start']):
+                self.recovered += 1
+                result = running
+            else:
+                result = await self.api.start_time_entry(user.clockify_apikey, user.clockify_userid, payload['start'],
+                                                         payload['project_id'], payload['description'])
+                if result is None:
+                    raise Exception("Ошибка при запуске записи времени на Clockify.")
+            # Локальный таймер создан при постановке в очередь, теперь известен id записи в Clockify
+            timer = await self.repo.get_running_timer(user.clockify_userid)
+            if timer is not None and timer.started_at == payload['start']:
+                await self.repo.set_running_timer(user.clockify_userid, result.get('id', ''), timer.project_id,
+                                                  timer.project_name, timer.description, timer.started_at)
+        elif entry.action == END:
+            try:
+                await self.api.end_time_entry(user.clockify_apikey, user.clockify_userid, payload['end'])
+            except aiohttp.ClientResponseError as e:
+                if e.status != 404:
+                    raise
+                if retried:
+                    # Таймер остановила прошлая попытка
+                    self.recovered += 1
+                    return
+                raise PermanentError("в Clockify нет запущенной записи времени") from e
+        else:
+            raise PermanentError(f"неизвестное действие {entry.action}")
+
+    async def _entry_exists(self, user, payload: Dict[str, Any]) -> bool:
+        entries = await self.api.find_time_entries(user.clockify_apikey, user.clockify_userid,
+                                                   payload['start'], payload['end'])
+        return any(entry.get('projectId') == payload['project_id']
+                   and (entry.get('description') or '') == (payload['description'] or '')
+                   and _same_time((entry.get('timeInterval') or {}).get('start'), payload['start'])
+                   and _same_time((entry.get('timeInterval') or {}).get('end'), payload['end'])
+                   for entry in entries)
+
+    async def _on_dead(self, entry, payload: Dict[str, Any]) -> None:
+        # Таймер, который так и не запустился в Clockify, не должен числиться запущенным
+        if entry.action == START:
+            timer = await self.repo.get_running_timer(entry.clockify_userid)
+            if timer is not None and timer.started_at == payload['start']:
+                await self.repo.delete_running_timer(entry.clockify_userid)
+
+    async def _notify(self, entry, text: str) -> None:
+        if entry.chat_id is None:
+            return
+        try:
+            await self.fanout.send(Delivery(entry.clockify_userid, entry.chat_id, text))
+        except Exception as e:
+            logger.warning("Failed to notify %s about outbox entry %s: %s", entry.clockify_userid, entry.id, e)
+
+    async def _cleanup(self) -> None:
+        now = time.time()
+        if now - self._cleaned_at < 3600:
+            return
+        self._cleaned_at = now
+        removed = await self.repo.delete_outbox_done(now - OUTBOX_RETENTION_DAYS * 86400)
+        if removed:
+            logger.info("Removed %d sent outbox entries", removed)
+
+    async def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание, пока в очереди не останется ожидающих изменений (для тестов и бенчмарков)."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._active or (await self.repo.get_outbox_counts()).get(PENDING):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'enqueued': self.enqueued,
+            'duplicates': self.duplicates,
+            'sent': self.sent,
+            'retries': self.retries,
+            'dead': self.dead,
+            'recovered': self.recovered,
+            'active': len(self._active),
+        }
+
+    async def close(self) -> None:
+        # Изменения остаются в таблице: незавершённые будут отправлены после перезапуска
+        tasks = [task for task in (self._task, *self._active.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
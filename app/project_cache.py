@@ -0,0 +1,174 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+# Время жизни кэша проектов в секундах (можно переопределить через .env)
+PROJECT_CACHE_TTL = float(os.getenv('PROJECT_CACHE_TTL', '300'))
+
+
+class ProjectIndex:
+    """Индекс проектов: clockify_userid -> [(имя, id)] и имя -> id.
+
+    Строится при каждом обновлении списка проектов; перестраиваются только
+    проекты, у которых изменились имя или состав участников.
+    """
+
+    def __init__(self):
+        self._projects: Dict[str, Tuple[str, FrozenSet[str]]] = {}
+        self._order: Dict[str, int] = {}
+        self._name_to_id: Dict[str, str] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._user_lists: Dict[str, List[Tuple[str, str]]] = {}
+
+    def rebuild(self, projects: List[Dict]) -> None:
+        """Синхронизация индекса с полным списком проектов рабочего пространства."""
+        order: Dict[str, int] = {}
+        for position, project in enumerate(projects):
+            project_id = project['id']
+            if project_id in order:
+                continue
+            order[project_id] = position
+            members = frozenset(m['userId'] for m in project.get('memberships') or [] if m.get('userId'))
+            self.upsert(project_id, project['name'], members)
+        for project_id in [pid for pid in self._projects if pid not in order]:
+            self.remove(project_id)
+        if order != self._order:
+            self._order = order
+            self._user_lists.clear()
+
+    def upsert(self, project_id: str, name: str, members: FrozenSet[str]) -> None:
+        """Добавление или обновление одного проекта в индексе."""
+        old = self._projects.get(project_id)
+        if old == (name, members):
+            return
+        old_name, old_members = old if old else (None, frozenset())
+        if old_name is not None and old_name != name:
+            self._drop_name(old_name, project_id)
+        self._name_to_id.setdefault(name, project_id)
+        for user_id in old_members - members:
+            self._by_user.get(user_id, set()).discard(project_id)
+        for user_id in members - old_members:
+            self._by_user.setdefault(user_id, set()).add(project_id)
+        self._projects[project_id] = (name, members)
+        self._order.setdefault(project_id, len(self._order))
+        # Сбрасываем готовые списки только у затронутых пользователей
+        affected = members | old_members if old_name != name else members ^ old_members
+        for user_id in affected:
+            self._user_lists.pop(user_id, None)
+
+    def remove(self, project_id: str) -> None:
+        """Удаление проекта из индекса."""
+        old = self._projects.pop(project_id, None)
+        if old is None:
+            return
+        name, members = old
+        self._drop_name(name, project_id)
+        for user_id in members:
+            self._by_user.get(user_id, set()).discard(project_id)
+            self._user_lists.pop(user_id, None)
+        self._order.pop(project_id, None)
+
+    def _drop_name(self, name: str, project_id: str) -> None:
+        if self._name_to_id.get(name) != project_id:
+            return
+        del self._name_to_id[name]
+        # Если есть другой проект с тем же именем — имя теперь указывает на него
+        for other_id, (other_name, _) in self._projects.items():
+            if other_name == name and other_id != project_id:
+                self._name_to_id[name] = other_id
+                break
+
+    def projects_for_user(self, clockify_userid: str) -> List[Tuple[str, str]]:
+        """Упорядоченный список (имя, id) проектов пользователя без повторов."""
+        cached = self._user_lists.get(clockify_userid)
+        if cached is None:
+            project_ids = sorted(self._by_user.get(clockify_userid, ()), key=lambda pid: self._order.get(pid, 0))
+            cached = [(self._projects[pid][0], pid) for pid in project_ids]
+            self._user_lists[clockify_userid] = cached
+        return cached
+
+    def project_id(self, name: str) -> Optional[str]:
+        """ID проекта по имени."""
+        return self._name_to_id.get(name)
+
+    def project_name(self, project_id: str) -> Optional[str]:
+        """Имя проекта по ID."""
+        project = self._projects.get(project_id)
+        return project[0] if project else None
+
+    def __len__(self) -> int:
+        return len(self._projects)
+
+
+class ProjectCache:
+    """Кэш списка проектов рабочего пространства (вместе с участниками) с TTL.
+
+    Одновременные промахи разделяют один запрос к Clockify (single-flight),
+    кэш можно явно сбросить через invalidate().
+    """
+
+    def __init__(self, loader: Callable[[], Awaitable[Optional[List[Dict]]]], ttl: float = PROJECT_CACHE_TTL):
+        self._loader = loader
+        self.ttl = ttl
+        self._projects: Optional[List[Dict]] = None
+        self._expires_at: float = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        self.index = ProjectIndex()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.refreshes: int = 0
+
+    def is_fresh(self) -> bool:
+        return self._projects is not None and time.monotonic() < self._expires_at
+
+    async def get(self) -> List[Dict]:
+        """Получение проектов из кэша или из Clockify, если кэш устарел."""
+        if self.is_fresh():
+            self.hits += 1
+            return self._projects
+        self.misses += 1
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+        # shield: отмена одного из ожидающих не должна отменять общий запрос
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh(self) -> List[Dict]:
+        try:
+            projects = await self._loader() or []
+            self.index.rebuild(projects)
+            self._projects = projects
+            self._expires_at = time.monotonic() + self.ttl
+            self.refreshes += 1
+            return projects
+        finally:
+            self._inflight = None
+
+    async def refresh(self) -> List[Dict]:
+        """Загрузка проектов независимо от TTL (для фонового прогрева).
+
+        Кэш не сбрасывается, поэтому до окончания загрузки читатели получают прежние данные.
+        """
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._inflight)
+
+    async def get_index(self) -> ProjectIndex:
+        """Получение индекса проектов, актуального на момент вызова."""
+        await self.get()
+        return self.index
+
+    def invalidate(self) -> None:
+        """Явный сброс кэша: следующий get() загрузит проекты заново."""
+        self._projects = None
+        self._expires_at = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._projects) if self._projects is not None else 0,
+        }
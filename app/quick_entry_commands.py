@@ -0,0 +1,224 @@
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import F, Router, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+from clockify_api import AsyncClockifyAPI, TimeEntryManager
+from db.repository import UserRepository
+from outbox import with_queued_note
+from keyboards import (CONFIRM_KEYBOARD, DATE_KEYBOARD_DAYS, DESCRIPTION_KEYBOARD, EntryCallback, datetime_picker,
+                       format_minutes, inline_project_keyboard)
+from time_conversion import clockify_to_local, get_timezone, local_to_clockify, today_local, user_timezone
+
+router = Router()
+
+
+# Быстрая запись времени: одно сообщение бота редактируется на каждом шаге,
+# выбор делается кнопками под ним. Текстом вводится только описание.
+class QuickEntryForm(StatesGroup):
+    picking = State()
+    description = State()
+
+
+async def _user_projects(repository: UserRepository, clockify_api: AsyncClockifyAPI,
+                         tg_username: str) -> Tuple[Tuple[str, str], ...]:
+    user = await repository.get_user_by_tg_username(tg_username)
+    if not user:
+        return ()
+    index = await clockify_api.project_cache.get_index()
+    return tuple(index.projects_for_user(user.clockify_userid))
+
+
+def _day(data: Dict[str, Any], offset: int) -> date:
+    return date.fromisoformat(data['today']) - timedelta(days=offset)
+
+
+def _start_picker(data: Dict[str, Any]):
+    return datetime_picker(date.fromisoformat(data['today']), data['start_offset'], 0, DATE_KEYBOARD_DAYS - 1)
+
+
+def _end_picker(data: Dict[str, Any]):
+    # Окончание — не раньше дня начала; для записи, начатой сегодня, можно выбрать и завтра
+    start_offset, end_offset = data['start_offset'], data['end_offset']
+    limit = data['start'] + 1 if end_offset == start_offset else None
+    return datetime_picker(date.fromisoformat(data['today']), end_offset,
+                           -1 if start_offset == 0 else 0, start_offset, limit)
+
+
+def _moment(data: Dict[str, Any], prefix: str) -> datetime:
+    minutes = data[prefix]
+    return datetime.combine(_day(data, data[f'{prefix}_offset']), datetime.min.time()) + timedelta(minutes=minutes)
+
+
+def _summary(data: Dict[str, Any]) -> str:
+    lines = [f"Проект: {data['project']}"]
+    if 'description' in data:
+        lines.append(f"Описание: {data['description'] or '—'}")
+    if 'start' in data:
+        lines.append(f"Начало: {_day(data, data['start_offset']).isoformat()} {format_minutes(data['start'])}")
+    if 'end' in data:
+        lines.append(f"Окончание: {_day(data, data['end_offset']).isoformat()} {format_minutes(data['end'])}")
+    return "\n".join(lines)
+
+
+async def _edit(message: types.Message, text: str, markup=None) -> None:
+    try:
+        await message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest as e:
+        # Повторное нажатие той же кнопки
+        if 'message is not modified' not in str(e):
+            raise
+
+
+async def _show_confirmation(bot, chat_id: int, data: Dict[str, Any]) -> None:
+    await bot.edit_message_text(f"Проверьте запись времени:\n\n{_summary(data)}", chat_id=chat_id,
+                                message_id=data['message_id'], reply_markup=CONFIRM_KEYBOARD)
+
+
+async def _last_entry_data(repository: UserRepository, clockify_api: AsyncClockifyAPI,
+                           tg_username: str) -> Optional[Dict[str, Any]]:
+    """Проект, описание, время начала и длительность последней записи — для повтора сегодня."""
+    user = await repository.get_user_by_tg_username(tg_username)
+    if not user:
+        return None
+    entry = await clockify_api.get_last_time_entry(user.clockify_apikey, user.clockify_userid)
+    if entry is None:
+        return None
+    index = await clockify_api.project_cache.get_index()
+    project = index.project_name(entry.get('projectId'))
+    if project is None:
+        return None
+    interval = entry['timeInterval']
+    tz = user_timezone(user)
+    started, ended = clockify_to_local(interval['start'], tz), clockify_to_local(interval['end'], tz)
+    start = started.hour * 60 + started.minute
+    end = start + max(1, round((ended - started).total_seconds() / 60))
+    # Запись, переходящая через полночь, заканчивается завтра
+    return {'project_id': entry['projectId'], 'project': project, 'description': entry.get('description') or '',
+            'start_offset': 0, 'start': start, 'end_offset': -(end // 1440), 'end': end % 1440}
+
+
+@router.message(Command('quick_entry'))
+async def cmd_quick_entry(message: types.Message, state: FSMContext, repository: UserRepository,
+                          clockify_api: AsyncClockifyAPI):
+    try:
+        projects = await _user_projects(repository, clockify_api, message.from_user.username)
+    except Exception as e:
+        await message.answer(f"Ошибка при получении проектов: {str(e)}")
+        return
+    if not projects:
+        await message.answer("Проекты не найдены. Если вы ещё не зарегистрированы, используйте /start.")
+        return
+    # Дни в выборе даты и сохранённое время — по часовому поясу пользователя
+    tz = user_timezone(await repository.get_user_by_tg_username(message.from_user.username))
+    sent = await message.answer("Новая запись времени. Выберите проект:",
+                                reply_markup=inline_project_keyboard(projects))
+    await state.set_state(QuickEntryForm.picking)
+    await state.set_data({'message_id': sent.message_id, 'today': today_local(tz).isoformat(), 'timezone': tz.zone})
+
+
+@router.message(QuickEntryForm.description, F.text)
+async def process_quick_description(message: types.Message, state: FSMContext):
+    data = await state.update_data(description=message.text)
+    await state.set_state(QuickEntryForm.picking)
+    await _show_confirmation(message.bot, message.chat.id, data)
+
+
+@router.callback_query(StateFilter(QuickEntryForm.picking, QuickEntryForm.description), EntryCallback.filter())
+async def process_quick_entry_button(callback: types.CallbackQuery, callback_data: EntryCallback, state: FSMContext,
+                                     repository: UserRepository, clockify_api: AsyncClockifyAPI,
+                                     time_entry_manager: TimeEntryManager):
+    data = await state.get_data()
+    if callback.message is None or callback.message.message_id != data.get('message_id'):
+        await callback.answer("Эта запись уже неактуальна.")
+        return
+    action, value = callback_data.action, callback_data.value
+    alert = None
+
+    if action == 'x':
+        await state.clear()
+        await _edit(callback.message, "Запись времени отменена.")
+    elif action == 'pg':
+        projects = await _user_projects(repository, clockify_api, callback.from_user.username)
+        await _edit(callback.message, "Новая запись времени. Выберите проект:",
+                    inline_project_keyboard(projects, int(value)))
+    elif action == 'p':
+        index = await clockify_api.project_cache.get_index()
+        data = await state.update_data(project_id=value, project=index.project_name(value) or value,
+                                       stage='start', start_offset=0)
+        await _edit(callback.message, f"{_summary(data)}\n\nВыберите дату и время начала:", _start_picker(data))
+    elif action == 'r':
+        try:
+            last = await _last_entry_data(repository, clockify_api, callback.from_user.username)
+        except Exception as e:
+            last, alert = None, f"Ошибка при получении последней записи: {str(e)}"
+        if last is not None:
+            data = await state.update_data(**last)
+            await _show_confirmation(callback.bot, callback.message.chat.id, data)
+        else:
+            alert = alert or "Нет записей для повтора."
+    elif action == 'd':
+        if data.get('stage') == 'end':
+            data = await state.update_data(end_offset=int(value))
+            await _edit(callback.message, f"{_summary(data)}\n\nВыберите дату и время окончания:", _end_picker(data))
+        else:
+            data = await state.update_data(start_offset=int(value))
+            await _edit(callback.message, f"{_summary(data)}\n\nВыберите дату и время начала:", _start_picker(data))
+    elif action == 't':
+        if data.get('stage') == 'end':
+            data = await state.update_data(end=int(value))
+            if 'description' in data:
+                # Время изменено после повтора или подтверждения: описание уже есть
+                await _show_confirmation(callback.bot, callback.message.chat.id, data)
+            else:
+                await state.set_state(QuickEntryForm.description)
+                await _edit(callback.message, f"{_summary(data)}\n\nОтправьте описание сообщением:",
+                            DESCRIPTION_KEYBOARD)
+        else:
+            data = await state.update_data(start=int(value), stage='end', end_offset=data['start_offset'])
+            await _edit(callback.message, f"{_summary(data)}\n\nВыберите дату и время окончания:", _end_picker(data))
+    elif action == 'n':
+        data = await state.update_data(description='')
+        await state.set_state(QuickEntryForm.picking)
+        await _show_confirmation(callback.bot, callback.message.chat.id, data)
+    elif action == 'e':
+        for key in ('start', 'end'):
+            data.pop(key, None)
+        data.update(stage='start', start_offset=0)
+        await state.set_data(data)
+        await _edit(callback.message, f"{_summary(data)}\n\nВыберите дату и время начала:", _start_picker(data))
+    elif action == 's':
+        start, end = _moment(data, 'start'), _moment(data, 'end')
+        if end <= start:
+            alert = "Окончание должно быть позже начала."
+        else:
+            tz = get_timezone(data.get('timezone'))
+            try:
+                entry_id = await time_entry_manager.create_time_entry(
+                    clockify_api, callback.from_user.username, local_to_clockify(start, tz),
+                    local_to_clockify(end, tz), data['project'], data.get('description') or '',
+                    chat_id=callback.message.chat.id,
+                    # Повторное нажатие «Сохранить» не создаст вторую запись
+                    idempotency_key=f"{callback.message.chat.id}:{data['message_id']}:save",
+                    project_id=data['project_id']
+                )
+                queued = time_entry_manager.outbox is not None
+                if queued and entry_id is None:
+                    await _edit(callback.message, f"Запись времени уже сохранена.\n\n{_summary(data)}")
+                else:
+                    await _edit(callback.message, with_queued_note(
+                        f"Запись времени успешно создана.\n\n{_summary(data)}", queued))
+            except Exception as e:
+                await _edit(callback.message, f"Ошибка при создании записи времени: {str(e)}")
+            await state.clear()
+    await callback.answer(alert, show_alert=alert is not None)
+
+
+# Кнопки сообщения, диалог которого уже завершён или сброшен
+@router.callback_query(EntryCallback.filter())
+async def process_stale_quick_entry_button(callback: types.CallbackQuery):
+    await callback.answer("Эта запись уже неактуальна. Начните заново: /quick_entry")
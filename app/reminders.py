@@ -0,0 +1,65 @@
+import asyncio
+from typing import Dict, List
+
+import logging
+
+from broadcast import BLOCKED, Delivery, FanOut
+from time_conversion import clockify_to_local, user_timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _format_started_at(target) -> str:
+    return clockify_to_local(target.started_at, user_timezone(target)).strftime('%d.%m %H:%M')
+
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+
+class ReminderService:
+    """Рассылка напоминаний о таймерах.
+
+    Адресаты выбираются одним запросом к базе вместе с локальными таймерами;
+    Clockify опрашивается только для тех, у кого локального таймера нет.
+    Сообщения отправляются через общий для бота FanOut.
+    """
+
+    def __init__(self, fanout: FanOut, repository, api):
+        self.fanout = fanout
+        self.repo = repository
+        self.api = api
+
+    async def _is_running_in_clockify(self, target) -> bool:
+        """Проверка таймера, запущенного в Clockify не через бота. При ошибке напоминание не отправляется."""
+        try:
+            return await self.api.get_in_progress_time_entry(target.clockify_apikey, target.clockify_userid) is not None
+        except Exception as e:
+            logger.warning("Failed to check running timer for %s: %s", target.clockify_userid, e)
+            return True
+
+    async def remind_not_started(self) -> Dict[str, float]:
+        """Напоминание тем, у кого в рабочее время не запущен таймер."""
+        candidates = [t for t in await self.repo.get_reminder_targets() if t.started_at is None]
+        running = await asyncio.gather(*(self._is_running_in_clockify(t) for t in candidates))
+        text = "У вас не запущен таймер Clockify. Запустить: /start_time_entry"
+        return await self.send([Delivery(t.clockify_userid, t.chat_id, text)
+                                for t, is_running in zip(candidates, running) if not is_running])
+
+    async def remind_not_stopped(self) -> Dict[str, float]:
+        """Напоминание тем, у кого в конце дня ещё идёт таймер."""
+        return await self.send([
+            Delivery(t.clockify_userid, t.chat_id,
+                     f"Таймер по проекту {t.project_name or 'без проекта'} идёт с {_format_started_at(t)}. "
+                     f"Не забудьте остановить его: /end_time_entry")
+            for t in await self.repo.get_reminder_targets() if t.started_at is not None
+        ])
+
+    async def send(self, deliveries: List[Delivery]) -> Dict[str, float]:
+        async def on_result(delivery: Delivery, status: str):
+            # Пользователь заблокировал бота — больше не пишем ему
+            if status == BLOCKED:
+                await self.repo.set_reminders_enabled(delivery.clockify_userid, False)
+
+        return await self.fanout.send_all(_iterate(deliveries), on_result)
@@ -0,0 +1,21 @@
+from aiogram import Router, types
+from aiogram.filters import Command, CommandObject
+from clockify_api import AsyncClockifyAPI
+from reports import ReportManager, REPORT_PERIODS
+
+router = Router()
+
+# Команда для отчёта: /report day|week|month
+@router.message(Command('report'))
+async def cmd_report(message: types.Message, command: CommandObject, report_manager: ReportManager,
+                     clockify_api: AsyncClockifyAPI):
+    period = (command.args or 'day').strip().lower()
+    if period not in REPORT_PERIODS:
+        await message.answer("Использование: /report day|week|month")
+        return
+    try:
+        report = await report_manager.build_report(clockify_api, message.from_user.username, period)
+        index = await clockify_api.project_cache.get_index()
+        await message.answer(ReportManager.format_report(report, index.project_name))
+    except Exception as e:
+        await message.answer(f"Ошибка при построении отчёта: {str(e)}")
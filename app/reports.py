@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from time_conversion import CLOCKIFY_TIME_FORMAT, now_local, parse_clockify, user_timezone, utc_local_dates
+
+# Как давно (в секундах) должна быть последняя синхронизация, чтобы отчёт обошёлся без Clockify
+REPORT_SYNC_TTL = int(os.getenv('REPORT_SYNC_TTL', '300'))
+# Глубина первой загрузки записей: хватает на отчёт за прошлый месяц
+REPORT_HISTORY_DAYS = int(os.getenv('REPORT_HISTORY_DAYS', '62'))
+# Перекрытие окна синхронизации: записи, изменённые задним числом за это время, подтянутся
+REPORT_SYNC_OVERLAP = timedelta(days=2)
+
+REPORT_PERIODS = {'day': 'день', 'week': 'неделю', 'month': 'месяц'}
+NO_PROJECT = ''
+
+class Report(NamedTuple):
+    period: str
+    day_from: str
+    day_to: str
+    total_seconds: int
+    by_project: List[Tuple[str, int]]
+    by_day: List[Tuple[str, int]]
+
+
+def _format_clockify_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime(CLOCKIFY_TIME_FORMAT)
+
+
+def entries_to_rows(clockify_userid: str, entries: List[Dict], tz=None) -> List[Tuple]:
+    """Строки для таблицы time_entries; ещё не завершённые записи пропускаются.
+
+    Запись целиком относится ко дню своего начала по времени пользователя,
+    дни всей пачки считаются одним вызовом utc_local_dates по уже разобранным началам.
+    """
+    finished = [entry for entry in entries if (entry.get('timeInterval') or {}).get('end')]
+    starts = [parse_clockify(entry['timeInterval']['start']) for entry in finished]
+    days = utc_local_dates(starts, tz)
+    rows = []
+    for entry, start, day in zip(finished, starts, days):
+        interval = entry['timeInterval']
+        end = parse_clockify(interval['end'])
+        # Clockify отдаёт время в UTC с суффиксом Z — такую строку можно хранить без переформатирования
+        start_str = interval['start'] if len(interval['start']) == 20 else start.strftime(CLOCKIFY_TIME_FORMAT)
+        rows.append((entry['id'], clockify_userid, entry.get('projectId') or NO_PROJECT, entry.get('description'),
+                     start_str, day, max(0, int((end - start).total_seconds()))))
+    return rows
+
+
+def entry_to_row(clockify_userid: str, entry: Dict, tz=None) -> Optional[Tuple]:
+    """Строка для таблицы time_entries; None для ещё не завершённой записи."""
+    rows = entries_to_rows(clockify_userid, [entry], tz)
+    return rows[0] if rows else None
+
+
+def period_bounds(period: str, today: Optional[datetime] = None, tz=None) -> Tuple[str, str]:
+    """Первый и последний день периода (включительно) по времени пользователя."""
+    today = (today or now_local(tz)).date()
+    if period == 'day':
+        first = today
+    elif period == 'week':
+        first = today - timedelta(days=today.weekday())
+    elif period == 'month':
+        first = today.replace(day=1)
+    else:
+        raise ValueError(f"Unknown report period: {period}")
+    return first.isoformat(), today.isoformat()
+
+
+def aggregate_rollups(rows) -> Tuple[int, List[Tuple[str, int]], List[Tuple[str, int]]]:
+    """Итоги по проектам и по дням из строк (day, project_id, seconds, entries)."""
+    by_project: Dict[str, int] = defaultdict(int)
+    by_day: Dict[str, int] = defaultdict(int)
+    for day, project_id, seconds, _ in rows:
+        by_project[project_id] += seconds
+        by_day[day] += seconds
+    return (sum(by_day.values()),
+            sorted(by_project.items(), key=lambda item: -item[1]),
+            sorted(by_day.items()))
+
+
+def format_duration(seconds: int) -> str:
+    hours, minutes = divmod(seconds // 60, 60)
+    return f"{hours} ч {minutes} мин"
+
+
+class ReportManager:
+    """Отчёты по времени на основе локальной копии записей Clockify.
+
+    Записи загружаются инкрементально от последней точки синхронизации,
+    суммы по дням и проектам хранятся готовыми в time_rollups.
+    """
+
+    def __init__(self, repository):
+        self.repo = repository
+        # Блокировки синхронизации по пользователям и число их владельцев и ожидающих:
+        # блокировка удаляется, когда она больше никому не нужна
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = defaultdict(int)
+        self.syncs = 0
+        self.skipped_syncs = 0
+
+    @asynccontextmanager
+    async def _user_lock(self, clockify_userid: str):
+        lock = self._locks.setdefault(clockify_userid, asyncio.Lock())
+        self._lock_users[clockify_userid] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[clockify_userid] -= 1
+            if not self._lock_users[clockify_userid]:
+                del self._lock_users[clockify_userid]
+                del self._locks[clockify_userid]
+
+    async def sync_user_entries(self, api, user, force: bool = False) -> int:
+        """Загрузка новых и изменённых записей пользователя. Возвращает число загруженных записей."""
+        async with self._user_lock(user.clockify_userid):
+            state = await self.repo.get_time_entries_sync(user.clockify_userid)
+            now = datetime.now(timezone.utc)
+            if state and not force and time.time() - state[1] < REPORT_SYNC_TTL:
+                self.skipped_syncs += 1
+                return 0
+            window_start = state[0] if state else _format_clockify_time(now - timedelta(days=REPORT_HISTORY_DAYS))
+            rows = []
+            next_from = now - REPORT_SYNC_OVERLAP
+            tz = user_timezone(user)
+            async for entries in api.iter_user_time_entries(user.clockify_apikey, user.clockify_userid, window_start):
+                rows.extend(entries_to_rows(user.clockify_userid, entries, tz))
+                for entry in entries:
+                    if not (entry.get('timeInterval') or {}).get('end'):
+                        # Незавершённую запись нужно будет загрузить снова, когда она закончится
+                        next_from = min(next_from, parse_clockify(entry['timeInterval']['start']).replace(tzinfo=timezone.utc))
+            await self.repo.replace_time_entries(user.clockify_userid, window_start, rows)
+            next_from_str = max(window_start, _format_clockify_time(next_from))
+            await self.repo.set_time_entries_sync(user.clockify_userid, next_from_str, time.time())
+            self.syncs += 1
+            return len(rows)
+
+    async def reset_sync(self, clockify_userid: str) -> None:
+        """Полная перезагрузка записей при следующем отчёте: например, после смены часового пояса,
+        когда дни записей нужно пересчитать."""
+        window_start = _format_clockify_time(datetime.now(timezone.utc) - timedelta(days=REPORT_HISTORY_DAYS))
+        await self.repo.set_time_entries_sync(clockify_userid, window_start, 0)
+
+    async def build_report(self, api, tg_username: str, period: str) -> Report:
+        user = await self.repo.get_user_by_tg_username(tg_username)
+        if not user:
+            raise ValueError(f"User with tg_username {tg_username} not found.")
+        day_from, day_to = period_bounds(period, tz=user_timezone(user))
+        await self.sync_user_entries(api, user)
+        rows = await self.repo.get_time_rollups(user.clockify_userid, day_from, day_to)
+        total, by_project, by_day = aggregate_rollups(rows)
+        return Report(period, day_from, day_to, total, by_project, by_day)
+
+    @staticmethod
+    def format_report(report: Report, project_names) -> str:
+        lines = [f"Отчёт за {REPORT_PERIODS[report.period]} ({report.day_from} — {report.day_to})",
+                 f"Всего: {format_duration(report.total_seconds)}"]
+        if report.by_project:
+            lines.append("\nПо проектам:")
+            for project_id, seconds in report.by_project:
+                name = project_names(project_id) if project_id else None
+                lines.append(f"• {name or 'Без проекта'} — {format_duration(seconds)}")
+        if report.period != 'day' and report.by_day:
+            lines.append("\nПо дням:")
+            lines += [f"{day} — {format_duration(seconds)}" for day, seconds in report.by_day]
+        return "\n".join(lines)
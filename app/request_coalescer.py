@@ -0,0 +1,86 @@
+import asyncio
+import os
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Hashable, Iterable, Optional, Tuple
+
+from metrics import REGISTRY, Counter as MetricCounter
+
+# Эндпоинты (в виде metrics.endpoint_label), для которых одинаковые одновременные GET
+# объединяются в один запрос; пустая строка отключает объединение
+CLOCKIFY_COALESCE_ENDPOINTS = os.getenv('CLOCKIFY_COALESCE_ENDPOINTS', 'users,projects,user/{id}/time-entries')
+
+CLOCKIFY_COALESCED_TOTAL = REGISTRY.register(MetricCounter(
+    'clockify_coalesced_requests_total', 'Clockify GET calls served by an identical in-flight request', ('endpoint',)))
+
+
+def parse_endpoints(value: str) -> FrozenSet[str]:
+    return frozenset(item.strip() for item in value.split(',') if item.strip())
+
+
+class _Flight:
+    __slots__ = ('future', 'waiters')
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+
+class RequestCoalescer:
+    """Объединение одинаковых одновременных запросов на чтение.
+
+    Пока запрос с ключом (адрес, параметры, API-ключ) выполняется, такие же
+    вызовы не отправляют свой запрос, а ждут его результат (или ошибку).
+    Это не кэш: после завершения запроса следующий вызов снова идёт в Clockify.
+    Результат общий для всех ожидающих — изменять его нельзя.
+    """
+
+    def __init__(self, endpoints: Iterable[str] = parse_endpoints(CLOCKIFY_COALESCE_ENDPOINTS)):
+        self.endpoints = frozenset(endpoints)
+        self._in_flight: Dict[Hashable, _Flight] = {}
+        # Метрики
+        self.calls: Counter = Counter()
+        self.coalesced: Counter = Counter()
+
+    def enabled(self, endpoint: str) -> bool:
+        return endpoint in self.endpoints
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, str]], api_key: str) -> Tuple:
+        return url, tuple(sorted((params or {}).items())), api_key
+
+    async def run(self, endpoint: str, key: Hashable, send: Callable[[], Awaitable[Any]]) -> Any:
+        """Результат send() для первого вызова с ключом key, результат того же запроса — для остальных."""
+        self.calls[endpoint] += 1
+        flight = self._in_flight.get(key)
+        if flight is not None:
+            self.coalesced[endpoint] += 1
+            CLOCKIFY_COALESCED_TOTAL.inc(endpoint=endpoint)
+        else:
+            # Запрос выполняется отдельной задачей: отмена первого вызова не обрывает
+            # запрос для остальных; он отменяется, только когда ждать его некому
+            flight = self._in_flight[key] = _Flight(asyncio.ensure_future(send()))
+            flight.future.add_done_callback(lambda done: self._forget(key, flight))
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.future)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.future.done():
+                flight.future.cancel()
+
+    def _forget(self, key: Hashable, flight: '_Flight') -> None:
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+        # Ошибку получают ожидающие; если все они отменены, она не должна логироваться как потерянная
+        if not flight.future.cancelled():
+            flight.future.exception()
+
+    def stats(self) -> Dict[str, float]:
+        calls = sum(self.calls.values())
+        coalesced = sum(self.coalesced.values())
+        return {
+            'calls': calls,
+            'coalesced': coalesced,
+            'coalesced_rate': coalesced / calls if calls else 0.0,
+            'in_flight': len(self._in_flight),
+        }
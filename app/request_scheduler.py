@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Clockify: число запросов в секунду на один API-ключ
+CLOCKIFY_RATE_LIMIT = float(os.getenv('CLOCKIFY_RATE_LIMIT', '50'))
+# Максимальное число одновременных запросов ко всему API
+CLOCKIFY_MAX_CONCURRENCY = int(os.getenv('CLOCKIFY_MAX_CONCURRENCY', '20'))
+# Число повторов при 429, 5xx и сетевых ошибках
+CLOCKIFY_MAX_RETRIES = int(os.getenv('CLOCKIFY_MAX_RETRIES', '4'))
+
+# Методы, которые безопасно повторять после 5xx и обрыва соединения.
+# POST повторяется только при 429: в этом случае запрос точно не был выполнен.
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'PATCH', 'DELETE'}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Корзина токенов: не более rate запросов в секунду с запасом capacity."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        # Lock выстраивает ожидающих в очередь по порядку прихода
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block_for(self, seconds: float) -> None:
+        """Пауза для всех запросов с этим ключом (например, по Retry-After)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class RequestScheduler:
+    """Планировщик запросов к Clockify.
+
+    Для каждого API-ключа своя корзина токенов, общее ограничение на число
+    одновременных запросов, повторы с экспоненциальной задержкой и учётом Retry-After.
+    """
+
+    def __init__(self, rate: float = CLOCKIFY_RATE_LIMIT, max_concurrency: int = CLOCKIFY_MAX_CONCURRENCY,
+                 max_retries: int = CLOCKIFY_MAX_RETRIES, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.rate = rate
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        # Метрики
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _bucket(self, api_key: str) -> TokenBucket:
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket(self.rate)
+        return bucket
+
+    def _backoff(self, attempt: int) -> float:
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(error: aiohttp.ClientResponseError) -> Optional[float]:
+        value = (error.headers or {}).get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return None
+
+    def _should_retry(self, method: str, error: BaseException) -> bool:
+        if isinstance(error, aiohttp.ClientResponseError):
+            if error.status == 429:
+                return True
+            return error.status in RETRY_STATUSES and method in IDEMPOTENT_METHODS
+        if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+            return method in IDEMPOTENT_METHODS
+        return False
+
+    async def _acquire(self, api_key: str) -> None:
+        started = time.monotonic()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            await self._bucket(api_key).acquire()
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+        waited = time.monotonic() - started
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    async def run(self, api_key: str, method: str, send: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнение запроса send() с ограничением частоты и повторами."""
+        attempt = 0
+        while True:
+            await self._acquire(api_key)
+            self.requests += 1
+            self.in_flight += 1
+            try:
+                return await send()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries or not self._should_retry(method, e):
+                    self.failures += 1
+                    raise
+                delay = self._backoff(attempt)
+                if isinstance(e, aiohttp.ClientResponseError) and e.status == 429:
+                    retry_after = self._retry_after(e)
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+                    self._bucket(api_key).block_for(delay)
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+            attempt += 1
+            self.retries += 1
+            logger.info("Retrying %s in %.2fs (attempt %d/%d)", method, delay, attempt, self.max_retries)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        acquired = self.requests
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'in_flight': self.in_flight,
+            'max_concurrency': self.max_concurrency,
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'avg_wait_time': self.wait_time_total / acquired if acquired else 0.0,
+            'max_wait_time': self.wait_time_max,
+            'api_keys': len(self._buckets),
+        }
@@ -1,44 +1,46 @@
 from aiogram import Router, types
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import Command
-from db.engine import create_connection
-from db.methods import get_user_by_tg_username, get_user_by_email, update_api_key_by_tg_username, update_user_by_email
-from clockify_api import ClockifyAPI, UserManager
+from aiogram.filters import Command, CommandObject
+from db.repository import UserRepository
+from clockify_api import AsyncClockifyAPI, UserManager
+from reports import ReportManager
+from time_conversion import DEFAULT_TIMEZONE
 from aiogram.fsm.state import State, StatesGroup
 
 router = Router()
 
-clockify_api = ClockifyAPI()
-db_conn = create_connection()
-user_manager = UserManager(db_conn)
-
 # Состояния для FSM
 class Form(StatesGroup):
     email = State()
     api_key = State()
 
 @router.message(Command('start'))
-async def cmd_start(message: types.Message, state: FSMContext):
-    user_manager.add_new_users_to_db(clockify_api)
+async def cmd_start(message: types.Message, state: FSMContext, repository: UserRepository):
     tg_username = message.from_user.username
-    user = get_user_by_tg_username(db_conn, tg_username)
+    user = await repository.get_user_by_tg_username(tg_username)
 
-    if user and user[1]:  # Проверяем, что api_key уже установлен
+    if user and user.clockify_apikey:  # Проверяем, что api_key уже установлен
+        await repository.set_user_chat(user.clockify_userid, message.chat.id)
         await message.answer("Вы уже зарегистрированы. Используйте команды:\n"
-                             "/create_time_entry\n/start_time_entry\n/end_time_entry\n/change_api_key")
+                             "/create_time_entry\n/quick_entry\n/start_time_entry\n/end_time_entry\n/status\n/report\n/import_entries\n/reminders\n/timezone\n/change_api_key")
         await state.clear()
     else:
         await message.answer("Пожалуйста, отправьте вашу электронную почту для идентификации.")
         await state.set_state(Form.email)
 
 @router.message(Form.email)
-async def process_email(message: types.Message, state: FSMContext):
+async def process_email(message: types.Message, state: FSMContext, repository: UserRepository,
+                        user_manager: UserManager, clockify_api: AsyncClockifyAPI):
     email = message.text
-    user = get_user_by_email(db_conn, email)
+    user = await repository.get_user_by_email(email)
+    if not user:
+        # Пользователь мог появиться в Clockify после последней фоновой синхронизации
+        await user_manager.sync_users(clockify_api, remove_missing=False)
+        user = await repository.get_user_by_email(email)
     if user:
         tg_username = message.from_user.username
         await state.update_data(email=email, tg_username=tg_username)
-        update_user_by_email(db_conn, email, 'placeholder_api_key', tg_username)
+        await repository.update_user_by_email(email, 'placeholder_api_key', tg_username)
         await message.answer("Пользователь найден. Пожалуйста, отправьте ваш Clockify API ключ.")
         await state.set_state(Form.api_key)
     else:
@@ -46,16 +48,58 @@ async def process_email(message: types.Message, state: FSMContext):
         await state.clear()
 
 @router.message(Form.api_key)
-async def process_api_key(message: types.Message, state: FSMContext):
+async def process_api_key(message: types.Message, state: FSMContext, repository: UserRepository):
     api_key = message.text
     user_data = await state.get_data()
     tg_username = message.from_user.username
-    update_api_key_by_tg_username(db_conn, tg_username, api_key)
+    await repository.update_api_key_by_tg_username(tg_username, api_key)
+    user = await repository.get_user_by_tg_username(tg_username)
+    if user:
+        # Чат нужен для напоминаний о таймерах
+        await repository.set_user_chat(user.clockify_userid, message.chat.id)
     await message.answer("Ваш API ключ обновлен. Теперь используйте команды:\n"
-                         "/create_time_entry\n/start_time_entry\n/end_time_entry\n/change_api_key")
+                         "/create_time_entry\n/quick_entry\n/start_time_entry\n/end_time_entry\n/status\n/report\n/import_entries\n/reminders\n/timezone\n/change_api_key")
     await state.clear()
 
 @router.message(Command('change_api_key'))
 async def cmd_change_api_key(message: types.Message, state: FSMContext):
     await message.answer("Отправьте новый API ключ:")
     await state.set_state(Form.api_key)
+
+# Включение и отключение напоминаний о таймерах: /reminders on|off
+@router.message(Command('reminders'))
+async def cmd_reminders(message: types.Message, command: CommandObject, repository: UserRepository):
+    arg = (command.args or '').strip().lower()
+    if arg not in ('on', 'off'):
+        await message.answer("Использование: /reminders on|off")
+        return
+    user = await repository.get_user_by_tg_username(message.from_user.username)
+    if not user:
+        await message.answer("Сначала зарегистрируйтесь через /start.")
+        return
+    await repository.set_user_chat(user.clockify_userid, message.chat.id)
+    await repository.set_reminders_enabled(user.clockify_userid, arg == 'on')
+    await message.answer("Напоминания включены." if arg == 'on' else "Напоминания отключены.")
+
+# Часовой пояс для ввода и показа времени: /timezone Europe/Moscow, /timezone reset — пояс по умолчанию
+@router.message(Command('timezone'))
+async def cmd_timezone(message: types.Message, command: CommandObject, user_manager: UserManager,
+                       report_manager: ReportManager):
+    arg = (command.args or '').strip()
+    if not arg:
+        tz = await user_manager.get_user_timezone(message.from_user.username)
+        await message.answer(f"Ваш часовой пояс: {tz.zone}.\n"
+                             "Сменить: /timezone Europe/Moscow\n"
+                             f"Вернуть пояс по умолчанию ({DEFAULT_TIMEZONE}): /timezone reset")
+        return
+    try:
+        user = await user_manager.set_user_timezone(message.from_user.username,
+                                                    None if arg.lower() == 'reset' else arg)
+    except ValueError:
+        await message.answer("Неизвестный часовой пояс или вы ещё не зарегистрированы (/start). "
+                             "Укажите пояс из базы tz, например Europe/Moscow или Asia/Yekaterinburg.")
+        return
+    # Дни в отчётах считаются по часовому поясу — записи нужно перераспределить по дням
+    await report_manager.reset_sync(user.clockify_userid)
+    tz = await user_manager.get_user_timezone(message.from_user.username)
+    await message.answer(f"Часовой пояс изменён: {tz.zone}.")
@@ -0,0 +1,161 @@
+import os
+from datetime import date, datetime, timedelta, tzinfo
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+import pytz
+
+# Часовой пояс пользователей, которые не выбрали свой (/timezone)
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'Europe/Moscow')
+# Число дней (и часов с переходом на летнее время), смещение от UTC которых запоминается
+OFFSET_CACHE_SIZE = int(os.getenv('OFFSET_CACHE_SIZE', '4096'))
+
+# Формат даты и времени, который вводят в боте и в файлах импорта
+LOCAL_FORMAT = '%Y-%m-%d %H:%M'
+CLOCKIFY_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+_HOUR_END = timedelta(minutes=59, seconds=59)
+_DAY_END = timedelta(hours=23, minutes=59, seconds=59)
+_MISSING = object()
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name: Optional[str] = None) -> tzinfo:
+    """Объект часового пояса по имени из базы tz; None — пояс по умолчанию.
+
+    pytz.timezone разбирает файл зоны при каждом вызове, здесь — один раз на имя.
+    """
+    return pytz.timezone(name or DEFAULT_TIMEZONE)
+
+
+def timezone_name(name: str) -> Optional[str]:
+    """Имя пояса из базы tz без учёта регистра (europe/moscow → Europe/Moscow); None, если пояса нет."""
+    try:
+        return pytz.timezone(name).zone
+    except pytz.UnknownTimeZoneError:
+        return None
+
+
+def user_timezone(user) -> tzinfo:
+    """Часовой пояс пользователя из строки users (или пояс по умолчанию)."""
+    return get_timezone(user.timezone if user is not None else None)
+
+
+def parse_local(value: str) -> datetime:
+    """Строгий разбор YYYY-MM-DD HH:MM без strptime: срезы фиксированной длины и int()."""
+    if (len(value) != 16 or value[4] != '-' or value[7] != '-' or value[10] != ' ' or value[13] != ':'
+            or not value.isascii()
+            or not (value[:4] + value[5:7] + value[8:10] + value[11:13] + value[14:]).isdigit()):
+        raise ValueError(f"time data {value!r} does not match format 'YYYY-MM-DD HH:MM'")
+    return datetime(int(value[:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]), int(value[14:]))
+
+
+def parse_clockify(value: str) -> datetime:
+    """Время из ответа Clockify как наивный datetime в UTC."""
+    if len(value) == 20 and value[19] == 'Z':
+        return datetime.fromisoformat(value[:19])
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _format_utc(value: datetime) -> str:
+    return value.replace(microsecond=0).isoformat() + 'Z'
+
+
+# Смещение от UTC меняется не чаще раза в сутки (переход на летнее время), поэтому
+# его можно вычислить один раз на день, а для дня с переходом — на час. Для часа,
+# внутри которого смещение меняется, кэш возвращает None, и время переводится точно
+@lru_cache(maxsize=OFFSET_CACHE_SIZE)
+def _local_span_offset(tz: tzinfo, start: datetime, length: timedelta) -> Optional[timedelta]:
+    offset = tz.localize(start).utcoffset()
+    return offset if tz.localize(start + length).utcoffset() == offset else None
+
+
+@lru_cache(maxsize=OFFSET_CACHE_SIZE)
+def _utc_span_offset(tz: tzinfo, start: datetime, length: timedelta) -> Optional[timedelta]:
+    offset = pytz.utc.localize(start).astimezone(tz).utcoffset()
+    return offset if pytz.utc.localize(start + length).astimezone(tz).utcoffset() == offset else None
+
+
+def _local_offset(tz: tzinfo, value: datetime) -> timedelta:
+    offset = _local_span_offset(tz, datetime(value.year, value.month, value.day), _DAY_END)
+    if offset is None:
+        offset = _local_span_offset(tz, value.replace(minute=0, second=0, microsecond=0), _HOUR_END)
+        if offset is None:
+            offset = tz.localize(value).utcoffset()
+    return offset
+
+
+def _utc_offset(tz: tzinfo, value: datetime) -> timedelta:
+    offset = _utc_span_offset(tz, datetime(value.year, value.month, value.day), _DAY_END)
+    if offset is None:
+        offset = _utc_span_offset(tz, value.replace(minute=0, second=0, microsecond=0), _HOUR_END)
+        if offset is None:
+            offset = pytz.utc.localize(value).astimezone(tz).utcoffset()
+    return offset
+
+
+def local_to_clockify(value: datetime, tz: Optional[tzinfo] = None) -> str:
+    """Наивное местное время пользователя в UTC-строку формата Clockify."""
+    tz = tz or get_timezone()
+    return _format_utc(value - _local_offset(tz, value))
+
+
+def aware_to_clockify(value: datetime) -> str:
+    """Время с часовым поясом (например, now_local(tz)) в UTC-строку формата Clockify."""
+    return _format_utc(value.astimezone(pytz.utc).replace(tzinfo=None))
+
+
+def clockify_to_local(value: str, tz: Optional[tzinfo] = None) -> datetime:
+    """Время из Clockify в часовом поясе пользователя."""
+    return pytz.utc.localize(parse_clockify(value)).astimezone(tz or get_timezone())
+
+
+def now_local(tz: Optional[tzinfo] = None) -> datetime:
+    return datetime.now(tz or get_timezone())
+
+
+def today_local(tz: Optional[tzinfo] = None) -> date:
+    return now_local(tz).date()
+
+
+# Пакетные варианты для импорта и отчётов: смещение дня берётся из словаря
+# по строке даты, без обращений к lru_cache и pytz для каждого значения
+def local_strings_to_clockify(values: Iterable[str], tz: Optional[tzinfo] = None) -> List[str]:
+    """Список строк YYYY-MM-DD HH:MM в UTC-строки Clockify. ValueError на первой неверной строке."""
+    tz = tz or get_timezone()
+    offsets = {}
+    result = []
+    for value in values:
+        local = parse_local(value)
+        day = value[:10]
+        offset = offsets.get(day, _MISSING)
+        if offset is _MISSING:
+            offset = offsets[day] = _local_span_offset(tz, datetime(local.year, local.month, local.day), _DAY_END)
+        if offset is None:
+            offset = _local_offset(tz, local)
+        result.append((local - offset).isoformat() + 'Z')
+    return result
+
+
+def clockify_local_dates(values: Iterable[str], tz: Optional[tzinfo] = None) -> List[str]:
+    """Местные даты (YYYY-MM-DD) для списка времён Clockify."""
+    return utc_local_dates(map(parse_clockify, values), tz)
+
+
+def utc_local_dates(values: Iterable[datetime], tz: Optional[tzinfo] = None) -> List[str]:
+    """Местные даты (YYYY-MM-DD) для списка уже разобранных наивных времён UTC."""
+    tz = tz or get_timezone()
+    offsets = {}
+    result = []
+    for utc in values:
+        day = utc.date()
+        offset = offsets.get(day, _MISSING)
+        if offset is _MISSING:
+            offset = offsets[day] = _utc_span_offset(tz, datetime(utc.year, utc.month, utc.day), _DAY_END)
+        if offset is None:
+            offset = _utc_offset(tz, utc)
+        result.append((utc + offset).date().isoformat())
+    return result
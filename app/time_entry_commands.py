@@ -1,21 +1,26 @@
-import requests
+import csv
+import io
+import os
+import aiohttp
 from aiogram import Router, types
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import BufferedInputFile
 from aiogram.fsm.state import State, StatesGroup
-from datetime import datetime, timedelta
-from db.engine import create_connection
-from db.methods import get_user_by_tg_username
-from clockify_api import ClockifyAPI, TimeEntryManager, UserManager
-from utils import get_current_time_in_moscow
+from datetime import datetime
+from clockify_api import AsyncClockifyAPI, TimeEntryManager, UserManager, TimerAlreadyRunningError
+from time_conversion import clockify_to_local, local_strings_to_clockify, today_local
+from entry_import import iter_text_lines, parse_entries
+from outbox import with_queued_note
+from keyboards import (choice_keyboard, date_keyboard, end_date_keyboard, format_minutes, page_count, parse_date,
+                       parse_time, project_keyboard, time_keyboard, turn_page)
 
 router = Router()
 
-clockify_api = ClockifyAPI()
-db_conn = create_connection()
-time_entry_manager = TimeEntryManager(db_conn)
-user_manager = UserManager(db_conn)
+# Ограничения для /import_entries
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', '1000'))
+IMPORT_MAX_FILE_SIZE = 1024 * 1024
+IMPORT_ERRORS_IN_REPLY = 20
 
 # Состояния для FSM
 class CreateTimeEntryForm(StatesGroup):
@@ -31,56 +36,26 @@ class StartTimeEntryForm(StatesGroup):
     project_choice = State()
     description = State()
 
-# Функция для создания клавиатуры с датами (от сегодня до 5 дней назад)
-def get_date_keyboard():
-    buttons = []
-    for i in range(6):
-        date = (datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d')
-        buttons.append([KeyboardButton(text=date)])
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
-
-# Функция для создания клавиатуры с временем (с шагом в 30 минут)
-def get_time_keyboard(start_time_limit=None):
-    buttons = []
-    times = []
-    for hour in range(24):
-        for minute in [0, 30]:
-            time_str = f"{hour:02}:{minute:02}"
-            if start_time_limit and datetime.strptime(time_str, "%H:%M") < start_time_limit:
-                continue
-            times.append(time_str)
-    for i in range(0, len(times), 2):
-        buttons.append([KeyboardButton(text=times[i]), KeyboardButton(text=times[i+1])])
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
-
-# Функция для создания клавиатуры с датой окончания
-def get_end_date_keyboard(start_date):
-    buttons = []
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    if start_date == today:
-        # Если дата начала — сегодня, добавляем только "сегодня" и "завтра"
-        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-        buttons = [[KeyboardButton(text=today)], [KeyboardButton(text=tomorrow)]]
-    else:
-        # Добавляем даты от сегодня до даты начала включительно
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-        days_diff = (datetime.now() - start_date_obj).days
-        for i in range(days_diff + 1):
-            date = (start_date_obj + timedelta(days=i)).strftime('%Y-%m-%d')
-            buttons.append([KeyboardButton(text=date)])
-    
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+class ImportEntriesForm(StatesGroup):
+    document = State()
+
+async def send_project_keyboard(message: types.Message, state: FSMContext, user_manager: UserManager,
+                                clockify_api: AsyncClockifyAPI, page: int = 0) -> bool:
+    """Страница клавиатуры проектов пользователя. False, если проектов нет."""
+    projects = tuple(await user_manager.get_user_projects(clockify_api, message.from_user.username))
+    if not projects:
+        return False
+    page = min(max(page, 0), page_count(len(projects)) - 1)
+    await state.update_data(project_page=page)
+    await message.answer("Выберите проект:", reply_markup=project_keyboard(projects, page))
+    return True
 
 # Команда для создания полной записи времени
 @router.message(Command('create_time_entry'))
-async def cmd_create_time_entry(message: types.Message, state: FSMContext):
+async def cmd_create_time_entry(message: types.Message, state: FSMContext, user_manager: UserManager,
+                                clockify_api: AsyncClockifyAPI):
     try:
-        projects = user_manager.get_user_projects(clockify_api, message.from_user.username)
-        if projects:
-            buttons = [[KeyboardButton(text=project)] for project in projects]
-            markup = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
-            await message.answer("Выберите проект:", reply_markup=markup)
+        if await send_project_keyboard(message, state, user_manager, clockify_api):
             await state.set_state(CreateTimeEntryForm.project_choice)
         else:
             await message.answer("Проекты не найдены.")
@@ -88,57 +63,89 @@ async def cmd_create_time_entry(message: types.Message, state: FSMContext):
         await message.answer(f"Ошибка при получении проектов: {str(e)}")
 
 @router.message(CreateTimeEntryForm.project_choice)
-async def process_project_choice(message: types.Message, state: FSMContext):
+async def process_project_choice(message: types.Message, state: FSMContext, user_manager: UserManager,
+                                 clockify_api: AsyncClockifyAPI):
+    page = turn_page(message.text, (await state.get_data()).get('project_page', 0))
+    if page is not None:
+        await send_project_keyboard(message, state, user_manager, clockify_api, page)
+        return
     await state.update_data(project=message.text)
     await message.answer("Введите описание:")
     await state.set_state(CreateTimeEntryForm.description)
 
 @router.message(CreateTimeEntryForm.description)
-async def process_description(message: types.Message, state: FSMContext):
+async def process_description(message: types.Message, state: FSMContext, user_manager: UserManager):
     await state.update_data(description=message.text)
-    markup = get_date_keyboard()
-    await message.answer("Выберите дату начала:", reply_markup=markup)
+    tz = await user_manager.get_user_timezone(message.from_user.username)
+    await message.answer("Выберите дату начала:", reply_markup=date_keyboard(today_local(tz)))
     await state.set_state(CreateTimeEntryForm.start_date)
 
 @router.message(CreateTimeEntryForm.start_date)
-async def process_start_date(message: types.Message, state: FSMContext):
-    await state.update_data(start_date=message.text)
-    markup = get_time_keyboard()
-    await message.answer("Выберите время начала:", reply_markup=markup)
+async def process_start_date(message: types.Message, state: FSMContext, user_manager: UserManager):
+    start_date = parse_date(message.text)
+    today = today_local(await user_manager.get_user_timezone(message.from_user.username))
+    # Для даты из будущего не было бы ни одной даты окончания
+    if start_date is None or start_date > today:
+        await message.answer("Введите дату начала в формате ГГГГ-ММ-ДД, не позже сегодняшней:",
+                             reply_markup=date_keyboard(today))
+        return
+    await state.update_data(start_date=start_date.isoformat())
+    await message.answer("Выберите время начала:", reply_markup=time_keyboard())
     await state.set_state(CreateTimeEntryForm.start_time)
 
 @router.message(CreateTimeEntryForm.start_time)
-async def process_start_time(message: types.Message, state: FSMContext):
-    await state.update_data(start_time=message.text)
+async def process_start_time(message: types.Message, state: FSMContext, user_manager: UserManager):
+    start_time = parse_time(message.text)
+    if start_time is None:
+        await message.answer("Введите время в формате ЧЧ:ММ:", reply_markup=time_keyboard())
+        return
+    # Сохраняется в строгом формате ЧЧ:ММ: «9:30» и « 09:30 » разбираются так же, как кнопка 09:30
+    await state.update_data(start_time=format_minutes(start_time))
     
     # Получаем дату начала
     user_data = await state.get_data()
     start_date = user_data['start_date']
     
     # Формируем клавиатуру для выбора даты окончания
-    markup = get_end_date_keyboard(start_date)
-    await message.answer("Выберите дату окончания:", reply_markup=markup)
+    tz = await user_manager.get_user_timezone(message.from_user.username)
+    await message.answer("Выберите дату окончания:", reply_markup=end_date_keyboard(start_date, today_local(tz)))
     await state.set_state(CreateTimeEntryForm.end_date)
 
 @router.message(CreateTimeEntryForm.end_date)
-async def process_end_date(message: types.Message, state: FSMContext):
-    await state.update_data(end_date=message.text)
-    
-    # Если дата окончания совпадает с началом, то время окончания не может быть раньше начала
+async def process_end_date(message: types.Message, state: FSMContext, user_manager: UserManager):
     user_data = await state.get_data()
     start_date = user_data['start_date']
-    start_time = datetime.strptime(user_data['start_time'], "%H:%M")
+    end_date = parse_date(message.text)
+    if end_date is None or end_date.isoformat() < start_date:
+        tz = await user_manager.get_user_timezone(message.from_user.username)
+        await message.answer("Введите дату окончания в формате ГГГГ-ММ-ДД, не раньше даты начала:",
+                             reply_markup=end_date_keyboard(start_date, today_local(tz)))
+        return
+    await state.update_data(end_date=end_date.isoformat())
     
+    # Если дата окончания совпадает с началом, то время окончания не может быть раньше начала.
     # Ограничиваем выбор времени окончания только если дата совпадает
-    time_limit = start_time if start_date == message.text else None
-    markup = get_time_keyboard(start_time_limit=time_limit)
-    await message.answer("Выберите время окончания:", reply_markup=markup)
+    time_limit = _end_time_limit(user_data['start_date'], user_data['start_time'], end_date.isoformat())
+    await message.answer("Выберите время окончания:", reply_markup=time_keyboard(time_limit))
     await state.set_state(CreateTimeEntryForm.end_time)
 
+def _end_time_limit(start_date: str, start_time: str, end_date: str):
+    """Минуты начала, если запись заканчивается в день начала: окончание должно быть позже."""
+    return parse_time(start_time) if start_date == end_date else None
+
 @router.message(CreateTimeEntryForm.end_time)
 async def process_end_time(message: types.Message, state: FSMContext):
-    await state.update_data(end_time=message.text)
     user_data = await state.get_data()
+    end_time = parse_time(message.text)
+    time_limit = _end_time_limit(user_data['start_date'], user_data['start_time'], user_data['end_date'])
+    if end_time is None or (time_limit is not None and end_time <= time_limit):
+        if end_time is None:
+            text = "Введите время в формате ЧЧ:ММ:"
+        else:
+            text = f"Время окончания должно быть позже {user_data['start_time']}. Введите время ЧЧ:ММ:"
+        await message.answer(text, reply_markup=time_keyboard(time_limit))
+        return
+    user_data = await state.update_data(end_time=format_minutes(end_time))
     
     # Формируем сообщение с подтверждением
     start_time = f"{user_data['start_date']} {user_data['start_time']}"
@@ -146,8 +153,7 @@ async def process_end_time(message: types.Message, state: FSMContext):
     project = user_data['project']
     description = user_data['description']
     
-    buttons = [[KeyboardButton(text=project)] for project in ['да', 'нет']]
-    markup = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+    markup = choice_keyboard('да', 'нет')
     await message.answer(f"Подтвердите запись времени:\n\n"
                          f"Проект: {project}\n"
                          f"Описание: {description}\n"
@@ -156,17 +162,25 @@ async def process_end_time(message: types.Message, state: FSMContext):
     await state.set_state(CreateTimeEntryForm.confirmation)
 
 @router.message(CreateTimeEntryForm.confirmation)
-async def process_confirmation(message: types.Message, state: FSMContext):
+async def process_confirmation(message: types.Message, state: FSMContext, time_entry_manager: TimeEntryManager,
+                               user_manager: UserManager, clockify_api: AsyncClockifyAPI):
     if message.text.lower() == 'да':
         try:
             user_data = await state.get_data()
-            start_time = f"{user_data['start_date']}T{user_data['start_time']}:00Z"
-            end_time = f"{user_data['end_date']}T{user_data['end_time']}:00Z"
-            time_entry_manager.create_time_entry(
+            # Дата и время введены по часовому поясу пользователя, Clockify ждёт UTC
+            tz = await user_manager.get_user_timezone(message.from_user.username)
+            start_time, end_time = local_strings_to_clockify(
+                (f"{user_data['start_date']} {user_data['start_time']}",
+                 f"{user_data['end_date']} {user_data['end_time']}"), tz)
+            if end_time <= start_time:
+                raise ValueError("время окончания должно быть позже начала")
+            await time_entry_manager.create_time_entry(
                 clockify_api, message.from_user.username, start_time, end_time,
-                user_data['project'], user_data['description']
+                user_data['project'], user_data['description'],
+                chat_id=message.chat.id, idempotency_key=f"{message.chat.id}:{message.message_id}"
             )
-            await message.answer("Запись времени успешно создана.")
+            await message.answer(with_queued_note("Запись времени успешно создана.",
+                                                  time_entry_manager.outbox is not None))
         except Exception as e:
             await message.answer(f"Ошибка при создании записи времени: {str(e)}")
     else:
@@ -176,13 +190,10 @@ async def process_confirmation(message: types.Message, state: FSMContext):
 
 # Команда для начала записи времени
 @router.message(Command('start_time_entry'))
-async def cmd_start_time_entry(message: types.Message, state: FSMContext):
+async def cmd_start_time_entry(message: types.Message, state: FSMContext, user_manager: UserManager,
+                               clockify_api: AsyncClockifyAPI):
     try:
-        projects = user_manager.get_user_projects(clockify_api, message.from_user.username)
-        if projects:
-            buttons = [[KeyboardButton(text=project)] for project in projects]
-            markup = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
-            await message.answer("Выберите проект:", reply_markup=markup)
+        if await send_project_keyboard(message, state, user_manager, clockify_api):
             await state.set_state(StartTimeEntryForm.project_choice)
         else:
             await message.answer("Проекты не найдены.")
@@ -190,35 +201,118 @@ async def cmd_start_time_entry(message: types.Message, state: FSMContext):
         await message.answer(f"Ошибка при получении проектов: {str(e)}")
 
 @router.message(StartTimeEntryForm.project_choice)
-async def process_project_choice_start(message: types.Message, state: FSMContext):
+async def process_project_choice_start(message: types.Message, state: FSMContext, user_manager: UserManager,
+                                       clockify_api: AsyncClockifyAPI):
+    page = turn_page(message.text, (await state.get_data()).get('project_page', 0))
+    if page is not None:
+        await send_project_keyboard(message, state, user_manager, clockify_api, page)
+        return
     await state.update_data(project=message.text)
     await message.answer("Введите описание:")
     await state.set_state(StartTimeEntryForm.description)
 
 @router.message(StartTimeEntryForm.description)
-async def process_description_start(message: types.Message, state: FSMContext):
+async def process_description_start(message: types.Message, state: FSMContext, time_entry_manager: TimeEntryManager,
+                                    clockify_api: AsyncClockifyAPI):
     user_data = await state.get_data()
     description = message.text
     project_name = user_data.get('project')
 
-    # Используем текущее время для начала записи
-    start_time = get_current_time_in_moscow()
-
-    time_entry_manager.start_time_entry(
-        clockify_api, message.from_user.username, project_name, description
-    )
-    await message.answer("Запись времени успешно начата.")
+    try:
+        await time_entry_manager.start_time_entry(
+            clockify_api, message.from_user.username, project_name, description,
+            chat_id=message.chat.id, idempotency_key=f"{message.chat.id}:{message.message_id}"
+        )
+        await message.answer(with_queued_note("Запись времени успешно начата.",
+                                              time_entry_manager.outbox is not None))
+    except TimerAlreadyRunningError as e:
+        await message.answer(f"Уже запущена запись по проекту {e.timer.project_name}. "
+                             "Завершите её командой /end_time_entry.")
+    except Exception as e:
+        await message.answer(f"Ошибка при начале записи времени: {str(e)}")
     await state.clear()
 
 @router.message(Command('end_time_entry'))
-async def cmd_end_time_entry(message: types.Message):
+async def cmd_end_time_entry(message: types.Message, time_entry_manager: TimeEntryManager,
+                             clockify_api: AsyncClockifyAPI):
     try:
-        time_entry_manager.end_time_entry(clockify_api, message.from_user.username)
-        await message.answer("Запись времени успешно завершена.")
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
+        await time_entry_manager.end_time_entry(clockify_api, message.from_user.username, chat_id=message.chat.id,
+                                                idempotency_key=f"{message.chat.id}:{message.message_id}")
+        await message.answer(with_queued_note("Запись времени успешно завершена.",
+                                              time_entry_manager.outbox is not None))
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
             await message.answer("Ошибка: Тайм-запись не найдена.")
         else:
-            await message.answer(f"Произошла ошибка при завершении записи времени: {e.response.status_code} {e.response.text}")
+            await message.answer(f"Произошла ошибка при завершении записи времени: {e.status} {e.message}")
+    except Exception as e:
+        await message.answer(f"Произошла ошибка: {str(e)}")
+
+
+# Команда для просмотра запущенной записи времени
+@router.message(Command('status'))
+async def cmd_status(message: types.Message, time_entry_manager: TimeEntryManager, user_manager: UserManager):
+    try:
+        timer = await time_entry_manager.get_running_timer(message.from_user.username)
+        tz = await user_manager.get_user_timezone(message.from_user.username)
     except Exception as e:
         await message.answer(f"Произошла ошибка: {str(e)}")
+        return
+    if timer is None:
+        await message.answer("Нет запущенной записи времени.")
+        return
+    started_at = clockify_to_local(timer.started_at, tz)
+    elapsed = datetime.now(started_at.tzinfo) - started_at
+    hours, minutes = divmod(int(elapsed.total_seconds()) // 60, 60)
+    await message.answer(f"Запущена запись времени:\n\n"
+                         f"Проект: {timer.project_name or '—'}\n"
+                         f"Описание: {timer.description or '—'}\n"
+                         f"Начало: {started_at.strftime('%Y-%m-%d %H:%M')}\n"
+                         f"Прошло: {hours} ч {minutes} мин")
+
+# Команда для массового импорта записей времени из CSV
+@router.message(Command('import_entries'))
+async def cmd_import_entries(message: types.Message, state: FSMContext):
+    await message.answer("Отправьте CSV или текстовый файл с записями. Каждая строка:\n"
+                         "проект;описание;YYYY-MM-DD HH:MM;YYYY-MM-DD HH:MM\n"
+                         "Время — по вашему часовому поясу (/timezone).\n"
+                         f"Не более {IMPORT_MAX_ROWS} записей.")
+    await state.set_state(ImportEntriesForm.document)
+
+@router.message(ImportEntriesForm.document)
+async def process_import_document(message: types.Message, state: FSMContext, time_entry_manager: TimeEntryManager,
+                                  user_manager: UserManager, clockify_api: AsyncClockifyAPI):
+    document = message.document
+    if document is None:
+        await message.answer("Пришлите файл документом.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer("Файл слишком большой (максимум 1 МБ).")
+        await state.clear()
+        return
+    await state.clear()
+    try:
+        data = await message.bot.download(document, destination=io.BytesIO())
+        data.seek(0)
+        tz = await user_manager.get_user_timezone(message.from_user.username)
+        entries = parse_entries(iter_text_lines(data), IMPORT_MAX_ROWS, tz)
+        results = await time_entry_manager.import_time_entries(clockify_api, message.from_user.username, entries)
+    except Exception as e:
+        await message.answer(f"Ошибка при импорте записей: {str(e)}")
+        return
+
+    created = sum(result.ok for result in results)
+    failed = [result for result in results if not result.ok]
+    lines = [f"Импорт завершён: создано {created} из {len(results)} записей."]
+    lines += [f"Строка {result.line}: {result.message}" for result in failed[:IMPORT_ERRORS_IN_REPLY]]
+    if len(failed) > IMPORT_ERRORS_IN_REPLY:
+        # Полный отчёт по строкам прикладываем файлом, чтобы не упереться в лимит длины сообщения
+        report = io.StringIO()
+        writer = csv.writer(report, delimiter=';')
+        writer.writerow(['line', 'ok', 'message'])
+        writer.writerows(results)
+        lines.append(f"...и ещё {len(failed) - IMPORT_ERRORS_IN_REPLY} ошибок, полный отчёт во вложении.")
+        await message.answer_document(BufferedInputFile(report.getvalue().encode('utf-8'), filename='import_report.csv'),
+                                      caption="\n".join(lines)[:1024])
+    else:
+        await message.answer("\n".join(lines))
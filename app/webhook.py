@@ -0,0 +1,143 @@
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import signal
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from metrics import REGISTRY, add_metrics_route
+
+logger = logging.getLogger(__name__)
+
+# Режим работы бота: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес, на который Telegram отправляет обновления (https://example.com)
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Секрет, который Telegram присылает в заголовке каждого запроса. Если не задан, а адрес
+# регистрирует сам бот (WEBHOOK_BASE_URL), секрет генерируется при запуске
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8081'))
+# Число обработчиков обновлений и размер очереди перед ними
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """HTTP-сервер для приёма обновлений Telegram.
+
+    Обновление кладётся в очередь, и Telegram сразу получает ответ 200;
+    обрабатывают очередь WEBHOOK_WORKERS задач. При остановке сервер перестаёт
+    принимать запросы и дорабатывает уже принятые обновления. Запросы без
+    секрета Telegram отклоняются, поэтому без секрета сервер не создаётся.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH,
+                 workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE):
+        if not secret:
+            raise ValueError("Webhook secret is required: set WEBHOOK_SECRET")
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.path = path
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._worker_tasks = []
+        self._runner: Optional[web.AppRunner] = None
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self.handle)
+        add_metrics_route(self.app)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception:
+            self.rejected += 1
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception("Update %s failed: %s", update.update_id, e)
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        return {'received': self.received, 'rejected': self.rejected, 'processed': self.processed,
+                'failed': self.failed, 'queue_size': self.queue.qsize()}
+
+    async def start(self, host: str = WEBAPP_HOST, port: int = WEBAPP_PORT) -> None:
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("Webhook server listening on %s:%s%s", host, port, self.path)
+
+    async def stop(self) -> None:
+        """Остановка: новые запросы не принимаются, принятые обновления дорабатываются."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.queue.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """Запуск бота в режиме webhook до получения сигнала остановки."""
+    secret = WEBHOOK_SECRET
+    if not secret:
+        if not WEBHOOK_BASE_URL:
+            # Адрес зарегистрирован вне бота, и секрет, известный Telegram, взять неоткуда
+            raise RuntimeError("WEBHOOK_SECRET must be set when WEBHOOK_BASE_URL is empty")
+        secret = secrets.token_urlsafe(32)
+    server = WebhookServer(dp, bot, secret)
+    REGISTRY.register_stats('webhook', server.stats)
+    await dp.emit_startup(bot=bot)
+    await server.start()
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(f'{WEBHOOK_BASE_URL.rstrip("/")}{WEBHOOK_PATH}', secret_token=secret,
+                              allowed_updates=dp.resolve_used_update_types())
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
@@ -0,0 +1,325 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import TelegramObject, Update
+
+from container import Container
+from metrics import REGISTRY, setup_logging
+from outbox import OUTBOX_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Число процессов-обработчиков обновлений; 1 — всё в одном процессе
+WORKERS = int(os.getenv('WORKERS', '1'))
+# Как часто обработчик присылает фронту статистику (в секундах)
+WORKER_REPORT_INTERVAL = float(os.getenv('WORKER_REPORT_INTERVAL', '5'))
+# Обработчик, который так долго не присылал статистику, считается зависшим (в секундах)
+WORKER_STALL_TIMEOUT = float(os.getenv('WORKER_STALL_TIMEOUT', '60'))
+# Сколько ждать, пока обработчики доработают принятые обновления при остановке (в секундах)
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv('WORKER_SHUTDOWN_TIMEOUT', '30'))
+# Сколько обновлений обработчик забирает из очереди за раз
+WORKER_BATCH = 100
+
+# Команды фронта обработчику: передаются в очереди обновлений кортежем (команда,)
+STOP = 'stop'
+CLEAR_USER_CACHE = 'clear_user_cache'
+
+
+def shard_key(update: Update) -> int:
+    """Ключ распределения обновления: Telegram ID пользователя, иначе чата, иначе номер обновления."""
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.user is not None:
+        return context.user.id
+    if context.chat is not None:
+        return context.chat.id
+    return update.update_id
+
+
+def _next_batch(updates) -> List[Any]:
+    # Выполняется в потоке: первое обновление ждём, остальные забираем без ожидания
+    items = [updates.get()]
+    while len(items) < WORKER_BATCH:
+        try:
+            items.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return items
+
+
+def run_worker(index: int, updates, reports, dispatcher_factory: Callable[[Container], Dispatcher],
+               container_factory: Callable[[], Container]) -> None:
+    """Точка входа процесса-обработчика."""
+    # Ctrl+C получает вся группа процессов; обработчик останавливает фронт командой STOP,
+    # чтобы принятые обновления были доработаны
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging()
+    asyncio.run(_serve_worker(index, updates, reports, dispatcher_factory, container_factory))
+
+
+async def _serve_worker(index: int, updates, reports, dispatcher_factory, container_factory) -> None:
+    container = container_factory()
+    dp = dispatcher_factory(container)
+    container.register_stats(REGISTRY)
+    await container.startup()
+    # Кэш проектов у каждого обработчика свой: заполняется до первого обновления
+    try:
+        await container.clockify_api.project_cache.refresh()
+    except Exception as e:
+        logger.warning("Worker %d failed to warm up the project cache: %s", index, e)
+    if OUTBOX_ENABLED:
+        # Очередь изменений безопасно разбирать из нескольких процессов: запись захватывается атомарно
+        container.outbox.start()
+
+    bot = container.bot
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    counters = {'processed': 0, 'failed': 0}
+
+    async def handle(raw: str) -> None:
+        try:
+            await dp.feed_raw_update(bot, json.loads(raw))
+        except Exception as e:
+            counters['failed'] += 1
+            logger.exception("Worker %d failed to process an update: %s", index, e)
+        finally:
+            counters['processed'] += 1
+
+    def report() -> None:
+        reports.put({'worker': index, 'pid': os.getpid(), 'processed': counters['processed'],
+                     'failed': counters['failed'], 'in_flight': len(tasks), 'stats': REGISTRY.collect_stats()})
+
+    async def report_periodically() -> None:
+        while True:
+            await asyncio.sleep(WORKER_REPORT_INTERVAL)
+            report()
+
+    # Первый отчёт — сигнал фронту, что обработчик готов
+    report()
+    reporter = asyncio.create_task(report_periodically())
+    try:
+        stopping = False
+        while not stopping:
+            for item in await loop.run_in_executor(None, _next_batch, updates):
+                if isinstance(item, str):
+                    task = asyncio.create_task(handle(item))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif item[0] == CLEAR_USER_CACHE:
+                    container.repository.cache.clear()
+                elif item[0] == STOP:
+                    stopping = True
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        reporter.cancel()
+        report()
+        await container.close()
+
+
+class _Worker:
+    """Процесс-обработчик глазами фронта: очередь обновлений и последний отчёт."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.updates = None
+        self.pid = 0
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.restarts = 0
+        self.lost = 0
+        self.reported_at: Optional[float] = None
+        self.updates_per_s = 0.0
+        self.stats: Dict[str, float] = {}
+
+    @property
+    def backlog(self) -> int:
+        return self.submitted - self.processed
+
+    def update(self, report: Dict[str, Any], now: float) -> None:
+        if self.reported_at is not None and now > self.reported_at:
+            self.updates_per_s = (report['processed'] - self.processed) / (now - self.reported_at)
+        self.pid = report['pid']
+        self.processed = report['processed']
+        self.failed = report['failed']
+        self.in_flight = report['in_flight']
+        self.stats = report['stats']
+        self.reported_at = now
+
+
+class WorkerPool:
+    """Многопроцессный режим: фронт принимает обновления и раскладывает их по обработчикам.
+
+    Обновления одного пользователя всегда попадают в один процесс (Telegram ID
+    по модулю числа процессов), поэтому его диалог FSM обрабатывается по порядку.
+    У каждого обработчика свой контейнер: соединения с базой, кэши пользователей,
+    проектов и клавиатур, клиент Clockify с лимитами и очередь outbox.
+    Обработчики присылают фронту статистику; фронт перезапускает упавшие
+    процессы и отдаёт в /metrics здоровье и пропускную способность каждого.
+    """
+
+    def __init__(self, size: int, dispatcher_factory: Callable[[Container], Dispatcher],
+                 container_factory: Callable[[], Container] = Container):
+        self.size = size
+        self.dispatcher_factory = dispatcher_factory
+        self.container_factory = container_factory
+        # spawn, а не fork: дочерний процесс не наследует цикл событий, сессии и соединения фронта
+        self._context = multiprocessing.get_context('spawn')
+        self._reports = self._context.Queue()
+        self._workers = [_Worker(index) for index in range(size)]
+        self._monitor: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        for worker in self._workers:
+            self._spawn(worker)
+        self._monitor = asyncio.create_task(self._watch())
+
+    def _spawn(self, worker: _Worker) -> None:
+        # Очередь новая при каждом запуске: упавший процесс мог оставить старую заблокированной
+        if worker.updates is not None:
+            worker.updates.close()
+            worker.updates.cancel_join_thread()
+        worker.updates = self._context.Queue()
+        worker.reported_at = None
+        worker.process = self._context.Process(
+            target=run_worker, name=f'worker-{worker.index}',
+            args=(worker.index, worker.updates, self._reports, self.dispatcher_factory, self.container_factory))
+        worker.process.start()
+
+    def submit(self, update: Update) -> int:
+        """Передача обновления обработчику его пользователя. Возвращает номер обработчика."""
+        worker = self._workers[shard_key(update) % self.size]
+        worker.updates.put(update.model_dump_json(exclude_unset=True, by_alias=True))
+        worker.submitted += 1
+        return worker.index
+
+    def broadcast(self, command: str) -> None:
+        for worker in self._workers:
+            worker.updates.put((command,))
+
+    def clear_user_caches(self) -> None:
+        """Сброс кэшей пользователей в обработчиках после изменения таблицы users фронтом."""
+        self.broadcast(CLEAR_USER_CACHE)
+
+    def _collect(self) -> None:
+        now = time.monotonic()
+        while True:
+            try:
+                report = self._reports.get_nowait()
+            except queue.Empty:
+                return
+            self._workers[report['worker']].update(report, now)
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(1)
+            self._collect()
+            now = time.monotonic()
+            for worker in self._workers:
+                if not worker.process.is_alive():
+                    # Обновления, которые процесс принял, но не обработал, потеряны
+                    worker.lost += worker.backlog
+                    logger.error("Worker %d exited with code %s, restarting (%d updates lost)",
+                                 worker.index, worker.process.exitcode, worker.backlog)
+                    worker.restarts += 1
+                    worker.submitted = worker.processed = worker.in_flight = 0
+                    self._spawn(worker)
+                elif worker.reported_at is not None and now - worker.reported_at > WORKER_STALL_TIMEOUT:
+                    logger.warning("Worker %d has not reported for %.0f s", worker.index, now - worker.reported_at)
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание первого отчёта от каждого обработчика."""
+        return await self._wait(lambda: all(worker.reported_at is not None for worker in self._workers), timeout)
+
+    async def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание, пока обработчики обработают все переданные обновления (для бенчмарков)."""
+        return await self._wait(lambda: all(not worker.backlog and not worker.in_flight
+                                            for worker in self._workers), timeout)
+
+    async def _wait(self, condition: Callable[[], bool], timeout: Optional[float]) -> bool:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            self._collect()
+            if condition():
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.02)
+
+    def health(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [{
+            'worker': worker.index,
+            'pid': worker.pid,
+            'alive': worker.process is not None and worker.process.is_alive(),
+            'stalled': worker.reported_at is not None and now - worker.reported_at > WORKER_STALL_TIMEOUT,
+            'submitted': worker.submitted,
+            'processed': worker.processed,
+            'failed': worker.failed,
+            'backlog': worker.backlog,
+            'in_flight': worker.in_flight,
+            'updates_per_s': round(worker.updates_per_s, 1),
+            'restarts': worker.restarts,
+            'lost': worker.lost,
+            'report_age_s': round(now - worker.reported_at, 1) if worker.reported_at is not None else -1,
+        } for worker in self._workers]
+
+    def stats(self) -> Dict[str, float]:
+        """Здоровье и статистика каждого обработчика (ключи с номером) и итоги по всем."""
+        self._collect()
+        result: Dict[str, float] = {'count': self.size}
+        for item in self.health():
+            prefix = item.pop('worker')
+            for key, value in item.items():
+                result[f'{prefix}_{key}'] = int(value) if isinstance(value, bool) else value
+                if key in ('submitted', 'processed', 'failed', 'backlog', 'updates_per_s', 'restarts', 'lost'):
+                    result[key] = result.get(key, 0) + value
+        for worker in self._workers:
+            for key, value in worker.stats.items():
+                result[f'{worker.index}_{key}'] = value
+        return result
+
+    async def close(self, timeout: float = WORKER_SHUTDOWN_TIMEOUT) -> None:
+        """Остановка: обработчики дорабатывают принятые обновления, затем завершаются."""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+        self.broadcast(STOP)
+        # Отчёты читаются и во время ожидания: процесс не завершится, пока не передаст их
+        if not await self._wait(lambda: not any(worker.process.is_alive() for worker in self._workers), timeout):
+            for worker in self._workers:
+                if worker.process.is_alive():
+                    logger.warning("Worker %d did not stop in %.0f s, terminating", worker.index, timeout)
+                    worker.process.terminate()
+        for worker in self._workers:
+            worker.process.join()
+        self._collect()
+
+
+class ShardingMiddleware(BaseMiddleware):
+    """Внешний middleware фронта: обновление передаётся обработчику вместо роутеров.
+
+    Обновления, для которых local возвращает True, обрабатывают роутеры самого фронта.
+    """
+
+    def __init__(self, pool: WorkerPool, local: Optional[Callable[[Update], bool]] = None):
+        self.pool = pool
+        self.local = local
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if self.local is not None and self.local(event):
+            return await handler(event, data)
+        self.pool.submit(event)
+        return None
@@ -0,0 +1,60 @@
+"""Бенчмарк поиска пользователей в SQLite: без индексов (схема v1) и после миграций.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_db_lookup.py --sizes 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from db.engine import create_connection, migrate, MIGRATIONS  # noqa: E402
+from db.methods import add_users_bulk, get_user_by_email, get_user_by_tg_username  # noqa: E402
+
+
+def build_db(path, size, indexed):
+    conn = create_connection(path)
+    if indexed:
+        migrate(conn)
+    else:
+        with conn:
+            MIGRATIONS[0](conn)
+    add_users_bulk(conn, [(f'uid{i}', f'key{i}', f'tg{i}', f'user{i}@example.com') for i in range(size)])
+    return conn
+
+
+def measure(conn, size, lookups):
+    ids = [random.randrange(size) for _ in range(lookups)]
+    results = {}
+    for name, func, fmt in (('tg_username', get_user_by_tg_username, 'tg{}'),
+                            ('email', get_user_by_email, 'user{}@example.com')):
+        started = time.perf_counter()
+        for i in ids:
+            func(conn, fmt.format(i))
+        results[name] = (time.perf_counter() - started) / lookups * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'schema':>9} {'tg_username, us':>16} {'email, us':>10}")
+    for size in args.sizes:
+        for indexed in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                conn = build_db(os.path.join(tmp, 'bench.db'), size, indexed)
+                res = measure(conn, size, args.lookups)
+                conn.close()
+            schema = 'indexed' if indexed else 'baseline'
+            print(f"{size:>8} {schema:>9} {res['tg_username']:>16.1f} {res['email']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
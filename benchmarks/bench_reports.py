@@ -0,0 +1,64 @@
+"""Бенчмарк отчётов: загрузка записей в time_entries с пересчётом сумм и чтение отчёта из time_rollups.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_reports.py --entries 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from db.engine import create_connection, migrate  # noqa: E402
+from db.methods import get_time_rollups, replace_time_entries  # noqa: E402
+from reports import aggregate_rollups, entries_to_rows  # noqa: E402
+
+
+def fake_entries(count, days, projects):
+    now = datetime.now(timezone.utc)
+    for i in range(count):
+        start = now - timedelta(days=random.uniform(0, days))
+        end = start + timedelta(minutes=random.randint(5, 240))
+        yield {'id': f'e{i}', 'projectId': f'p{random.randrange(projects)}', 'description': 'bench',
+               'timeInterval': {'start': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                'end': end.strftime('%Y-%m-%dT%H:%M:%SZ')}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=100_000)
+    parser.add_argument('--days', type=int, default=62)
+    parser.add_argument('--projects', type=int, default=50)
+    parser.add_argument('--reports', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = create_connection(os.path.join(tmp, 'bench.db'))
+        migrate(conn)
+        entries = list(fake_entries(args.entries, args.days, args.projects))
+
+        started = time.perf_counter()
+        rows = entries_to_rows('u1', entries)
+        replace_time_entries(conn, 'u1', '0000', rows)
+        ingest = time.perf_counter() - started
+
+        day_from = (datetime.now() - timedelta(days=31)).strftime('%Y-%m-%d')
+        day_to = datetime.now().strftime('%Y-%m-%d')
+        started = time.perf_counter()
+        for _ in range(args.reports):
+            total, by_project, by_day = aggregate_rollups(get_time_rollups(conn, 'u1', day_from, day_to))
+        report = (time.perf_counter() - started) / args.reports
+        conn.close()
+
+    print(f"entries: {args.entries}")
+    print(f"ingest + rollup rebuild: {ingest * 1000:.0f} ms")
+    print(f"month report from rollups: {report * 1000:.2f} ms "
+          f"({len(by_project)} projects, {len(by_day)} days, total {total // 3600} h)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Бенчмарк холодного старта: импорт модулей бота, подготовка контейнера и первое обновление.
+
+Каждый замер выполняется в новом процессе Python на свежей базе, как после
+перезапуска контейнера. Bot API заменяется сессией из loadtest.py, первое
+обновление — /start от незарегистрированного пользователя (база, FSM, ответ).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_startup.py --runs 5 --output startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'app')
+PHASES = ('import', 'startup', 'first_update', 'total')
+
+
+def child(database: str) -> None:
+    """Один холодный старт; результат — строка JSON в stdout."""
+    started = time.perf_counter()
+    os.environ.update({'TELEGRAM_TOKEN': '42:STARTUP', 'DATABASE': database, 'FSM_STORAGE': 'sqlite',
+                       'LOG_LEVEL': 'WARNING'})
+    os.environ.pop('DATABASE_URL', None)
+    sys.path.insert(0, BENCH_DIR)
+    sys.path.insert(0, APP_DIR)
+
+    import main
+    imported = time.perf_counter()
+
+    from datetime import datetime
+    from aiogram import Bot
+    from aiogram.types import Chat, Message, Update, User
+    from loadtest import FakeTelegramSession
+
+    async def run():
+        container = main.Container(bot=Bot(token=os.environ['TELEGRAM_TOKEN'], session=FakeTelegramSession()))
+        dp = main.create_dispatcher(container)
+        await container.startup()
+        ready = time.perf_counter()
+        user = User(id=1, is_bot=False, first_name='User', username='startup')
+        await dp.feed_update(container.bot, Update(update_id=1, message=Message(
+            message_id=1, date=datetime.now(), text='/start', chat=Chat(id=1, type='private'), from_user=user)))
+        answered = time.perf_counter()
+        await container.close()
+        return ready, answered
+
+    ready, answered = asyncio.run(run())
+    print(json.dumps({'import': imported - started, 'startup': ready - imported,
+                      'first_update': answered - ready, 'total': answered - started}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', os.path.join(tmp, 'bot.db')],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            result['process'] = time.perf_counter() - started
+            runs.append(result)
+    report = {'runs': args.runs, 'python': sys.version.split()[0]}
+    for phase in PHASES + ('process',):
+        values = [run[phase] * 1000 for run in runs]
+        report[phase + '_ms'] = {'median': round(statistics.median(values), 1), 'min': round(min(values), 1),
+                                 'max': round(max(values), 1)}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
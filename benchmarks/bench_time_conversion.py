@@ -0,0 +1,96 @@
+"""Бенчмарк перевода времени: прежний путь через strptime и pytz.localize против time_conversion.
+
+Местное время YYYY-MM-DD HH:MM → UTC-строка Clockify (создание записей, импорт)
+и время Clockify → местная дата (дни в отчётах). Результаты всех вариантов сверяются.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_time_conversion.py --values 100000 --timezone Europe/Berlin
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+import pytz  # noqa: E402
+
+from time_conversion import (CLOCKIFY_TIME_FORMAT, LOCAL_FORMAT, clockify_local_dates, get_timezone,  # noqa: E402
+                             local_strings_to_clockify, local_to_clockify, parse_local)
+
+
+def fake_values(count, days):
+    now = datetime.now().replace(second=0, microsecond=0)
+    return [(now - timedelta(minutes=random.randrange(days * 1440))).strftime(LOCAL_FORMAT) for _ in range(count)]
+
+
+def strptime_to_utc(values, name):
+    # Так переводилось время до time_conversion: пояс, strptime и localize на каждое значение
+    return [pytz.timezone(name).localize(datetime.strptime(value, LOCAL_FORMAT)).astimezone(pytz.utc)
+            .strftime(CLOCKIFY_TIME_FORMAT) for value in values]
+
+
+def fast_to_utc(values, name):
+    tz = get_timezone(name)
+    return [local_to_clockify(parse_local(value), tz) for value in values]
+
+
+def batch_to_utc(values, name):
+    return local_strings_to_clockify(values, get_timezone(name))
+
+
+def fromisoformat_to_dates(values, name):
+    tz = pytz.timezone(name)
+    return [datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(tz).date().isoformat()
+            for value in values]
+
+
+def batch_to_dates(values, name):
+    return clockify_local_dates(values, get_timezone(name))
+
+
+def measure(func, values, name, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(values, name)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(title, variants, values, name, repeat):
+    print(title)
+    baseline = expected = None
+    for label, func in variants:
+        elapsed, result = measure(func, values, name, repeat)
+        if expected is None:
+            baseline, expected = elapsed, result
+        elif result != expected:
+            raise SystemExit(f"{label}: результат отличается от {variants[0][0]}")
+        print(f"  {label:<28} {elapsed * 1000:8.1f} ms  {elapsed / len(values) * 1e9:7.0f} ns/value  "
+              f"x{baseline / elapsed:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--values', type=int, default=100_000)
+    parser.add_argument('--days', type=int, default=62, help='разброс значений по дням (с переходами на летнее время — больше 180)')
+    parser.add_argument('--timezone', default='Europe/Moscow')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(1)
+    local = fake_values(args.values, args.days)
+    print(f"values: {args.values}, days: {args.days}, timezone: {args.timezone}")
+    report("local → Clockify UTC", [('strptime + localize', strptime_to_utc), ('parse_local + local_to_clockify', fast_to_utc),
+                                    ('local_strings_to_clockify', batch_to_utc)], local, args.timezone, args.repeat)
+    utc = batch_to_utc(local, args.timezone)
+    report("Clockify UTC → local date", [('fromisoformat + astimezone', fromisoformat_to_dates),
+                                         ('clockify_local_dates', batch_to_dates)], utc, args.timezone, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Бенчмарк многопроцессного режима: пропускная способность при разном числе обработчиков.
+
+Этот процесс играет роль фронта: поддельные обновления Telegram (диалоги
+/start, /create_time_entry, /start_time_entry и /end_time_entry, как в
+loadtest.py) раскладываются WorkerPool по процессам-обработчикам по Telegram ID.
+Clockify заменяется сервером из fake_clockify.py, Bot API в обработчиках —
+сессией без сети. Для каждого числа обработчиков N берутся новые пользователи.
+
+Результат — JSON с пропускной способностью (обновлений в секунду), ускорением
+относительно первого N, временем отправки очереди outbox и статистикой каждого
+обработчика. Ускорение растёт почти линейно, пока N не превышает числа ядер
+(os.cpu_count() в отчёте): обработка обновления упирается в процессор.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_workers.py --workers 1 2 4 --users 200 --output workers.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'app'))
+
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+from fake_clockify import FakeClockify, user_email, user_id  # noqa: E402
+from loadtest import TG_ID_OFFSET, FakeTelegramSession  # noqa: E402
+
+
+def bench_container():
+    """Контейнер обработчика: Bot API заменён сессией без сети (вызывается в процессе-обработчике)."""
+    from aiogram import Bot
+    from container import Container
+    return Container(bot=Bot(token=os.environ['TELEGRAM_TOKEN'],
+                             session=FakeTelegramSession(float(os.environ.get('BENCH_TELEGRAM_LATENCY', '0')))))
+
+
+def make_updates(fake: FakeClockify, users: range, update_ids) -> List[Update]:
+    """Диалоги пользователей вперемешку, как их доставил бы Telegram; порядок внутри диалога сохраняется."""
+    today = datetime.now().strftime('%Y-%m-%d')
+    dialogs = []
+    for number in users:
+        project = fake.project_for(user_id(number))
+        dialogs.append(['/start', user_email(number), f'key-{number}',
+                        '/create_time_entry', project, 'бенчмарк', today, '09:00', today, '10:00', 'да',
+                        '/start_time_entry', project, 'бенчмарк',
+                        '/end_time_entry'])
+    updates = []
+    for step in itertools.zip_longest(*dialogs):
+        for number, text in zip(users, step):
+            if text is None:
+                continue
+            tg_id = TG_ID_OFFSET + number
+            update_id = next(update_ids)
+            updates.append(Update(update_id=update_id, message=Message(
+                message_id=update_id, date=datetime.now(), text=text, chat=Chat(id=tg_id, type='private'),
+                from_user=User(id=tg_id, is_bot=False, first_name=f'User {number}', username=f'tg{number}'))))
+    return updates
+
+
+async def wait_outbox(repository, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while (await repository.get_outbox_counts()).get('pending'):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def run(args) -> Dict[str, Any]:
+    total_users = args.users * len(args.workers)
+    fake = FakeClockify(total_users, args.projects, max(1, total_users // args.projects), args.latency,
+                        seed=args.seed)
+    fake_runner = await fake.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Настройки читаются при импорте модулей бота, обработчики получают их через окружение
+        os.environ.update({
+            'TELEGRAM_TOKEN': '42:WORKERS',
+            'CLOCKIFY_API_KEY': 'bench',
+            'CLOCKIFY_API_URL': fake.url,
+            'WORKSPACE_ID': 'bench',
+            'DATABASE': os.path.join(tmp, 'workers.db'),
+            'FSM_STORAGE': args.fsm_storage,
+            'LOG_LEVEL': 'WARNING',
+            'WORKER_REPORT_INTERVAL': '0.05',
+            'BENCH_TELEGRAM_LATENCY': str(args.telegram_latency),
+        })
+        os.environ.pop('DATABASE_URL', None)
+        from main import create_dispatcher
+        from workers import WorkerPool
+
+        container = bench_container()
+        await container.startup()
+        await container.user_manager.sync_users(container.clockify_api)
+        report: Dict[str, Any] = {
+            'config': {'workers': args.workers, 'users_per_run': args.users, 'projects': args.projects,
+                       'clockify_latency_s': args.latency, 'telegram_latency_s': args.telegram_latency,
+                       'fsm_storage': args.fsm_storage, 'cpu_count': os.cpu_count()},
+            'runs': [],
+        }
+        update_ids = itertools.count(1)
+        offset = 0
+        try:
+            for size in args.workers:
+                updates = make_updates(fake, range(offset, offset + args.users), update_ids)
+                offset += args.users
+                pool = WorkerPool(size, create_dispatcher, bench_container)
+                pool.start()
+                try:
+                    if not await pool.wait_ready(120):
+                        raise RuntimeError(f"{size} workers did not start")
+                    done_before = (await container.repository.get_outbox_counts()).get('done', 0)
+                    started = time.perf_counter()
+                    for update in updates:
+                        pool.submit(update)
+                    idle = await pool.wait_idle(args.timeout)
+                    elapsed = time.perf_counter() - started
+                    drained = await wait_outbox(container.repository, args.timeout)
+                    drain = time.perf_counter() - started - elapsed
+                    health = pool.health()
+                finally:
+                    await pool.close()
+                counts = await container.repository.get_outbox_counts()
+                throughput = len(updates) / elapsed
+                run_report = {
+                    'workers': size,
+                    'updates': len(updates),
+                    'completed': idle,
+                    'elapsed_s': round(elapsed, 3),
+                    'updates_per_s': round(throughput, 1),
+                    'speedup': round(throughput / report['runs'][0]['updates_per_s'], 2) if report['runs'] else 1.0,
+                    'failed': sum(item['failed'] for item in health),
+                    'outbox_drained': drained,
+                    'outbox_drain_s': round(drain, 3),
+                    'outbox_sent': counts.get('done', 0) - done_before,
+                    'outbox_dead': counts.get('dead', 0),
+                    'per_worker': [{'worker': item['worker'], 'updates': item['processed'],
+                                    'updates_per_s': round(item['processed'] / elapsed, 1),
+                                    'failed': item['failed'], 'restarts': item['restarts']} for item in health],
+                }
+                report['runs'].append(run_report)
+                print(f"workers {size}: {run_report['updates_per_s']} updates/s, speedup {run_report['speedup']}, "
+                      f"failed={run_report['failed']}, outbox sent={run_report['outbox_sent']}", file=sys.stderr)
+            report['clockify'] = fake.stats()
+        finally:
+            await container.close()
+            await fake_runner.cleanup()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=200, help='пользователей в каждом прогоне')
+    parser.add_argument('--projects', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.005, help='задержка ответа Clockify, с')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='задержка ответа Bot API, с')
+    parser.add_argument('--fsm-storage', default='memory', choices=('memory', 'sqlite'))
+    parser.add_argument('--timeout', type=float, default=300.0, help='предельное время одного прогона, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Локальная замена Clockify API для нагрузочных тестов.
+
+Отдаёт пользователей и проекты рабочего пространства (с участниками),
+принимает записи времени. Задержку ответа и долю ответов 429 можно настроить.
+
+Отдельный запуск (бот направляется на него через CLOCKIFY_API_URL=http://127.0.0.1:8090/api/v1):
+    python benchmarks/fake_clockify.py --users 1000 --projects 50 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+API_PREFIX = '/api/v1'
+
+
+def object_id() -> str:
+    """Идентификатор в формате Clockify (24 шестнадцатеричных символа)."""
+    return uuid.uuid4().hex[:24]
+
+
+def user_id(number: int) -> str:
+    return f'{number:024x}'
+
+
+def user_email(number: int) -> str:
+    return f'user{number}@example.com'
+
+
+class FakeClockify:
+    """Состояние и обработчики поддельного Clockify.
+
+    users — число пользователей, projects — число проектов; в каждом проекте
+    members_per_project участников (пользователи распределяются по кругу).
+    latency и jitter задают задержку каждого ответа в секундах, error_rate —
+    долю ответов 429 с заголовком Retry-After.
+    """
+
+    def __init__(self, users: int = 1000, projects: int = 20, members_per_project: int = 100,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, retry_after: float = 0.1,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self.users = [{'id': user_id(i), 'email': user_email(i), 'name': f'User {i}'} for i in range(users)]
+        self.projects = []
+        for p in range(projects):
+            members = [self.users[(p * members_per_project + i) % users]['id']
+                       for i in range(min(members_per_project, users))]
+            self.projects.append({'id': object_id(), 'name': f'Project {p}',
+                                  'memberships': [{'userId': member} for member in members]})
+        self.entries: Dict[str, List[Dict]] = {}
+        self.requests: Counter = Counter()
+        self.throttled = 0
+
+    def project_for(self, clockify_userid: str) -> Optional[str]:
+        """Имя первого проекта, в котором участвует пользователь."""
+        for project in self.projects:
+            if any(m['userId'] == clockify_userid for m in project['memberships']):
+                return project['name']
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {'requests': sum(self.requests.values()), 'throttled': self.throttled,
+                **{f'requests_{key}': value for key, value in sorted(self.requests.items())}}
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else 'unknown'
+        self.requests[f"{request.method} {route.rsplit('/', 1)[-1]}"] += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.throttled += 1
+            return web.json_response({'message': 'Too many requests'}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        return await handler(request)
+
+    @staticmethod
+    def _page(request: web.Request, items: List[Dict]) -> web.Response:
+        page = int(request.query.get('page', '1'))
+        size = int(request.query.get('page-size', '50'))
+        return web.json_response(items[(page - 1) * size:page * size])
+
+    async def get_users(self, request: web.Request) -> web.Response:
+        return self._page(request, self.users)
+
+    async def get_projects(self, request: web.Request) -> web.Response:
+        return self._page(request, self.projects)
+
+    def _running(self, clockify_userid: str) -> Optional[Dict]:
+        for entry in reversed(self.entries.get(clockify_userid, [])):
+            if entry['timeInterval']['end'] is None:
+                return entry
+        return None
+
+    async def get_time_entries(self, request: web.Request) -> web.Response:
+        clockify_userid = request.match_info['user']
+        entries = self.entries.get(clockify_userid, [])
+        if request.query.get('in-progress') == 'true':
+            running = self._running(clockify_userid)
+            return web.json_response([running] if running else [])
+        # Как и Clockify, от новых записей к старым
+        return self._page(request, entries[::-1])
+
+    async def post_time_entry(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if not body.get('start'):
+            return web.json_response({'message': 'start is required'}, status=400)
+        entry = {'id': object_id(), 'description': body.get('description'), 'projectId': body.get('projectId'),
+                 'userId': request.match_info['user'],
+                 'timeInterval': {'start': body['start'], 'end': body.get('end')}}
+        self.entries.setdefault(request.match_info['user'], []).append(entry)
+        return web.json_response(entry, status=201)
+
+    async def patch_time_entry(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        running = self._running(request.match_info['user'])
+        if running is None:
+            return web.json_response({'message': 'No running time entry'}, status=404)
+        running['timeInterval']['end'] = body.get('end') or time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        return web.json_response(running)
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        workspace = API_PREFIX + '/workspaces/{workspace}'
+        app.router.add_get(workspace + '/users', self.get_users)
+        app.router.add_get(workspace + '/projects', self.get_projects)
+        entries = workspace + '/user/{user}/time-entries'
+        app.router.add_get(entries, self.get_time_entries)
+        app.router.add_post(entries, self.post_time_entry)
+        app.router.add_patch(entries, self.patch_time_entry)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> web.AppRunner:
+        """Запуск сервера; при port=0 порт выбирается свободный, адрес API — в self.url."""
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}{API_PREFIX}'
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--projects', type=int, default=20)
+    parser.add_argument('--members', type=int, default=100, help='участников в каждом проекте')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 429')
+    args = parser.parse_args()
+
+    fake = FakeClockify(args.users, args.projects, args.members, args.latency, args.jitter, args.error_rate)
+
+    async def serve():
+        runner = await fake.start(args.host, args.port)
+        print(f"Fake Clockify: {fake.url}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""Нагрузочный тест бота: сквозные сценарии против локальных Clockify и Telegram.
+
+Clockify заменяется сервером из fake_clockify.py, Bot API — сессией aiogram,
+которая запоминает ответы бота вместо отправки. Обновления Telegram подаются
+в диспетчер бота (dp.feed_update) так же, как при polling и webhook.
+
+Для каждого уровня конкурентности N пользователей одновременно проходят
+сценарии /start (регистрация), /create_time_entry, /start_time_entry
+и /end_time_entry. Результат — JSON с p50/p99 времени обработки одного
+обновления и всего диалога, пропускной способностью и числом ошибок.
+После каждого уровня тест ждёт, пока очередь изменений (outbox.py) будет
+отправлена в Clockify, и записывает время этого ожидания.
+
+Запуск из корня репозитория:
+    python benchmarks/loadtest.py --levels 10 100 1000 --latency 0.05 --error-rate 0.01 --output loadtest.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'app'))
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import SendMessage, TelegramMethod  # noqa: E402
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+from fake_clockify import FakeClockify, user_email, user_id  # noqa: E402
+
+# Telegram ID пользователя номер i и его чат
+TG_ID_OFFSET = 100_000
+SCENARIOS = ('/start', '/create_time_entry', '/start_time_entry', '/end_time_entry')
+# Ответ бота, которым успешно заканчивается каждый сценарий
+SUCCESS_REPLIES = {
+    '/start': 'API ключ обновлен',
+    '/create_time_entry': 'успешно создана',
+    '/start_time_entry': 'успешно начата',
+    '/end_time_entry': 'успешно завершена',
+}
+
+
+class FakeTelegramSession(BaseSession):
+    """Сессия Bot API без сети: все сообщения бота сохраняются по чатам."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.replies: Dict[int, List[str]] = defaultdict(list)
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            self.replies[method.chat_id].append(method.text)
+            return Message(message_id=next(self._message_ids), date=datetime.now(), text=method.text,
+                           chat=Chat(id=method.chat_id, type='private'))
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+        yield b''
+
+    async def close(self) -> None:
+        pass
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summary_ms(values: List[float]) -> Dict[str, float]:
+    return {'p50': round(percentile(values, 50) * 1000, 2), 'p99': round(percentile(values, 99) * 1000, 2),
+            'max': round(max(values, default=0.0) * 1000, 2)}
+
+
+class LoadTest:
+    def __init__(self, dp, bot, fake: FakeClockify):
+        self.dp = dp
+        self.bot = bot
+        self.session = bot.session
+        self.fake = fake
+        self._update_ids = itertools.count(1)
+
+    def _update(self, number: int, text: str) -> Update:
+        tg_id = TG_ID_OFFSET + number
+        update_id = next(self._update_ids)
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id, date=datetime.now(), text=text, chat=Chat(id=tg_id, type='private'),
+            from_user=User(id=tg_id, is_bot=False, first_name=f'User {number}', username=f'tg{number}')))
+
+    def _dialog(self, scenario: str, number: int) -> List[str]:
+        today = datetime.now().strftime('%Y-%m-%d')
+        project = self.fake.project_for(user_id(number))
+        if scenario == '/start':
+            return ['/start', user_email(number), f'key-{number}']
+        if scenario == '/create_time_entry':
+            return ['/create_time_entry', project, 'нагрузочный тест', today, '09:00', today, '10:00', 'да']
+        if scenario == '/start_time_entry':
+            return ['/start_time_entry', project, 'нагрузочный тест']
+        return ['/end_time_entry']
+
+    async def _run_dialog(self, scenario: str, number: int) -> Tuple[List[float], float, bool]:
+        """Один диалог пользователя: обновления подаются по очереди, как их отправлял бы человек."""
+        latencies = []
+        replies = self.session.replies[TG_ID_OFFSET + number]
+        replies_before = len(replies)
+        started = time.perf_counter()
+        ok = True
+        for text in self._dialog(scenario, number):
+            update_started = time.perf_counter()
+            try:
+                await self.dp.feed_update(self.bot, self._update(number, text))
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - update_started)
+        # Уведомление о фоновой отправке в Clockify может прийти раньше, чем закончится диалог
+        replied = any(SUCCESS_REPLIES[scenario] in reply for reply in replies[replies_before:])
+        return latencies, time.perf_counter() - started, ok and replied
+
+    async def run_level(self, users: range) -> Dict[str, Any]:
+        scenarios = {}
+        for scenario in SCENARIOS:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(self._run_dialog(scenario, number) for number in users))
+            elapsed = time.perf_counter() - started
+            updates = [latency for latencies, _, _ in results for latency in latencies]
+            scenarios[scenario] = {
+                'dialogs': len(results),
+                'updates': len(updates),
+                'errors': sum(not ok for _, _, ok in results),
+                'elapsed_s': round(elapsed, 3),
+                'updates_per_s': round(len(updates) / elapsed, 1) if elapsed else 0.0,
+                'update_ms': summary_ms(updates),
+                'dialog_ms': summary_ms([duration for _, duration, _ in results]),
+            }
+        return scenarios
+
+
+def configure_environment(args, fake_url: str, tmp: str) -> None:
+    """Настройки бота задаются до импорта его модулей: они читаются при импорте."""
+    os.environ.update({
+        'TELEGRAM_TOKEN': '42:LOADTEST',
+        'CLOCKIFY_API_KEY': 'loadtest',
+        'CLOCKIFY_API_URL': fake_url,
+        'WORKSPACE_ID': 'loadtest',
+        'DATABASE': os.path.join(tmp, 'loadtest.db'),
+        'FSM_STORAGE': args.fsm_storage,
+        'LOG_LEVEL': 'WARNING',
+    })
+    os.environ.pop('DATABASE_URL', None)
+
+
+async def run(args) -> Dict[str, Any]:
+    total_users = sum(args.levels)
+    members = args.members or max(1, math.ceil(total_users / args.projects))
+    fake = FakeClockify(total_users, args.projects, members, args.latency, args.jitter, args.error_rate,
+                        seed=args.seed)
+    fake_runner = await fake.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(args, fake.url, tmp)
+        from aiogram import Bot
+        from container import Container
+        from main import create_dispatcher
+        from outbox import OUTBOX_ENABLED
+
+        container = Container(bot=Bot(token=os.environ['TELEGRAM_TOKEN'],
+                                      session=FakeTelegramSession(args.telegram_latency)))
+        dp = create_dispatcher(container)
+        await container.startup()
+        await container.user_manager.sync_users(container.clockify_api)
+        if OUTBOX_ENABLED:
+            container.outbox.start()
+
+        test = LoadTest(dp, container.bot, fake)
+        report: Dict[str, Any] = {
+            'config': {'levels': args.levels, 'users': total_users, 'projects': args.projects,
+                       'members_per_project': members, 'clockify_latency_s': args.latency,
+                       'clockify_jitter_s': args.jitter, 'clockify_429_rate': args.error_rate,
+                       'telegram_latency_s': args.telegram_latency, 'fsm_storage': args.fsm_storage},
+            'levels': [],
+        }
+        offset = 0
+        try:
+            for level in args.levels:
+                requests_before, throttled_before = sum(fake.requests.values()), fake.throttled
+                result = await test.run_level(range(offset, offset + level))
+                offset += level
+                # Изменения, которые ещё отправляются в Clockify в фоне, относятся к этому уровню
+                drain_started = time.perf_counter()
+                if OUTBOX_ENABLED:
+                    await container.outbox.wait_idle(args.drain_timeout)
+                report['levels'].append({
+                    'concurrency': level,
+                    'scenarios': result,
+                    'outbox_drain_s': round(time.perf_counter() - drain_started, 3),
+                    'clockify_requests': sum(fake.requests.values()) - requests_before,
+                    'clockify_429': fake.throttled - throttled_before,
+                })
+                print(f"concurrency {level}: " + ', '.join(
+                    f"{name} p50={data['update_ms']['p50']}ms p99={data['update_ms']['p99']}ms "
+                    f"errors={data['errors']}" for name, data in result.items()), file=sys.stderr)
+            report['clockify'] = fake.stats()
+            report['clockify_scheduler'] = container.clockify_api.scheduler.stats()
+            report['clockify_coalescer'] = container.clockify_api.coalescer.stats()
+            report['project_cache'] = container.clockify_api.project_cache.stats()
+            if OUTBOX_ENABLED:
+                report['outbox'] = {**container.outbox.stats(), **await container.repository.get_outbox_counts()}
+            report['telegram_requests'] = test.session.requests
+        finally:
+            await container.close()
+            await fake_runner.cleanup()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', type=int, nargs='+', default=[10, 100, 1000],
+                        help='число одновременных пользователей на каждом уровне')
+    parser.add_argument('--projects', type=int, default=20)
+    parser.add_argument('--members', type=int, default=0,
+                        help='участников в проекте (по умолчанию все пользователи распределяются по проектам)')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа Clockify, с')
+    parser.add_argument('--jitter', type=float, default=0.02, help='случайная добавка к задержке Clockify, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов Clockify 429')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='задержка ответа Bot API, с')
+    parser.add_argument('--fsm-storage', default='sqlite', choices=('memory', 'sqlite'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--drain-timeout', type=float, default=120.0,
+                        help='сколько ждать отправки очереди изменений в Clockify после уровня, с')
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
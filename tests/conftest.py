@@ -0,0 +1,23 @@
+import os
+import sys
+
+# Модули бота импортируются так же, как при запуске из app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+import pytest  # noqa: E402
+
+from db.engine import ConnectionPool  # noqa: E402
+from db.repository import SQLiteBackend, UserRepository  # noqa: E402
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    return str(tmp_path / 'bot.db')
+
+
+@pytest.fixture
+def repository(database_path):
+    """Репозиторий на отдельной SQLite-базе теста (схему создаёт сам тест: init_schema асинхронный)."""
+    repo = UserRepository(SQLiteBackend(ConnectionPool(database_path)))
+    yield repo
+    repo.close()
@@ -0,0 +1,47 @@
+"""Сессия Bot API без сети для тестов."""
+import asyncio
+import itertools
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage, TelegramMethod
+from aiogram.types import Chat, Message
+
+
+class FakeTelegramSession(BaseSession):
+    """Сообщения бота сохраняются по чатам вместе со временем отправки.
+
+    on_send(method, attempt) вызывается перед каждой отправкой и может бросить
+    исключение Telegram (например, TelegramRetryAfter) или приостановить отправку.
+    """
+
+    def __init__(self, on_send: Optional[Callable[[SendMessage, int], Any]] = None):
+        super().__init__()
+        self.on_send = on_send
+        self.replies: Dict[int, List[str]] = defaultdict(list)
+        self.sent_at: Dict[int, List[float]] = defaultdict(list)
+        self.attempts: Dict[int, int] = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        if isinstance(method, SendMessage):
+            self.attempts[method.chat_id] += 1
+            if self.on_send is not None:
+                result = self.on_send(method, self.attempts[method.chat_id])
+                if asyncio.iscoroutine(result):
+                    await result
+            self.replies[method.chat_id].append(method.text)
+            self.sent_at[method.chat_id].append(time.monotonic())
+            return Message(message_id=next(self._message_ids), date=datetime.now(), text=method.text,
+                           chat=Chat(id=method.chat_id, type='private'))
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+        yield b''
+
+    async def close(self) -> None:
+        pass
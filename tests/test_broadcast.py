@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from broadcast import SENT, BroadcastManager, Delivery, FanOut
+from fake_telegram import FakeTelegramSession
+
+
+async def deliveries(items):
+    for item in items:
+        yield item
+
+
+def test_retry_after_blocks_bot_and_resends():
+    def on_send(method, attempt):
+        if method.chat_id == 1 and attempt == 1:
+            raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=1)
+
+    async def scenario():
+        session = FakeTelegramSession(on_send)
+        fanout = FanOut(Bot(token='42:TEST', session=session), rate=100, chat_rate=100, concurrency=1)
+        started = time.monotonic()
+        result = await fanout.send_all(deliveries([Delivery('u1', 1, 'hi'), Delivery('u2', 2, 'hi')]))
+        return session, fanout, result, started
+
+    session, fanout, result, started = asyncio.run(scenario())
+    assert result[SENT] == 2
+    assert fanout.retries == 1
+    assert session.replies == {1: ['hi'], 2: ['hi']}
+    # RetryAfter приостанавливает все отправки бота, а не только повтор в этот чат
+    assert min(session.sent_at[1][0], session.sent_at[2][0]) - started >= 0.9
+
+
+def test_retry_after_gives_up_after_max_retries():
+    def on_send(method, attempt):
+        raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=0)
+
+    async def scenario():
+        fanout = FanOut(Bot(token='42:TEST', session=FakeTelegramSession(on_send)), max_retries=2)
+        return await fanout.send(Delivery('u1', 1, 'hi')), fanout
+
+    status, fanout = asyncio.run(scenario())
+    assert status == 'failed'
+    assert fanout.retries == 2
+
+
+def test_messages_to_one_chat_are_spaced_by_chat_rate():
+    async def scenario():
+        session = FakeTelegramSession()
+        fanout = FanOut(Bot(token='42:TEST', session=session), rate=1000, chat_rate=5, concurrency=4)
+        items = [Delivery('u1', 1, str(number)) for number in range(3)] + [Delivery('u2', 2, 'other')]
+        await fanout.send_all(deliveries(items))
+        return session
+
+    session = asyncio.run(scenario())
+    assert sorted(session.replies[1]) == ['0', '1', '2']
+    gaps = [later - earlier for earlier, later in zip(session.sent_at[1], session.sent_at[1][1:])]
+    assert all(gap >= 0.18 for gap in gaps)
+    # Другой чат не ждёт очереди первого
+    assert session.sent_at[2][0] < session.sent_at[1][1]
+
+
+def test_interrupted_broadcast_resumes_without_duplicates(repository):
+    users = [(f'u{number}', f'key{number}', f'tg{number}', f'u{number}@example.com') for number in range(6)]
+
+    async def prepare():
+        await repository.init_schema()
+        await repository.add_users_bulk(users)
+        for number in range(6):
+            await repository.set_user_chat(f'u{number}', 100 + number)
+        return await repository.create_broadcast('news', None, time.time())
+
+    async def interrupted(broadcast_id):
+        hang = asyncio.Event()
+
+        async def on_send(method, attempt):
+            # Бот останавливается, когда третье сообщение ещё отправляется
+            if len(session.replies) == 2:
+                await hang.wait()
+
+        session = FakeTelegramSession(on_send)
+        manager = BroadcastManager(FanOut(Bot(token='42:TEST', session=session), concurrency=1), repository)
+        manager.start(broadcast_id)
+        while len(session.replies) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        # Доставки уже в базе: их не потеряет даже аварийная остановка без close()
+        saved = await repository.get_broadcast_counts(broadcast_id)
+        await manager.close()
+        return session, saved
+
+    async def resumed():
+        session = FakeTelegramSession()
+        manager = BroadcastManager(FanOut(Bot(token='42:TEST', session=session), concurrency=1), repository)
+        assert await manager.resume() == 1
+        await asyncio.gather(*manager._tasks.values())
+        return session
+
+    async def scenario():
+        broadcast_id = await prepare()
+        first, saved = await interrupted(broadcast_id)
+        second = await resumed()
+        return broadcast_id, first, saved, second, await repository.get_broadcast(broadcast_id), \
+            await repository.get_broadcast_counts(broadcast_id)
+
+    broadcast_id, first, saved, second, broadcast, counts = asyncio.run(scenario())
+    assert len(first.replies) == 2
+    assert saved == {SENT: 2}
+    delivered = list(first.replies) + list(second.replies)
+    assert sorted(delivered) == [100 + number for number in range(6)]
+    assert broadcast.status == 'done'
+    assert counts == {SENT: 6}
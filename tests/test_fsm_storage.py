@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from db.engine import ConnectionPool
+from fsm_storage import PersistentStorage, SQLiteFSMBackend, build_key
+
+
+class Form(StatesGroup):
+    project = State()
+    description = State()
+
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+def stored_rows(pool):
+    with pool.connection() as conn:
+        return conn.execute('SELECT key, state, updated_at FROM fsm_states').fetchall()
+
+
+def test_changes_are_written_in_one_delayed_batch(database_path):
+    pool = ConnectionPool(database_path)
+
+    async def scenario():
+        storage = PersistentStorage(SQLiteFSMBackend(pool), flush_interval=0.05)
+        await storage.init()
+        await storage.set_state(KEY, Form.project)
+        await storage.update_data(KEY, {'project': 'Alpha'})
+        await storage.update_data(KEY, {'description': 'review'})
+        before = stored_rows(pool)
+        # Пока изменения не записаны, чтение видит их из памяти
+        state, data = await storage.get_state(KEY), await storage.get_data(KEY)
+        await asyncio.sleep(0.2)
+        after = stored_rows(pool)
+        flushes = storage.flushes
+        await storage.close()
+        return before, state, data, after, flushes
+
+    before, state, data, after, flushes = asyncio.run(scenario())
+    pool.close()
+    assert before == []
+    assert state == Form.project.state
+    assert data == {'project': 'Alpha', 'description': 'review'}
+    assert [(key, state) for key, state, _ in after] == [(build_key(KEY), Form.project.state)]
+    assert flushes == 1
+
+
+def test_state_survives_restart(database_path):
+    async def first_run():
+        pool = ConnectionPool(database_path)
+        storage = PersistentStorage(SQLiteFSMBackend(pool), flush_interval=60)
+        await storage.init()
+        await storage.set_state(KEY, Form.description)
+        await storage.set_data(KEY, {'project': 'Alpha', 'start_date': '2026-10-01'})
+        # Остановка бота записывает изменения, не дожидаясь flush_interval
+        await storage.close()
+        pool.close()
+
+    async def second_run():
+        pool = ConnectionPool(database_path)
+        storage = PersistentStorage(SQLiteFSMBackend(pool))
+        await storage.init()
+        result = await storage.get_state(KEY), await storage.get_data(KEY)
+        await storage.close()
+        pool.close()
+        return result
+
+    asyncio.run(first_run())
+    state, data = asyncio.run(second_run())
+    assert state == Form.description.state
+    assert data == {'project': 'Alpha', 'start_date': '2026-10-01'}
+
+
+def test_clearing_state_deletes_row(database_path):
+    pool = ConnectionPool(database_path)
+
+    async def scenario():
+        storage = PersistentStorage(SQLiteFSMBackend(pool), flush_interval=60)
+        await storage.init()
+        await storage.set_state(KEY, Form.project)
+        await storage.flush()
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.flush()
+        await storage.close()
+
+    asyncio.run(scenario())
+    assert stored_rows(pool) == []
+    pool.close()
+
+
+def test_expired_states_are_absent_and_purged(database_path):
+    pool = ConnectionPool(database_path)
+    other = StorageKey(bot_id=42, chat_id=2, user_id=2)
+
+    async def scenario():
+        storage = PersistentStorage(SQLiteFSMBackend(pool), ttl=60, flush_interval=60)
+        await storage.init()
+        await storage.set_state(KEY, Form.project)
+        await storage.set_data(KEY, {'project': 'Alpha'})
+        await storage.set_state(other, Form.description)
+        await storage.flush()
+        with pool.connection() as conn:
+            with conn:
+                conn.execute('UPDATE fsm_states SET updated_at = ? WHERE key = ?',
+                             (time.time() - 120, build_key(KEY)))
+        # Диалог просрочен, но ещё не удалён очисткой
+        expired = await storage.get_state(KEY), await storage.get_data(KEY)
+        removed = await storage.cleanup()
+        alive = await storage.get_state(other)
+        await storage.close()
+        return expired, removed, alive
+
+    expired, removed, alive = asyncio.run(scenario())
+    assert expired == (None, {})
+    assert removed == 1
+    assert alive == Form.description.state
+    assert [key for key, _, _ in stored_rows(pool)] == [build_key(other)]
+    pool.close()
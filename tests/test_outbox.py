@@ -0,0 +1,160 @@
+import asyncio
+import random
+import time
+
+from outbox import CREATE, DEAD, DONE, PENDING, Outbox
+
+
+class FakeClockifyAPI:
+    """Clockify без сети: вызовы пишутся в журнал, записи с описанием из failing не создаются."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    async def create_time_entry(self, user_api_key, clockify_userid, start_time, end_time, project_id, description):
+        # Случайная задержка: без очереди по пользователю порядок бы перемешался
+        await asyncio.sleep(random.random() * 0.005)
+        self.calls.append((clockify_userid, description))
+        if description in self.failing:
+            raise Exception("Clockify недоступен")
+        return {'id': f'entry-{len(self.calls)}'}
+
+    async def find_time_entries(self, user_api_key, clockify_userid, start, end):
+        return []
+
+
+class FakeFanOut:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, delivery):
+        self.sent.append(delivery)
+        return 'sent'
+
+
+def payload(description):
+    return {'start': '2024-03-05T09:00:00Z', 'end': '2024-03-05T10:00:00Z', 'project_id': 'p1',
+            'description': description, 'summary': f"запись {description}"}
+
+
+def make_outbox(repository, api, **options):
+    options.setdefault('poll_interval', 0.01)
+    return Outbox(repository, api, FakeFanOut(), notify_success=False, **options)
+
+
+async def add_users(repository, *userids):
+    await repository.init_schema()
+    for userid in userids:
+        await repository.add_user(userid, f'key-{userid}', f'tg-{userid}', f'{userid}@example.com')
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not await condition():
+        assert time.monotonic() < deadline, "condition was not met in time"
+        await asyncio.sleep(0.01)
+
+
+async def sent(outbox, count):
+    return outbox.sent >= count
+
+
+def entry_states(repository):
+    """Статус и число попыток записей очереди по описанию."""
+    with repository.backend.pool.connection() as conn:
+        return {row[0]: (row[1], row[2]) for row in conn.execute(
+            "SELECT json_extract(payload, '$.description'), status, attempts FROM outbox")}
+
+
+def test_entries_are_sent_in_order_for_each_user(repository):
+    api = FakeClockifyAPI()
+
+    async def scenario():
+        await add_users(repository, 'u1', 'u2', 'u3')
+        outbox = make_outbox(repository, api)
+        for number in range(10):
+            for userid in ('u1', 'u2', 'u3'):
+                await outbox.enqueue(userid, CREATE, payload(f'{userid}-{number}'), chat_id=1)
+        outbox.start()
+        try:
+            assert await outbox.wait_idle(5)
+        finally:
+            await outbox.close()
+        return await repository.get_outbox_counts()
+
+    counts = asyncio.run(scenario())
+    assert counts == {DONE: 30}
+    for userid in ('u1', 'u2', 'u3'):
+        assert [description for user, description in api.calls if user == userid] == \
+            [f'{userid}-{number}' for number in range(10)]
+
+
+def test_failed_head_blocks_later_entries_of_the_same_user(repository):
+    api = FakeClockifyAPI(failing={'u1-first'})
+
+    async def scenario():
+        await add_users(repository, 'u1', 'u2')
+        # Повтор не раньше чем через минуту: за время теста первая запись u1 остаётся головой очереди
+        outbox = make_outbox(repository, api, retry_delay=60, max_delay=60)
+        await outbox.enqueue('u1', CREATE, payload('u1-first'))
+        await outbox.enqueue('u1', CREATE, payload('u1-second'))
+        await outbox.enqueue('u2', CREATE, payload('u2-first'))
+        outbox.start()
+        try:
+            await wait_for(lambda: sent(outbox, 1))
+            await asyncio.sleep(0.2)
+        finally:
+            await outbox.close()
+
+    asyncio.run(scenario())
+    assert sorted(api.calls) == [('u1', 'u1-first'), ('u2', 'u2-first')]
+    assert entry_states(repository) == {'u1-first': (PENDING, 1), 'u1-second': (PENDING, 0),
+                                        'u2-first': (DONE, 1)}
+
+
+def test_entry_is_dead_after_max_attempts_and_unblocks_the_user(repository):
+    api = FakeClockifyAPI(failing={'u1-first'})
+
+    async def scenario():
+        await add_users(repository, 'u1')
+        outbox = make_outbox(repository, api, max_attempts=3, retry_delay=0.01, max_delay=0.01)
+        await outbox.enqueue('u1', CREATE, payload('u1-first'), chat_id=100)
+        await outbox.enqueue('u1', CREATE, payload('u1-second'), chat_id=100)
+        outbox.start()
+        try:
+            assert await outbox.wait_idle(5)
+        finally:
+            await outbox.close()
+        return outbox, await repository.get_outbox_counts()
+
+    outbox, counts = asyncio.run(scenario())
+    assert api.calls == [('u1', 'u1-first')] * 3 + [('u1', 'u1-second')]
+    assert counts == {DEAD: 1, DONE: 1}
+    assert (outbox.dead, outbox.retries, outbox.sent) == (1, 2, 1)
+    [notice] = outbox.fanout.sent
+    assert notice.chat_id == 100 and "запись u1-first" in notice.text
+
+
+def test_entry_with_expired_lease_is_claimed_again(repository):
+    api = FakeClockifyAPI()
+
+    async def scenario():
+        await add_users(repository, 'u1', 'u2')
+        outbox = make_outbox(repository, api)
+        expired = await outbox.enqueue('u1', CREATE, payload('u1-lost'))
+        leased = await outbox.enqueue('u2', CREATE, payload('u2-leased'))
+        # Другой экземпляр бота захватил обе записи и остановился, не дождавшись ответа Clockify;
+        # срок захвата первой уже истёк, второй — ещё нет
+        assert await repository.claim_outbox_entry(expired, 0, time.time() - 1)
+        assert await repository.claim_outbox_entry(leased, 0, time.time() + 60)
+        outbox.start()
+        try:
+            await wait_for(lambda: sent(outbox, 1))
+            await asyncio.sleep(0.2)
+        finally:
+            await outbox.close()
+
+    asyncio.run(scenario())
+    assert api.calls == [('u1', 'u1-lost')]
+    assert entry_states(repository) == {'u1-lost': (DONE, 2), 'u2-leased': (PENDING, 1)}
@@ -0,0 +1,41 @@
+import asyncio
+import sqlite3
+
+
+def test_writes_from_one_loop_iteration_share_a_transaction(repository):
+    statements = []
+
+    async def scenario():
+        await repository.init_schema()
+        with repository.backend.pool.connection() as conn:
+            conn.set_trace_callback(statements.append)
+        await asyncio.gather(*(repository.add_user(f'u{number}', f'key{number}', f'tg{number}',
+                                                   f'u{number}@example.com') for number in range(20)))
+        return await repository.get_all_clockify_userids()
+
+    userids = asyncio.run(scenario())
+    assert userids == {f'u{number}' for number in range(20)}
+    assert statements.count('COMMIT') == 1
+
+
+def test_failed_write_does_not_undo_the_rest_of_the_batch(repository):
+    async def scenario():
+        await repository.init_schema()
+        await repository.add_user('u1', 'key1', 'tg1', 'u1@example.com')
+        return await asyncio.gather(
+            repository.add_user('u2', 'key2', 'tg2', 'u2@example.com'),
+            # Тот же email: нарушает уникальный индекс
+            repository.add_user('u3', 'key3', 'tg3', 'u1@example.com'),
+            repository.set_user_chat('u2', 200),
+            return_exceptions=True,
+        )
+
+    async def check():
+        return await repository.get_all_clockify_userids(), await repository.get_reminder_targets()
+
+    results = asyncio.run(scenario())
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert not isinstance(results[0], Exception) and not isinstance(results[2], Exception)
+    userids, targets = asyncio.run(check())
+    assert userids == {'u1', 'u2'}
+    assert [target.chat_id for target in targets] == [200]
@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from time_conversion import get_timezone, local_strings_to_clockify
+from time_entry_commands import CreateTimeEntryForm, process_end_time, process_start_time
+
+
+class FakeUserManager:
+    async def get_user_timezone(self, tg_username):
+        return get_timezone('UTC')
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.from_user = SimpleNamespace(username='alice')
+        self.answers = []
+
+    async def answer(self, text, reply_markup=None):
+        self.answers.append((text, reply_markup))
+
+
+def make_state():
+    return FSMContext(MemoryStorage(), StorageKey(bot_id=42, chat_id=1, user_id=1))
+
+
+def test_typed_times_are_normalised_to_clockify_timestamps():
+    async def scenario():
+        state = make_state()
+        await state.update_data(project='Alpha', description='review', start_date='2024-03-05')
+        await process_start_time(FakeMessage(' 9:30 '), state, FakeUserManager())
+        await state.update_data(end_date='2024-03-05')
+        await process_end_time(FakeMessage('１０:15'), state)
+        return await state.get_data(), await state.get_state()
+
+    data, state = asyncio.run(scenario())
+    assert (data['start_time'], data['end_time']) == ('09:30', '10:15')
+    assert state == CreateTimeEntryForm.confirmation.state
+    start, end = local_strings_to_clockify(
+        (f"{data['start_date']} {data['start_time']}", f"{data['end_date']} {data['end_time']}"),
+        get_timezone('UTC'))
+    assert (start, end) == ('2024-03-05T09:30:00Z', '2024-03-05T10:15:00Z')
+
+
+def test_end_time_on_start_day_must_be_after_start():
+    async def scenario():
+        state = make_state()
+        await state.update_data(start_date='2024-03-05', start_time='23:30', end_date='2024-03-05')
+        await state.set_state(CreateTimeEntryForm.end_time)
+        message = FakeMessage('23:00')
+        await process_end_time(message, state)
+        return message.answers, await state.get_data(), await state.get_state()
+
+    answers, data, state = asyncio.run(scenario())
+    assert 'end_time' not in data
+    assert state == CreateTimeEntryForm.end_time.state
+    # Позже 23:30 слотов нет: клавиатура не показывается, время вводится вручную
+    assert answers == [("Время окончания должно быть позже 23:30. Введите время ЧЧ:ММ:", None)]
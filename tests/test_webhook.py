@@ -0,0 +1,98 @@
+import asyncio
+import socket
+from datetime import datetime
+
+import aiohttp
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import Chat, Message, Update, User
+
+import webhook
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'test-secret'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_update(update_id: int, text: str) -> dict:
+    user = User(id=1000 + update_id, is_bot=False, first_name='Test')
+    message = Message(message_id=update_id, date=datetime.now(), text=text,
+                      chat=Chat(id=user.id, type='private'), from_user=user)
+    return Update(update_id=update_id, message=message).model_dump(mode='json', exclude_none=True, by_alias=True)
+
+
+async def send_updates(url: str, updates, secret=None):
+    """Поддельный Telegram: POST каждого обновления, как его отправляет Bot API."""
+    headers = {SECRET_HEADER: secret} if secret is not None else {}
+    async with aiohttp.ClientSession() as session:
+        statuses = []
+        for update in updates:
+            async with session.post(url, json=update, headers=headers) as response:
+                statuses.append(response.status)
+        return statuses
+
+
+def test_webhook_delivers_only_requests_with_secret():
+    async def scenario():
+        received = []
+        dp = Dispatcher()
+
+        @dp.message()
+        async def record(message: Message):
+            received.append(message.text)
+
+        bot = Bot(token='42:TEST')
+        server = WebhookServer(dp, bot, secret=SECRET, workers=2)
+        port = free_port()
+        await server.start('127.0.0.1', port)
+        url = f'http://127.0.0.1:{port}{server.path}'
+        try:
+            missing = await send_updates(url, [make_update(1, 'no secret')])
+            wrong = await send_updates(url, [make_update(2, 'wrong secret')], secret='guess')
+            valid = await send_updates(url, [make_update(3, 'first'), make_update(4, 'second')], secret=SECRET)
+        finally:
+            await server.stop()
+            await bot.session.close()
+        return received, missing, wrong, valid, server.stats()
+
+    received, missing, wrong, valid, stats = asyncio.run(scenario())
+    assert missing == [401]
+    assert wrong == [401]
+    assert valid == [200, 200]
+    assert sorted(received) == ['first', 'second']
+    assert stats['received'] == 2 and stats['rejected'] == 2 and stats['processed'] == 2
+
+
+def test_webhook_server_requires_secret():
+    with pytest.raises(ValueError):
+        WebhookServer(Dispatcher(), Bot(token='42:TEST'), secret='')
+
+
+def test_run_webhook_refuses_to_start_without_secret(monkeypatch):
+    monkeypatch.setattr(webhook, 'WEBHOOK_SECRET', '')
+    monkeypatch.setattr(webhook, 'WEBHOOK_BASE_URL', '')
+    with pytest.raises(RuntimeError):
+        asyncio.run(webhook.run_webhook(Dispatcher(), Bot(token='42:TEST')))
+
+
+def test_run_webhook_registers_generated_secret(monkeypatch):
+    registered = {}
+
+    class FakeBot(Bot):
+        async def set_webhook(self, url, secret_token=None, **kwargs):
+            registered.update(url=url, secret=secret_token)
+            # Вместо сигнала остановки
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(webhook, 'WEBHOOK_SECRET', '')
+    monkeypatch.setattr(webhook, 'WEBHOOK_BASE_URL', 'https://bot.example.com')
+    monkeypatch.setattr(WebhookServer, 'start', lambda self, *args: asyncio.sleep(0))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(webhook.run_webhook(Dispatcher(), FakeBot(token='42:TEST')))
+    assert registered['url'] == 'https://bot.example.com/webhook'
+    assert len(registered['secret']) >= 32
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import random
+from collections import defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+from aiogram.types import Chat, Message, Update, User
+
+from fake_telegram import FakeTelegramSession
+import admin_commands
+from workers import ShardingMiddleware, WorkerPool, shard_key
+
+WORKERS = 3
+USERS = 9
+MESSAGES_PER_USER = 20
+
+
+class FakeContainer:
+    """Контейнер обработчика без базы и Clockify: в журнал пишутся обновления и сброс кэша."""
+
+    def __init__(self):
+        self.bot = Bot(token='42:TEST', session=FakeTelegramSession())
+        self.repository = SimpleNamespace(cache=SimpleNamespace(clear=lambda: log('clear')))
+        self.clockify_api = SimpleNamespace(project_cache=SimpleNamespace(refresh=self._noop))
+        self.outbox = SimpleNamespace(start=lambda: None)
+
+    async def _noop(self):
+        pass
+
+    def register_stats(self, registry):
+        pass
+
+    async def startup(self):
+        pass
+
+    async def close(self):
+        await self.bot.session.close()
+
+
+def log(*fields) -> None:
+    with open(os.path.join(os.environ['WORKER_TEST_LOG'], str(os.getpid())), 'a') as f:
+        f.write(' '.join(map(str, fields)) + '\n')
+
+
+def recording_dispatcher(container) -> Dispatcher:
+    dp = Dispatcher(events_isolation=SimpleEventIsolation())
+
+    @dp.message()
+    async def record(message: Message):
+        # Случайная задержка: без изоляции по пользователю порядок бы перемешался
+        await asyncio.sleep(random.random() * 0.005)
+        log('message', message.from_user.id, message.text)
+
+    return dp
+
+
+def read_log(directory):
+    """Записи журнала по PID процесса-обработчика."""
+    entries = {}
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name)) as f:
+            entries[int(name)] = [line.split() for line in f.read().splitlines()]
+    return entries
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    user = User(id=user_id, is_bot=False, first_name='Test')
+    return Update(update_id=update_id, message=Message(message_id=update_id, date=datetime.now(), text=text,
+                                                       chat=Chat(id=user_id, type='private'), from_user=user))
+
+
+def test_shard_key_prefers_user_then_chat_then_update_id():
+    assert shard_key(make_update(1, 7, 'hi')) == 7
+    channel_post = Update(update_id=2, channel_post=Message(message_id=1, date=datetime.now(), text='post',
+                                                            chat=Chat(id=-100, type='channel')))
+    assert shard_key(channel_post) == -100
+    assert shard_key(Update(update_id=3)) == 3
+
+
+def test_admin_commands_stay_in_the_front(monkeypatch):
+    monkeypatch.setattr(admin_commands, 'ADMIN_IDS', {7})
+    submitted, handled = [], []
+    middleware = ShardingMiddleware(SimpleNamespace(submit=submitted.append), local=admin_commands.is_admin_command)
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+
+    async def scenario():
+        for update in (make_update(1, 7, '/jobs'), make_update(2, 7, '/broadcast_status@bot 3'),
+                       make_update(3, 7, '/start'), make_update(4, 8, '/jobs'), make_update(5, 7, 'jobs')):
+            await middleware(handler, update, {})
+
+    asyncio.run(scenario())
+    assert handled == [1, 2]
+    assert [update.update_id for update in submitted] == [3, 4, 5]
+
+
+def test_updates_are_sharded_by_user_and_processed_in_order(tmp_path, monkeypatch):
+    monkeypatch.setenv('WORKER_TEST_LOG', str(tmp_path))
+    monkeypatch.setenv('OUTBOX_ENABLED', '0')
+
+    async def scenario():
+        pool = WorkerPool(WORKERS, recording_dispatcher, FakeContainer)
+        pool.start()
+        try:
+            assert await pool.wait_ready(60)
+            pids = {item['worker']: item['pid'] for item in pool.health()}
+            routed = {}
+            update_id = 0
+            # Сообщения пользователей вперемешку, как их доставил бы Telegram
+            for number in range(MESSAGES_PER_USER):
+                for user_id in range(1, USERS + 1):
+                    update_id += 1
+                    routed.setdefault(user_id, set()).add(pool.submit(make_update(update_id, user_id, str(number))))
+            assert await pool.wait_idle(60)
+            pool.clear_user_caches()
+        finally:
+            await pool.close()
+        return pids, routed, pool.health()
+
+    pids, routed, health = asyncio.run(scenario())
+    assert routed == {user_id: {user_id % WORKERS} for user_id in range(1, USERS + 1)}
+    assert sum(item['processed'] for item in health) == USERS * MESSAGES_PER_USER
+    assert all(item['failed'] == 0 for item in health)
+
+    entries = read_log(tmp_path)
+    for index, pid in pids.items():
+        texts = defaultdict(list)
+        for entry in entries[pid]:
+            if entry[0] == 'message':
+                texts[int(entry[1])].append(int(entry[2]))
+        # Каждый пользователь обработан только своим процессом и в порядке отправки
+        assert set(texts) == {user_id for user_id in range(1, USERS + 1) if user_id % WORKERS == index}
+        assert all(numbers == list(range(MESSAGES_PER_USER)) for numbers in texts.values())
+        # Команда сброса кэша дошла до каждого обработчика
+        assert entries[pid].count(['clear']) == 1